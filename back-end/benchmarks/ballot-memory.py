@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""Measures how much memory rate-options ballots take up in their JSON representation and in their
+   compact in-memory representation. Usage:
+
+       python3 benchmarks/ballot-memory.py [ballot-count] [candidate-count]"""
+
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from server.persistence.ballots import create_option_table, compact_ballot
+
+
+def create_vote(candidate_count: int):
+    vote = {
+        'id': 'benchmark',
+        'type': {'tally': 'star', 'positions': 1, 'min': 0, 'max': 5},
+        'options': [{'id': f'candidate-{i}', 'name': f'Candidate {i}', 'description': ''} for i in range(candidate_count)]
+    }
+    return {'vote': vote, 'ballots': {}, 'optionTable': create_option_table(vote)}
+
+
+def create_ballots(vote, ballot_count: int):
+    return [
+        {
+            'id': f'{i:064x}',
+            'timestamp': 1600000000.0 + i,
+            'ratingPerOption': [
+                {'optionId': option['id'], 'rating': random.randint(0, 5)}
+                for option in vote['vote']['options']
+            ]
+        }
+        for i in range(ballot_count)
+    ]
+
+
+def measure(create):
+    """Measures the number of bytes allocated by `create()` that are still live afterwards."""
+    tracemalloc.start()
+    result = create()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    ballot_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    candidate_count = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    vote = create_vote(candidate_count)
+
+    ballots, json_size = measure(lambda: create_ballots(vote, ballot_count))
+    _, compact_size = measure(lambda: [compact_ballot(ballot, vote) for ballot in ballots])
+
+    print(f'{ballot_count} ballots, {candidate_count} candidates')
+    print(f'  JSON representation:    {json_size / 2 ** 20:8.2f} MiB ({json_size / ballot_count:7.0f} bytes/ballot)')
+    print(f'  compact representation: {compact_size / 2 ** 20:8.2f} MiB ({compact_size / ballot_count:7.0f} bytes/ballot)')
+    print(f'  savings:                {json_size / compact_size:8.1f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""Measures how long it takes to load device indexes of various sizes at startup and how much
+   memory loading them takes at its peak. Every user has several devices and a tenth of the devices
+   have expired. Usage:
+
+       python3 benchmarks/device-index.py [devices-per-user] [device-count...]"""
+
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from server.persistence.authentication import read_device_index
+from server.persistence.helpers import write_json
+from server.persistence.storage import JsonDeviceStorage
+
+
+def create_device_index(device_count: int, devices_per_user: int):
+    """Creates a synthetic device index in its JSON representation."""
+    now = time.time()
+    devices = {}
+    for i in range(device_count):
+        device_id = f'{i:032x}'
+        devices[device_id] = {
+            'id': device_id,
+            'user': f'user-{i // devices_per_user}',
+            'expiry': now - 60 if i % 10 == 0 else now + 60 * 60 * 24 * 30,
+            'info': {
+                'deviceId': device_id,
+                'persistentId': f'{i:016x}',
+                'description': {'visitorId': f'{i:016x}'}
+            }
+        }
+
+    return {
+        'devices': devices,
+        'permissions': {'vote': {'cast': [f'user-{i}' for i in range(0, device_count // devices_per_user, 7)]}},
+        'admins': ['user-0'],
+        'developers': [],
+        'registered-voters': [f'user-{i}' for i in range(0, device_count // devices_per_user, 2)]
+    }
+
+
+def measure(load):
+    """Runs `load()` and reports how long it took. Runs it again with allocations traced and
+       reports the peak number of bytes allocated while it ran, as well as the number of bytes
+       taken up by its result."""
+    gc.collect()
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak, retained
+
+
+def main():
+    devices_per_user = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    device_counts = [int(arg) for arg in sys.argv[2:]] or [10000, 100000, 1000000]
+
+    data_dir = tempfile.mkdtemp()
+    try:
+        print(f'{devices_per_user} devices per user')
+        for device_count in device_counts:
+            storage = JsonDeviceStorage(os.path.join(data_dir, f'device-index-{device_count}.json'))
+            write_json(create_device_index(device_count, devices_per_user), storage.path)
+
+            parse_time, parse_peak, parse_retained = measure(storage.read)
+            load_time, load_peak, load_retained = measure(lambda: read_device_index(storage, []))
+            storage.committer.stop()
+
+            print(f'  {device_count:8} devices:')
+            print(f'    parse JSON:   {parse_time:8.3f} s, {parse_peak / 2 ** 20:8.1f} MiB peak, {parse_retained / 2 ** 20:8.1f} MiB retained')
+            print(f'    load index:   {load_time:8.3f} s, {load_peak / 2 ** 20:8.1f} MiB peak, {load_retained / 2 ** 20:8.1f} MiB retained')
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""Compares tallying large STV and SPSV elections inline, on the thread that handles the request,
+   with tallying them in the tally pool. Reports how long a request handler is blocked and how
+   long it takes until all results are in. Usage:
+
+       python3 benchmarks/tally-workers.py [election-count] [ballot-count] [workers]"""
+
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from server.persistence.ballots import create_option_table, compact_ballot
+from server.tally.outcomes import tally
+from server.tally.workers import TallyPool
+
+
+def create_vote(vote_id: str, algorithm: str, ballot_count: int, candidate_count: int = 20):
+    """Creates a closed election with random ballots, in its in-memory representation."""
+    header = {
+        'id': vote_id,
+        'type': {'tally': algorithm, 'positions': 5, 'min': 0, 'max': 5},
+        'options': [{'id': f'candidate-{i}', 'name': f'Candidate {i}', 'description': ''} for i in range(candidate_count)],
+        'resigned': ['candidate-0']
+    }
+    vote = {'vote': header, 'ballots': {}, 'optionTable': create_option_table(header), 'revision': 0}
+
+    option_ids = [option['id'] for option in header['options']]
+    for i in range(ballot_count):
+        if algorithm == 'stv':
+            ballot = {'optionRanking': random.sample(option_ids, random.randint(1, candidate_count))}
+        else:
+            ballot = {'ratingPerOption': [{'optionId': x, 'rating': random.randint(0, 5)} for x in option_ids]}
+
+        ballot = compact_ballot({**ballot, 'id': f'{i:064x}', 'timestamp': 0}, vote)
+        vote['ballots'][ballot['id']] = ballot
+    return vote
+
+
+def benchmark_inline(votes):
+    """Tallies every vote on the calling thread. Returns the time a handler blocks per vote and
+       the total time."""
+    start = time.perf_counter()
+    for vote in votes:
+        tally(vote)
+    total = time.perf_counter() - start
+    return total / len(votes), total
+
+
+def benchmark_pool(votes, pool: TallyPool):
+    """Submits every vote to the pool. Returns the time a handler blocks per vote and the time
+       until all outcomes are in."""
+    remaining = threading.Semaphore(0)
+    start = time.perf_counter()
+    for vote in votes:
+        pool.submit(vote['vote']['id'], vote, lambda _: remaining.release())
+    blocking = time.perf_counter() - start
+
+    for _ in votes:
+        remaining.acquire()
+    return blocking / len(votes), time.perf_counter() - start
+
+
+def main():
+    election_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    ballot_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+    random.seed(42)
+    algorithms = ['stv', 'spsv']
+    votes = [
+        create_vote(f'election-{i}', algorithms[i % len(algorithms)], ballot_count)
+        for i in range(election_count)
+    ]
+
+    pool = TallyPool(workers)
+    start = time.perf_counter()
+    benchmark_pool([create_vote(f'warm-up-{algorithm}', algorithm, 10) for algorithm in algorithms], pool)
+    startup = time.perf_counter() - start
+
+    inline_blocking, inline_total = benchmark_inline(votes)
+    pool_blocking, pool_total = benchmark_pool(votes, pool)
+    pool.stop()
+
+    print(f'{election_count} elections (STV and SPSV), {ballot_count} ballots each, {workers} workers')
+    print(f'  pool start-up:  {startup:8.3f} s')
+    print(f'  inline:         {inline_blocking * 1000:8.1f} ms blocked per request, {inline_total:8.3f} s in total')
+    print(f'  pool:           {pool_blocking * 1000:8.1f} ms blocked per request, {pool_total:8.3f} s in total')
+    print(f'  throughput:     {election_count / inline_total:8.2f} -> {election_count / pool_total:.2f} elections/s')
+
+
+if __name__ == "__main__":
+    main()
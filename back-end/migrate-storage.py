@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+"""Converts a data directory from one storage backend to another. Usage:
+
+       python3 migrate-storage.py <data-directory> <source-kind> <target-kind>
+
+   where the kinds are 'json' or 'sqlite'. Stop the server before migrating and set the config's
+   "storage" option to the target kind afterwards."""
+
+import sys
+from server.persistence.commit import GroupCommitter
+from server.persistence.migrate import migrate_votes, migrate_devices
+from server.persistence.storage import open_storage
+
+
+def main():
+    """The script's entry point."""
+    if len(sys.argv) != 4:
+        print(__doc__)
+        sys.exit(1)
+
+    data_path, source_kind, target_kind = sys.argv[1:]
+    if source_kind == target_kind:
+        print('Source and target storage are the same; nothing to do.')
+        return
+
+    committer = GroupCommitter(fsync_policy='always')
+    source_votes, source_devices = open_storage(source_kind, data_path, committer)
+    target_votes, target_devices = open_storage(target_kind, data_path, committer)
+
+    migrate_devices(source_devices, target_devices)
+    migrate_votes(source_votes, target_votes)
+    committer.stop()
+
+    print(f'Migrated {data_path} from {source_kind} to {target_kind} storage.')
+
+
+if __name__ == "__main__":
+    main()
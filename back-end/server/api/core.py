@@ -2,10 +2,11 @@
 
 """Implements the core APIs, which handle authentication and basic functionality that all citizens can access."""
 
-from flask import Blueprint, abort, jsonify, request
+from flask import Blueprint, Response, abort, jsonify, request
 from ..persistence.authentication import DeviceIndex, RegisteredDevice, Permission, UserId
+from ..persistence.responses import SerializedResponse
 from ..persistence.votes import VoteIndex
-from typing import Dict, List
+from typing import Dict, FrozenSet, List, Optional
 
 _default_permissions: Dict[str, Permission] = {}
 
@@ -19,29 +20,36 @@ def authenticate(req, device_index: DeviceIndex, permission: Permission=None) ->
         device_id = json_data.get('deviceId')
 
     device = device_index.devices.get(device_id)
+    if device is not None and not device.is_alive():
+        # The device has expired, but has not been reaped yet.
+        device = None
 
     if permission is not None \
-        and permission not in get_user_permissions(device.user_id, device_index):
+        and (device is None or permission not in get_user_permissions(device.user_id, device_index)):
         return None
     else:
         return device
     
-def get_user_permissions(user_id: UserId, device_index: DeviceIndex) -> List[Permission]:
-    found_perms = []
+def get_user_permissions(user_id: UserId, device_index: DeviceIndex) -> FrozenSet[Permission]:
+    """Gets the set of permissions a user has. Permission sets are cached by the device index."""
+    # The cache is replaced rather than cleared when permissions change, so a permission set that
+    # is computed while they change never ends up in the new cache.
+    cache = device_index.permission_cache
+    found_perms = cache.get(user_id)
+    if found_perms is not None:
+        return found_perms
 
-    for perm in device_index.permissions:
-        if perm(user_id, device_index):
-            found_perms.append(perm)
+    found_perms = set(perm for perm in device_index.permissions if perm(user_id, device_index))
 
     if user_id in device_index.developers:
-        found_perms.extend(_default_permissions['authenticated-developer'])
+        found_perms.update(_default_permissions['authenticated-developer'])
 
     if user_id in device_index.admins:
-        found_perms.extend(_default_permissions['authenticated-admin'])
+        found_perms.update(_default_permissions['authenticated-admin'])
 
-    found_perms.extend(_default_permissions['authenticated'])
+    found_perms.update(_default_permissions['authenticated'])
 
-    found_perms = list(set(found_perms))
+    found_perms = cache[user_id] = frozenset(found_perms)
     return found_perms
 
 """Gets the authentication level of a request, based on the role system."""
@@ -67,6 +75,35 @@ def get_json_arg(req, key: str, nullable=False):
             abort(400)
 
 
+def is_count(value) -> bool:
+    """Tells if a request argument is a non-negative integer."""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def send_serialized(req, response: SerializedResponse, etag: str) -> Response:
+    """Sends a serialized JSON response, compressed with gzip if the client accepts it."""
+    if req.accept_encodings['gzip']:
+        result = Response(response.gzipped(), mimetype='application/json')
+        result.headers['Content-Encoding'] = 'gzip'
+    else:
+        result = Response(response.data, mimetype='application/json')
+
+    result.vary.add('Accept-Encoding')
+    result.set_etag(etag)
+    return result
+
+
+def not_modified(req, etag: str) -> Optional[Response]:
+    """Answers a request with 304 Not Modified if the client's copy of a response is current.
+       Read-only APIs are requested with POST, so this is checked for POST requests, too."""
+    if not req.if_none_match.contains(etag):
+        return None
+
+    result = Response(status=304)
+    result.set_etag(etag)
+    return result
+
+
 def create_core_blueprint(device_index: DeviceIndex, vote_index: VoteIndex, default_permissions: Dict[str, Dict[str, Dict[str, List[UserId]]]]):
     """Creates a blueprint for the core API."""
     bp = Blueprint('core', __name__)
@@ -77,6 +114,7 @@ def create_core_blueprint(device_index: DeviceIndex, vote_index: VoteIndex, defa
                 _default_permissions[user_group] = [Permission(scope, permission) for permission in default_permissions[user_group][scope]]
             else:
                 _default_permissions[user_group].extend([Permission(scope, permission) for permission in default_permissions[user_group][scope]])
+    device_index.invalidate_permissions()
 
     @bp.route('/active-votes', methods=['POST'])
     def get_active_votes():
@@ -85,7 +123,19 @@ def create_core_blueprint(device_index: DeviceIndex, vote_index: VoteIndex, defa
         if not device:
             abort(403)
 
-        return jsonify(vote_index.get_active_votes(device))
+        # Clients that pass the `version` of an earlier response as `since` only get the changes.
+        since = get_json_arg(request, 'since', nullable=True)
+        if since is not None:
+            if not is_count(since):
+                abort(400)
+            return jsonify(vote_index.get_active_vote_changes(device, since))
+
+        etag = vote_index.get_active_votes_etag(device)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+
+        return send_serialized(request, vote_index.get_serialized_active_votes(device), etag)
 
     @bp.route('/all-votes', methods=['POST'])
     def get_all_votes():
@@ -94,7 +144,12 @@ def create_core_blueprint(device_index: DeviceIndex, vote_index: VoteIndex, defa
         if not device:
             abort(403)
 
-        return jsonify([vote['vote'] for vote in vote_index.votes.values()])
+        etag = vote_index.get_all_votes_etag()
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+
+        return send_serialized(request, vote_index.get_serialized_all_votes(), etag)
 
     @bp.route('/vote', methods=['POST'])
     def get_vote():
@@ -103,11 +158,59 @@ def create_core_blueprint(device_index: DeviceIndex, vote_index: VoteIndex, defa
         if not device:
             abort(403)
 
-        vote_data = vote_index.get_vote(get_json_arg(request, 'voteId'), device)
-        if vote_data is None:
+        # Large votes are paged through with `offset` and `limit`, which count ballots.
+        offset = get_json_arg(request, 'offset', nullable=True) or 0
+        limit = get_json_arg(request, 'limit', nullable=True)
+        if not is_count(offset) or (limit is not None and not is_count(limit)):
+            abort(400)
+
+        vote_id = get_json_arg(request, 'voteId')
+        try:
+            etag = vote_index.get_vote_etag(vote_id, device)
+            if offset != 0 or limit is not None:
+                etag = f'{etag}/{offset}-{limit}'
+
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return cached
+
+            if offset == 0 and limit is None:
+                serialized = vote_index.get_serialized_vote(vote_id, device)
+                if serialized is not None:
+                    return send_serialized(request, serialized, etag)
+
+            chunks = vote_index.stream_vote(vote_id, device, offset, limit)
+        except KeyError:
             abort(404)
-        else:
-            return jsonify(vote_data)
+
+        result = Response(chunks, mimetype='application/json')
+        result.set_etag(etag)
+        return result
+
+    @bp.route('/vote-results', methods=['POST'])
+    def get_vote_results():
+        """Tallies a vote whose deadline has passed."""
+        device = authenticate(request, device_index, permission=Permission.VOTE_VIEW)
+        if not device:
+            abort(403)
+
+        try:
+            return jsonify(vote_index.get_results(get_json_arg(request, 'voteId')))
+        except KeyError:
+            abort(404)
+
+    @bp.route('/tally-job', methods=['POST'])
+    def get_tally_job():
+        """Reports the status of a tally that runs in the background."""
+        device = authenticate(request, device_index, permission=Permission.VOTE_VIEW)
+        if not device:
+            abort(403)
+
+        status = vote_index.get_tally_job(get_json_arg(request, 'jobId'))
+        if status is None:
+            abort(404)
+
+        return jsonify(status)
 
     @bp.route('/cast-ballot', methods=['POST'])
     def cast_ballot():
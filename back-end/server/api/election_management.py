@@ -24,6 +24,19 @@ def create_election_management_blueprint(device_index: DeviceIndex, vote_index:
         vote_id = get_json_arg(request, 'voteId')
         return jsonify(vote_index.get_suspicious_ballots_report(vote_id))
 
+    @bp.route('/live-tally', methods=['POST'])
+    def live_tally():
+        """Gets the current standings of an open vote."""
+        device = authenticate(request, device_index, permission=Permission.ELECTION_VIEW_LIVE_TALLY)
+        if not device:
+            abort(403)
+
+        vote_id = get_json_arg(request, 'voteId')
+        try:
+            return jsonify(vote_index.get_live_tally(vote_id))
+        except KeyError:
+            abort(404)
+
     @bp.route('/create-vote', methods=['POST'])
     def create_vote():
         """Creates a new vote."""
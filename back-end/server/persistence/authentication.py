@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import heapq
+import threading
 import time
 from datetime import date
 from collections import defaultdict
-from pathlib import Path
-from typing import Dict, Set, List, Optional, Any
-from .helpers import read_json, write_json, send_to_log
+from typing import Callable, Dict, FrozenSet, Set, List, Optional, Tuple, Any
+from .helpers import send_to_log
+from .scheduler import DeadlineScheduler
+from .storage import DeviceStorage
 
 DeviceId = str
 UserId = str
@@ -16,6 +19,17 @@ VoterRequirement = Any
 # This is kept to provide backward compatibility with older configs, so the server does not bug out after an upgrade.
 SECONDS_UNTIL_EXPIRY = 60 * 60 * 24 * 30
 
+# Expiry timestamps below this value were stored before expiry timestamps became wall-clock
+# timestamps. They were taken from `time.monotonic()`, which counts the seconds since boot.
+LEGACY_EXPIRY_CUTOFF = 10 ** 9
+
+# The number of seconds between sweeps of the device reaper, which unregisters expired devices.
+DEVICE_REAPER_INTERVAL = 60
+
+# The maximal number of expired devices the reaper evicts at a time. The device index is locked
+# while a batch is evicted, so logins only wait for a single batch rather than an entire sweep.
+DEVICE_REAPER_BATCH_SIZE = 1000
+
 OPERATORS = {
     '>=': lambda x, y: x >= y,
     '<=': lambda x, y: x <= y,
@@ -40,6 +54,7 @@ PERMISSIONS = {
         'edit',
         'cancel',
         'view-suspicious-ballots',
+        'view-live-tally',
     ],
     'usermanagement': [
         'view',
@@ -49,12 +64,16 @@ PERMISSIONS = {
     'administration': [
         'edit-permissions',
         'upgrade-server',
+        'view-metrics',
     ]
 }
 
 class RegisteredDevice(object):
     """A class that represents a device ID registered with a particular user."""
 
+    # Device indexes can hold millions of devices, so devices do without an attribute dictionary.
+    __slots__ = ('device_id', 'device_info', 'user_id', 'expiry')
+
     def __init__(self, device_id: DeviceId, device_info: DeviceInfo, user_id: UserId, expiry: float):
         self.device_id = device_id
         self.device_info = device_info
@@ -79,7 +98,7 @@ class RegisteredDevice(object):
 
     def is_alive(self) -> bool:
         """Tests if this registered device has not yet expired."""
-        return self.expiry >= time.monotonic()
+        return self.expiry >= time.time()
 
     def to_json(self) -> Any:
         """Creates a JSON representation of this device ID."""
@@ -102,55 +121,101 @@ class DeviceIndex(object):
             developers: Set[UserId],
             registered_voters: Set[UserId],
             voter_requirements: List[VoterRequirement],
-            persistence_path: str):
+            storage: DeviceStorage):
 
-        self.persistence_path = persistence_path
+        self.storage = storage
         self.devices = devices
         self.permissions = permissions
         self.admins = admins
         self.developers = developers
         self.registered_voters = registered_voters
         self.voter_requirements = voter_requirements    
+
+        # A min-heap of (expiry, device ID) pairs. Entries of devices that were unregistered or
+        # registered again are left in the heap and skipped when they are popped.
+        self.expiry_queue: List[Tuple[float, DeviceId]] = []
+
+        # Index the devices by user and by expiry in a single pass.
         self.users_to_devices = defaultdict(set)
-        self.users_to_devices.update({
-            user_id: set(device for device in devices.values() if device.user_id == user_id)
-            for user_id in set(data.user_id for data in devices.values())
-        })
+        for device_id, device in devices.items():
+            self.users_to_devices[device.user_id].add(device)
+            self.expiry_queue.append((device.expiry, device_id))
+        heapq.heapify(self.expiry_queue)
+
+        # Guards changes to the registered devices.
+        self.lock = threading.RLock()
+
+        # Functions that are called with every newly registered device.
+        self.registration_listeners: List[Callable[[RegisteredDevice], None]] = []
+        self.reaper: Optional[DeadlineScheduler] = None
+
+        # Metrics.
+        self.reaped_count = 0
+        self.sweep_count = 0
+        self.last_sweep_seconds = 0.0
+
+        # Maps users to the set of permissions they have, including the permissions their user
+        # group has by default. Filled on demand and replaced wholesale whenever permissions,
+        # users, admins or developers change.
+        self.permission_cache: Dict[UserId, FrozenSet[Any]] = {}
+
+    def invalidate_permissions(self):
+        """Drops all cached permission sets. Must be called after permissions, users, admins or
+           developers change."""
+        self.permission_cache = {}
 
     def register(self, device_id: DeviceId, user_id: UserId, device_info: DeviceInfo, expiry: float = SECONDS_UNTIL_EXPIRY) -> RegisteredDevice:
         """Adds a new device to this device index."""
-        self.unregister(device_id, persist_changes=False)
+        with self.lock:
+            self.unregister(device_id, persist_changes=False)
+
+            device = RegisteredDevice(device_id, device_info, user_id, time.time() + expiry)
+            self.devices[device_id] = device
+            self.users_to_devices[user_id].add(device)
+            heapq.heappush(self.expiry_queue, (device.expiry, device_id))
+            self.register_user(user_id, persist_changes=False)
 
-        device = RegisteredDevice(device_id, device_info, user_id, time.monotonic() + expiry)
-        self.devices[device_id] = device
-        self.users_to_devices[user_id].add(device)
-        self.register_user(user_id, persist_changes=False)
+            self.storage.save_device(self, device)
+            self.storage.save_registered_voter(self, user_id)
 
-        write_device_index(self, self.persistence_path)
+        for listener in self.registration_listeners:
+            listener(device)
 
         return device
 
+    def add_registration_listener(self, listener: Callable[[RegisteredDevice], None]):
+        """Has `listener` called with every device that is registered from now on. Listeners run
+           on the thread that registers the device, after the device index's lock is released."""
+        self.registration_listeners.append(listener)
+
     def register_user(self, user_id: UserId, persist_changes: bool = True):
         """Adds a new user to the device index, but does not add an associated device."""
-        self.registered_voters.add(user_id)
+        # Every login registers its user, so the permission cache is only dropped for new users.
+        if user_id not in self.registered_voters:
+            self.registered_voters.add(user_id)
+            self.invalidate_permissions()
 
         if persist_changes:
-            write_device_index(self, self.persistence_path)
+            self.storage.save_registered_voter(self, user_id)
 
     def unregister_user(self, user_id: UserId, persist_changes: bool = True):
         """Removes a user from the device index. Removes any associated devices."""
-        self.registered_voters.remove(user_id)
-        for device in self.users_to_devices[user_id]:
-            try:
-                del self.devices[device.device_id]
-            except KeyError:
-                send_to_log(f'Attempted to delete nonexistent device {device.device_id}', 'authentication')
-                raise
-
-        del self.users_to_devices[user_id]
+        with self.lock:
+            self.registered_voters.remove(user_id)
+            for device in self.users_to_devices[user_id]:
+                try:
+                    del self.devices[device.device_id]
+                except KeyError:
+                    send_to_log(f'Attempted to delete nonexistent device {device.device_id}', 'authentication')
+                    raise
+
+            devices = self.users_to_devices.pop(user_id, set())
+            self.invalidate_permissions()
 
-        if persist_changes:
-            write_device_index(self, self.persistence_path)
+            if persist_changes:
+                for device in devices:
+                    self.storage.delete_device(self, device.device_id)
+                self.storage.delete_registered_voter(self, user_id)
 
     def check_requirements(self, redditor) -> list:
         """Tests if a Redditor is eligible to vote."""
@@ -172,37 +237,138 @@ class DeviceIndex(object):
 
     def unregister(self, device_id: DeviceId, persist_changes: bool = True) -> bool:
         """Unregisters a device, if it was registered."""
-        if device_id in self.devices:
-            device = self.devices[device_id]
-            del self.devices[device_id]
-            self.users_to_devices[device.user_id].remove(device)
+        with self.lock:
+            if device_id in self.devices:
+                self.remove_device(self.devices[device_id])
 
-            if persist_changes:
-                write_device_index(self, self.persistence_path)
+                if persist_changes:
+                    self.storage.delete_device(self, device_id)
 
-            return True
-        else:
-            return False
+                return True
+            else:
+                return False
+
+    def remove_device(self, device: RegisteredDevice):
+        """Removes a device from the index without persisting the change. Must be called with
+           the lock held."""
+        del self.devices[device.device_id]
+        user_devices = self.users_to_devices[device.user_id]
+        user_devices.discard(device)
+        if not user_devices:
+            del self.users_to_devices[device.user_id]
+
+    def start_reaper(self, interval: float = DEVICE_REAPER_INTERVAL):
+        """Starts unregistering expired devices on a background thread, every `interval`
+           seconds."""
+        if self.reaper is None:
+            self.reaper = DeadlineScheduler('device-reaper')
+            self.reaper.schedule(time.time(), self.sweep, interval)
+
+    def stop_reaper(self):
+        """Stops the background thread that unregisters expired devices."""
+        if self.reaper is not None:
+            self.reaper.stop()
+            self.reaper = None
+
+    def sweep(self, interval: float):
+        """Unregisters expired devices and schedules the next sweep. Runs on the reaper's
+           thread."""
+        reaper = self.reaper
+        if reaper is not None:
+            reaper.schedule(time.time() + interval, self.sweep, interval)
+        self.reap_expired_devices()
+
+    def reap_expired_devices(self, now: Optional[float] = None) -> int:
+        """Unregisters all devices that have expired by `now`, in batches of at most
+           `DEVICE_REAPER_BATCH_SIZE` devices. The evicted devices are persisted at once, after the
+           last batch. Returns the number of devices that were unregistered."""
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+
+        reaped: List[DeviceId] = []
+        while True:
+            with self.lock:
+                batch = self.pop_expired_devices(now, DEVICE_REAPER_BATCH_SIZE)
+            if not batch:
+                break
+            reaped.extend(batch)
+
+        with self.lock:
+            # Drop the heap entries of unregistered and re-registered devices once they make up
+            # the better part of the heap.
+            if len(self.expiry_queue) > 2 * len(self.devices) + DEVICE_REAPER_BATCH_SIZE:
+                self.expiry_queue = [(device.expiry, device_id) for device_id, device in self.devices.items()]
+                heapq.heapify(self.expiry_queue)
+
+        if reaped:
+            self.storage.delete_devices(self, reaped)
+
+        self.reaped_count += len(reaped)
+        self.sweep_count += 1
+        self.last_sweep_seconds = time.perf_counter() - start
+        return len(reaped)
+
+    def pop_expired_devices(self, now: float, limit: int) -> List[DeviceId]:
+        """Removes up to `limit` devices that have expired by `now` from the index, without
+           persisting the change. Must be called with the lock held."""
+        expired = []
+        while self.expiry_queue and self.expiry_queue[0][0] < now and len(expired) < limit:
+            expiry, device_id = heapq.heappop(self.expiry_queue)
+            device = self.devices.get(device_id)
+            if device is not None and device.expiry == expiry:
+                self.remove_device(device)
+                expired.append(device_id)
+        return expired
+
+    def metrics(self) -> Dict[str, Any]:
+        """Reports statistics on registered and reaped devices."""
+        return {
+            'liveDevices': len(self.devices),
+            'reapedDevices': self.reaped_count,
+            'sweeps': self.sweep_count,
+            'lastSweepSeconds': self.last_sweep_seconds,
+            'queuedExpiries': len(self.expiry_queue)
+        }
         
     def add_permission(self, permission, user_id: UserId, persist_changes: bool = True):
         """Adds a permission to a user."""
-        self.permissions[permission].add(user_id)
+        self.permissions.setdefault(permission, set()).add(user_id)
+        self.invalidate_permissions()
 
         if persist_changes:
-            write_device_index(self, self.persistence_path)
+            self.storage.save_permission(self, permission, user_id)
 
     def remove_permission(self, permission, user_id: UserId, persist_changes: bool = True) -> bool:
         """Removes a permission from a user."""
-        if permission(user_id):
+        if permission(user_id, self):
             self.permissions[permission].remove(user_id)
+            self.invalidate_permissions()
 
             if persist_changes:
-                write_device_index(self, self.persistence_path)
+                self.storage.delete_permission(self, permission, user_id)
         
             return True
         else:
             return False
-        
+
+    def to_json(self) -> Any:
+        """Creates a JSON representation of this device index."""
+        # Copy the devices first; they may be changed by other threads while the index is written.
+        permissions = {}
+        for permission, user_ids in dict(self.permissions).items():
+            permissions.setdefault(permission.scope, {})[permission.permission] = list(sorted(user_ids))
+
+        return {
+            'devices': {
+                device_id: device.to_json()
+                for device_id, device in dict(self.devices).items()
+            },
+            'permissions': permissions,
+            'admins': list(sorted(self.admins)),
+            'developers': list(sorted(self.developers)),
+            'registered-voters': list(sorted(self.registered_voters))
+        }
+
 
 class Permission(object):
     """A permission that can be granted to a user. Valid permissions are pre-defined in the PERMISSIONS constant."""
@@ -216,6 +382,7 @@ class Permission(object):
     ELECTION_EDIT = None
     ELECTION_CANCEL = None
     ELECTION_VIEW_SUSPICIOUS_BALLOTS = None
+    ELECTION_VIEW_LIVE_TALLY = None
 
     # Related to users themselves
     USERMANAGEMENT_VIEW = None
@@ -225,6 +392,7 @@ class Permission(object):
     # Related to the server and highly sensitive actions
     ADMINISTRATION_EDIT_PERMISSIONS = None
     ADMINISTRATION_UPGRADE_SERVER = None
+    ADMINISTRATION_VIEW_METRICS = None
 
     def check_permission_validity(scope: str, permission: str):
         return permission in PERMISSIONS.get(scope, {})
@@ -258,25 +426,44 @@ Permission.ELECTION_CREATE = Permission('election', 'create')
 Permission.ELECTION_EDIT = Permission('election', 'edit')
 Permission.ELECTION_CANCEL = Permission('election', 'cancel')
 Permission.ELECTION_VIEW_SUSPICIOUS_BALLOTS = Permission('election', 'view-suspicious-ballots')
+Permission.ELECTION_VIEW_LIVE_TALLY = Permission('election', 'view-live-tally')
 Permission.USERMANAGEMENT_VIEW = Permission('usermanagement', 'view')
 Permission.USERMANAGEMENT_ADD = Permission('usermanagement', 'add')
 Permission.USERMANAGEMENT_REMOVE = Permission('usermanagement', 'remove')
 Permission.ADMINISTRATION_EDIT_PERMISSIONS = Permission('administration', 'edit-permissions')
 Permission.ADMINISTRATION_UPGRADE_SERVER = Permission('administration', 'upgrade-server')
+Permission.ADMINISTRATION_VIEW_METRICS = Permission('administration', 'view-metrics')
 
 
-def read_device_index(path: str, voter_requirements: List[VoterRequirement]) -> DeviceIndex:
-    """Reads the device index from a file."""
+def to_wall_clock_expiry(expiry: float) -> float:
+    """Converts an expiry timestamp that was read from storage to a wall-clock timestamp. Legacy
+       timestamps, taken from `time.monotonic()`, are only meaningful if the machine has not been
+       rebooted since; their remaining lifetime is capped at `SECONDS_UNTIL_EXPIRY`."""
+    if expiry >= LEGACY_EXPIRY_CUTOFF:
+        return expiry
+
+    remaining = min(max(expiry - time.monotonic(), 0), SECONDS_UNTIL_EXPIRY)
+    return time.time() + remaining
 
-    # Read devices from JSON.
-    data = read_json(path)
-    devices = {
-        device_id: RegisteredDevice(device_id, info.get('info'), info['user'], info['expiry'])
-        for device_id, info in data['devices'].items()
-    }
 
-    # Discard devices that are no longer valid.
-    devices = { device_id: device for device_id, device in devices.items() if device.is_alive() }
+def read_device_index(storage: DeviceStorage, voter_requirements: List[VoterRequirement]) -> Optional[DeviceIndex]:
+    """Reads the device index from storage. Returns None if there is no device index yet."""
+
+    # Read devices from JSON.
+    data = storage.read()
+    if data is None:
+        return None
+
+    # Build the devices in a single pass, discarding devices that are no longer valid. Users with
+    # a device are registered voters.
+    now = time.time()
+    devices = {}
+    voters = set(data.get('registered-voters', []))
+    for device_id, info in data['devices'].items():
+        expiry = to_wall_clock_expiry(info['expiry'])
+        if expiry >= now:
+            devices[device_id] = RegisteredDevice(device_id, info.get('info'), info['user'], expiry)
+            voters.add(info['user'])
 
     # Read permissions from JSON.
     permissions = {}
@@ -286,7 +473,6 @@ def read_device_index(path: str, voter_requirements: List[VoterRequirement]) ->
             if Permission.check_permission_validity(scope, permission):
                 permissions[Permission(scope, permission)] = set(scopes[scope][permission])
 
-    voters = set(data.get('registered-voters', [])).union(info.user_id for info in devices.values())
     admins = set(data.get('admins', []))
     developers = set(data.get('developers', []))
                     
@@ -298,28 +484,12 @@ def read_device_index(path: str, voter_requirements: List[VoterRequirement]) ->
         developers,
         voters,
         voter_requirements,
-        path)
-
-
-def read_or_create_device_index(path: str, voter_requirements: List[VoterRequirement]) -> DeviceIndex:
-    """Reads the device index from a file or creates a fresh index if there is no such file."""
-    try:
-        return read_device_index(path, voter_requirements)
-    except FileNotFoundError:
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
-        return DeviceIndex({}, {}, set(), set(), set(), voter_requirements, path)
-
-
-def write_device_index(index: DeviceIndex, path: str):
-    """Writes the device index to a file."""
-    data = {
-        device_id: device.to_json()
-        for device_id, device in index.devices.items()
-    }
-    to_write = {
-        'devices': data,
-        'admins': list(sorted(index.admins)),
-        'developers': list(sorted(index.developers)),
-        'registered-voters': list(sorted(index.registered_voters))
-    }
-    write_json(to_write, path)
+        storage)
+
+
+def read_or_create_device_index(storage: DeviceStorage, voter_requirements: List[VoterRequirement]) -> DeviceIndex:
+    """Reads the device index from storage or creates a fresh index if there is none yet."""
+    index = read_device_index(storage, voter_requirements)
+    if index is None:
+        index = DeviceIndex({}, {}, set(), set(), set(), voter_requirements, storage)
+    return index
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""Compact in-memory representations of ballots.
+
+   Rate-options ballots are sent over the wire as a list of `{'optionId', 'rating'}` objects. In
+   memory and on disk, they are stored as an array of ratings instead. Positions in that array refer
+   to the vote's option table: a list of option IDs shared by all ballots cast in the vote. Options
+   are only ever appended to the option table. An option that is removed from a vote keeps its slot,
+   and an option that is added again gets a new one.
+
+   The length of the option table is the version of the vote's option set. Every ballot records the
+   version it was cast against, so changes to a vote's options never touch its ballots. Instead,
+   ballots are resolved against the vote's current options when they are read: options added after
+   a ballot was cast get the minimal rating, and choose-one ballots for a removed option no longer
+   count."""
+
+import itertools
+from array import array
+from typing import Any, Dict, Iterator, List, Optional
+
+OptionId = str
+Vote = Any
+VoteAndBallots = Any
+Ballot = Any
+
+# Array type codes that may hold ratings, from smallest to largest. Ratings are stored using the
+# smallest type that fits the vote's rating range.
+RATING_TYPECODES = ['b', 'h', 'i', 'q']
+
+
+def get_rating_typecode(ballot_type: Any) -> str:
+    """Picks an array type code that can hold all ratings for a type of rate-options ballot."""
+    for typecode in RATING_TYPECODES:
+        bound = 2 ** (array(typecode).itemsize * 8 - 1)
+        if -bound <= ballot_type['min'] and ballot_type['max'] < bound:
+            return typecode
+    raise ValueError(f'Rating range {ballot_type["min"]}..{ballot_type["max"]} is too large.')
+
+
+def fit_ratings(ratings: List[int], ballot_type: Any) -> array:
+    """Packs ratings into an array that can hold them as well as any other rating in the vote's
+       rating range. Raises a TypeError if the ratings are not integers."""
+    low = min([ballot_type['min'], *ratings])
+    high = max([ballot_type['max'], *ratings])
+    return array(get_rating_typecode({'min': low, 'max': high}), ratings)
+
+
+def create_option_table(vote: Vote) -> List[OptionId]:
+    """Creates an option table for a new vote."""
+    return [option['id'] for option in vote['options']]
+
+
+def get_option_slots(option_table: List[OptionId]) -> Dict[OptionId, int]:
+    """Maps option IDs to their current slot in an option table."""
+    return {option_id: slot for slot, option_id in enumerate(option_table)}
+
+
+def compact_ballot(ballot: Ballot, vote: VoteAndBallots) -> Ballot:
+    """Turns a ballot as it is received from a client into its in-memory representation, cast
+       against the vote's current option set. Options a rate-options ballot does not rate are given
+       the minimal rating. Raises a TypeError if the ballot's ratings are not integers."""
+    result = {key: value for key, value in ballot.items() if key != 'ratingPerOption'}
+    result['optionVersion'] = len(vote['optionTable'])
+    if 'ratingPerOption' not in ballot:
+        return result
+
+    ballot_type = vote['vote']['type']
+    slots = get_option_slots(vote['optionTable'])
+    ratings = [ballot_type['min']] * len(vote['optionTable'])
+    for entry in ballot['ratingPerOption']:
+        slot = slots.get(entry['optionId'])
+        if slot is not None:
+            ratings[slot] = entry['rating']
+
+    result['ratings'] = fit_ratings(ratings, ballot_type)
+    return result
+
+
+class OptionResolver(object):
+    """Resolves ballots against a vote's current options."""
+
+    def __init__(self, vote: VoteAndBallots):
+        self.ballot_type = vote['vote']['type']
+        self.options = [option['id'] for option in vote['vote']['options']]
+        self.slots = get_option_slots(vote['optionTable'])
+        self.current_options = set(self.options)
+
+    def is_counted(self, ballot: Ballot) -> bool:
+        """Tells if a ballot still counts. Choose-one ballots stop counting once the option they
+           selected is removed, even if it is added again later."""
+        if 'selectedOptionId' not in ballot:
+            return True
+
+        option_id = ballot['selectedOptionId']
+        slot = self.slots.get(option_id)
+        if slot is None:
+            # The option has never been part of the vote.
+            return True
+
+        return option_id in self.current_options and slot < ballot['optionVersion']
+
+    def get_ratings(self, ballot: Ballot) -> List[int]:
+        """Gets a rate-options ballot's ratings for the vote's current options, in order."""
+        ratings = ballot['ratings']
+        version = len(ratings)
+        minimum = self.ballot_type['min']
+        slots = self.slots
+        return [
+            ratings[slot] if slot < version else minimum
+            for slot in (slots[option_id] for option_id in self.options)
+        ]
+
+    def expand(self, ballot: Ballot) -> Optional[Ballot]:
+        """Turns a ballot's in-memory representation into the representation that is sent to
+           clients. Returns None if the ballot no longer counts."""
+        if not self.is_counted(ballot):
+            return None
+
+        result = {key: value for key, value in ballot.items() if key != 'ratings' and key != 'optionVersion'}
+        if 'ratings' in ballot:
+            result['ratingPerOption'] = [
+                {'optionId': option_id, 'rating': rating}
+                for option_id, rating in zip(self.options, self.get_ratings(ballot))
+            ]
+        return result
+
+
+def expand_ballot(ballot: Ballot, vote: VoteAndBallots) -> Optional[Ballot]:
+    """Turns a ballot's in-memory representation into the representation that is sent to clients.
+       Returns None if the ballot no longer counts."""
+    return OptionResolver(vote).expand(ballot)
+
+
+def expand_ballots(vote: VoteAndBallots, offset: int = 0, limit: Optional[int] = None) -> Iterator[Ballot]:
+    """Expands a vote's ballots one at a time, in the order in which they were cast. Ballots that
+       no longer count are skipped. `offset` and `limit` select a page of the ballots that count."""
+    resolver = OptionResolver(vote)
+    expanded = (resolver.expand(ballot) for ballot in vote['ballots'].values())
+    counted = (ballot for ballot in expanded if ballot is not None)
+    return itertools.islice(counted, offset, None if limit is None else offset + limit)
+
+
+def expand_vote(vote: VoteAndBallots, offset: int = 0, limit: Optional[int] = None) -> VoteAndBallots:
+    """Turns a vote's in-memory representation into the representation that is sent to clients.
+       Ballots are listed in the order in which they were cast."""
+    return {'vote': vote['vote'], 'ballots': list(expand_ballots(vote, offset, limit))}
+
+
+def ballot_to_json(ballot: Ballot) -> Ballot:
+    """Turns a ballot's in-memory representation into the representation that is stored on disk."""
+    if 'ratings' not in ballot:
+        return ballot
+
+    return {**ballot, 'ratings': ballot['ratings'].tolist()}
+
+
+def ballot_from_json(ballot: Ballot, vote: VoteAndBallots) -> Ballot:
+    """Turns a ballot that was stored on disk into its in-memory representation. Ballots that were
+       stored before ratings were compacted are compacted as they are read, and ballots that were
+       stored before option sets were versioned are taken to be cast against the current one."""
+    if 'ratings' in ballot:
+        return {
+            'optionVersion': len(ballot['ratings']),
+            **ballot,
+            'ratings': fit_ratings(ballot['ratings'], vote['vote']['type'])
+        }
+    elif 'ratingPerOption' in ballot:
+        return compact_ballot(ballot, vote)
+    else:
+        return {'optionVersion': len(vote['optionTable']), **ballot}
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class PinnedLRUCache(object):
+    """A cache that keeps pinned entries resident and evicts the least recently used unpinned
+       entries once their total size exceeds a budget. Entries that are not resident are loaded
+       on first access. Sizes are estimates in bytes, supplied by the loader and by `unpin`.
+
+       Entries are loaded without holding the cache's lock, so a slow load does not hold up
+       accesses to other entries. Threads that miss the same entry while it is being loaded wait
+       for that load rather than start their own."""
+
+    def __init__(self, loader: Callable[[Hashable], Tuple[Any, int]], budget: int):
+        self.loader = loader
+        self.budget = budget
+        self.pinned: Dict[Hashable, Any] = {}
+        self.entries: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self.size = 0
+        self.lock = threading.RLock()
+
+        # The loads in progress. A load is dropped from here if its entry is replaced or
+        # discarded while it runs, so the stale value it produces is not inserted.
+        self.loading: Dict[Hashable, Future] = {}
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self.lock:
+            if key in self.pinned:
+                return self.pinned[key]
+            elif key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+
+            load = self.loading.get(key)
+            if load is not None:
+                waiting = True
+            else:
+                waiting = False
+                load = self.loading[key] = Future()
+
+        if waiting:
+            return load.result()
+
+        try:
+            value, size = self.loader(key)
+        except BaseException as e:
+            with self.lock:
+                if self.loading.get(key) is load:
+                    del self.loading[key]
+            load.set_exception(e)
+            raise
+
+        with self.lock:
+            if self.loading.get(key) is load:
+                del self.loading[key]
+                self.insert(key, value, size)
+        load.set_result(value)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        """Adds a pinned entry to the cache."""
+        with self.lock:
+            self.discard(key)
+            self.pinned[key] = value
+
+    def __delitem__(self, key: Hashable):
+        with self.lock:
+            if not self.discard(key):
+                raise KeyError(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Tests if an entry is resident in the cache."""
+        with self.lock:
+            return key in self.pinned or key in self.entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def unpin(self, key: Hashable, size: int):
+        """Turns a pinned entry into an ordinary entry that may be evicted."""
+        with self.lock:
+            value = self.pinned.pop(key)
+            self.insert(key, value, size)
+
+    def insert(self, key: Hashable, value: Any, size: int):
+        """Inserts an unpinned entry and evicts entries until the cache fits its budget again. The
+           entry that was just inserted is never evicted right away."""
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.budget and len(self.entries) > 1:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def discard(self, key: Hashable) -> bool:
+        """Removes an entry from the cache, if it is resident. A load of the entry that is in
+           progress is not inserted when it completes."""
+        self.loading.pop(key, None)
+        if key in self.pinned:
+            del self.pinned[key]
+            return True
+        elif key in self.entries:
+            _, size = self.entries.pop(key)
+            self.size -= size
+            return True
+        else:
+            return False
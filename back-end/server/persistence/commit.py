@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Set
+from .helpers import send_to_log
+
+# Valid fsync policies:
+#   * 'always' writes and fsyncs every change before the request that made it completes.
+#   * 'batched' coalesces changes into periodic group commits and fsyncs once per commit.
+#   * 'off' coalesces changes like 'batched' but leaves flushing to the operating system.
+FSYNC_POLICIES = ['always', 'batched', 'off']
+
+DEFAULT_FSYNC_POLICY = 'batched'
+
+# The default number of seconds between group commits.
+DEFAULT_COMMIT_INTERVAL = 1.0
+
+
+def fsync_path(path: str):
+    """Flushes a file's contents to disk."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupCommitter(object):
+    """Coalesces writes to disk into periodic group commits on a background thread.
+
+       Callers mark state as dirty by handing the committer a key and a function that writes
+       that state to disk. If the same key is marked dirty more than once between commits, only
+       the most recent write function runs."""
+
+    def __init__(self, interval: float = DEFAULT_COMMIT_INTERVAL, fsync_policy: str = DEFAULT_FSYNC_POLICY):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f'Invalid fsync policy: {fsync_policy}')
+
+        self.interval = interval
+        self.fsync_policy = fsync_policy
+        self.dirty: Dict[Hashable, Callable[[], None]] = {}
+        self.unsynced_paths: Set[str] = set()
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+        # Metrics.
+        self.commit_count = 0
+        self.write_count = 0
+        self.coalesced_count = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+        if self.fsync_policy != 'always':
+            self.thread = threading.Thread(target=self.run, name='group-committer', daemon=True)
+            self.thread.start()
+
+    @property
+    def fsync_writes(self) -> bool:
+        """Tells if files should be fsynced when they are written."""
+        return self.fsync_policy != 'off'
+
+    def mark_dirty(self, key: Hashable, write: Callable[[], None]):
+        """Schedules `write` to run at the next group commit, replacing any write that was
+           scheduled for `key` earlier. Under the 'always' policy, `write` runs right away."""
+        if self.fsync_policy == 'always':
+            self.run_writes({key: write})
+            return
+
+        with self.lock:
+            if key in self.dirty:
+                self.coalesced_count += 1
+            self.dirty[key] = write
+
+    def write_now(self, key: Hashable, write: Callable[[], None]):
+        """Runs `write` right away, replacing any write that was scheduled for `key`. Like group
+           commits, it runs under the commit lock, so it never overlaps other writes."""
+        with self.lock:
+            if self.dirty.pop(key, None) is not None:
+                self.coalesced_count += 1
+
+        self.run_writes({key: write})
+
+    def appended(self, path: str):
+        """Notes that a record was appended to the file at `path`. Depending on the fsync policy,
+           the file is synced right away or at the next group commit."""
+        if self.fsync_policy == 'always':
+            fsync_path(path)
+        elif self.fsync_policy == 'batched':
+            with self.lock:
+                self.unsynced_paths.add(path)
+
+    def flush(self):
+        """Performs a group commit right away."""
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            unsynced_paths, self.unsynced_paths = self.unsynced_paths, set()
+
+        for path in unsynced_paths:
+            fsync_path(path)
+
+        self.run_writes(dirty)
+
+    def run_writes(self, writes: Dict[Hashable, Callable[[], None]]):
+        """Runs a batch of writes and records how long they took."""
+        if not writes:
+            return
+
+        with self.commit_lock:
+            start = time.perf_counter()
+            for key, write in writes.items():
+                try:
+                    write()
+                except Exception as e:
+                    send_to_log(f'Failed to write {key} to disk: {e}', name='persistence')
+
+            elapsed = time.perf_counter() - start
+            self.commit_count += 1
+            self.write_count += len(writes)
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self.total_flush_seconds += elapsed
+
+    def stop(self):
+        """Stops the background thread after a final group commit."""
+        self.stopped = True
+        self.wakeup.set()
+        self.flush()
+
+    def stop_at_exit(self):
+        """Performs a final group commit when the process exits, so changes made since the last
+           group commit are not lost. SIGTERM is turned into a regular exit, which would
+           otherwise end the process without running exit handlers."""
+        atexit.register(self.stop)
+        if threading.current_thread() is threading.main_thread() \
+                and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    def run(self):
+        """Performs group commits at regular intervals."""
+        while not self.stopped:
+            self.wakeup.wait(self.interval)
+            if not self.stopped:
+                self.flush()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Reports statistics on group commits."""
+        with self.lock:
+            pending_writes = len(self.dirty)
+
+        return {
+            'fsyncPolicy': self.fsync_policy,
+            'commits': self.commit_count,
+            'writes': self.write_count,
+            'coalescedWrites': self.coalesced_count,
+            'pendingWrites': pending_writes,
+            'lastFlushSeconds': self.last_flush_seconds,
+            'maxFlushSeconds': self.max_flush_seconds,
+            'meanFlushSeconds': self.total_flush_seconds / self.commit_count if self.commit_count else 0.0
+        }
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""Broadcasts changes to votes as server-sent events. Every subscriber has a bounded queue of
+   messages. Publishing never blocks: subscribers whose queue is full are disconnected instead, and
+   are expected to reconnect and catch up by syncing the active votes."""
+
+import json
+import queue
+import threading
+from typing import Any, Optional, Set
+
+# The maximal number of messages that can be queued for a subscriber.
+MAX_QUEUED_EVENTS = 256
+
+# The maximal number of subscribers. Every subscriber ties up a server thread.
+MAX_SUBSCRIBERS = 1000
+
+# The number of seconds between keep-alive messages. They keep proxies from closing idle
+# connections and let the server notice subscribers that have gone away.
+KEEP_ALIVE_SECONDS = 15
+
+# The number of milliseconds clients wait before they reconnect.
+RECONNECT_MILLISECONDS = 5000
+
+
+def format_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Formats an event as a server-sent event message."""
+    message = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+    return message if event_id is None else f'id: {event_id}\n{message}'
+
+
+class Subscription(object):
+    """A subscriber's queue of messages."""
+
+    def __init__(self, max_queued: int = MAX_QUEUED_EVENTS):
+        self.queue: 'queue.Queue[str]' = queue.Queue(max_queued)
+        self.closed = False
+
+    def get(self, timeout: float) -> Optional[str]:
+        """Waits for the next message. Returns None if there is none within `timeout` seconds or
+           if the subscription was closed."""
+        if self.closed:
+            return None
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroadcaster(object):
+    """Sends events to all subscribers."""
+
+    def __init__(self, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self.subscribers: Set[Subscription] = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self) -> Optional[Subscription]:
+        """Adds a subscriber. Returns None if there are too many subscribers already."""
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+
+            subscription = Subscription()
+            self.subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Removes a subscriber."""
+        with self.lock:
+            subscription.closed = True
+            self.subscribers.discard(subscription)
+
+    def publish(self, event: str, data: Any, event_id: Optional[int] = None):
+        """Sends an event to all subscribers. The event is serialized once. Subscribers that have
+           fallen too far behind are disconnected."""
+        message = format_event(event, data, event_id)
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                self.unsubscribe(subscription)
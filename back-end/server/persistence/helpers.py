@@ -2,6 +2,7 @@
 
 import os
 import json
+import tempfile
 from datetime import datetime
 
 log_name = f"actions-{datetime.now().strftime('%d%m%Y %H-%M-%S')}.log"
@@ -12,9 +13,70 @@ def read_json(path):
         return json.load(f)
 
 
-def write_json(data, path):
-    with open(path, 'w') as f:
-        return json.dump(data, f, indent=4)
+def write_json(data, path, fsync=False):
+    """Writes `data` to a temporary file and then moves it over the file at `path`, so a crash
+       never leaves a truncated file behind. Every write has a temporary file of its own, so
+       concurrent writes to the same path cannot move each other's files away."""
+    directory, name = os.path.split(os.fspath(path))
+    with tempfile.NamedTemporaryFile('w', dir=directory or '.', prefix=f'{name}.', suffix='.tmp', delete=False) as f:
+        temp_path = f.name
+        try:
+            json.dump(data, f, indent=4)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.remove(temp_path)
+            raise
+
+    os.replace(temp_path, path)
+
+
+def append_json_line(data, path):
+    """Appends `data` to the file at `path` as a single line of compact JSON."""
+    with open(path, 'a') as f:
+        f.write(json.dumps(data, separators=(',', ':')) + '\n')
+
+
+def read_json_lines(path):
+    """Reads a file of newline-delimited JSON records. A truncated final line, which may be left
+       behind by a crash in the middle of an append, is ignored."""
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            records.append(json.loads(line))
+    return records
+
+
+def repair_json_lines(path):
+    """Cuts a truncated final line, left behind by a crash in the middle of an append, off a file
+       of newline-delimited JSON records. Records appended afterwards would otherwise be glued
+       onto the truncated line and become unreadable themselves."""
+    try:
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+
+            # Scan backwards for the last newline.
+            end = size
+            while end > 0:
+                start = max(end - 4096, 0)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+
+            if end < size:
+                f.truncate(end)
+    except FileNotFoundError:
+        pass
 
 
 def send_to_log(string, name, level='ERROR'):
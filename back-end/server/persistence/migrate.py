@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+from .authentication import read_device_index
+from .storage import VoteStorage, DeviceStorage
+
+
+def migrate_votes(source: VoteStorage, target: VoteStorage):
+    """Copies all votes, their ballots, secrets, summaries and suspicious ballot reports from
+       one vote storage to another."""
+    vote_secrets = source.read_index()
+    if vote_secrets is None:
+        return
+
+    summaries = source.read_summaries() or {}
+    for vote_id in vote_secrets:
+        vote, _ = source.read_vote(vote_id)
+        target.write_vote(vote_id, vote)
+        summaries.setdefault(vote_id, vote['vote'])
+
+    target.write_summaries({vote_id: summaries[vote_id] for vote_id in vote_secrets})
+    target.write_suspicious_ballots(source.read_suspicious_ballots())
+    target.write_index(vote_secrets)
+
+
+def migrate_devices(source: DeviceStorage, target: DeviceStorage):
+    """Copies the device index from one device storage to another. Expired devices are dropped."""
+    index = read_device_index(source, [])
+    if index is not None:
+        target.save_all(index)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""Caches API responses in their serialized form. Votes and vote listings are requested far more
+   often than they change, so their JSON is kept around as bytes, along with a gzip-compressed
+   variant, until the data they were serialized from changes."""
+
+import gzip
+import json
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, DefaultDict, Hashable, List, Optional
+
+# The default number of bytes' worth of serialized responses to keep in memory.
+DEFAULT_RESPONSE_CACHE_BUDGET = 16 * 1024 * 1024
+
+
+def serialize(value: Any) -> bytes:
+    """Serializes a value as compact JSON."""
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+class SerializedResponse(object):
+    """A JSON response body. Its gzip-compressed variant is created when it is first needed."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.compressed: Optional[bytes] = None
+
+    def gzipped(self) -> bytes:
+        """Gets the response body, compressed with gzip."""
+        if self.compressed is None:
+            self.compressed = gzip.compress(self.data, mtime=0)
+        return self.compressed
+
+    def splice(self, key: str, value: Any) -> 'SerializedResponse':
+        """Creates a copy of a response that is a JSON object with an extra field. The response
+           itself is not re-serialized."""
+        return SerializedResponse(self.data[:-1] + b',' + serialize(key) + b':' + serialize(value) + b'}')
+
+
+def join_responses(responses: List[SerializedResponse]) -> SerializedResponse:
+    """Joins serialized responses into a serialized list."""
+    return SerializedResponse(b'[' + b','.join(response.data for response in responses) + b']')
+
+
+class ResponseCache(object):
+    """Caches serialized responses, evicting the least recently used ones once their total size
+       exceeds a budget. Every key has a generation that is bumped when the key is invalidated; a
+       response is only cached if its key was not invalidated while the response was being
+       serialized, so responses serialized from stale data never make it into the cache."""
+
+    def __init__(self, budget: int = DEFAULT_RESPONSE_CACHE_BUDGET):
+        self.budget = budget
+        self.entries: 'OrderedDict[Hashable, SerializedResponse]' = OrderedDict()
+        self.size = 0
+        self.generations: DefaultDict[Hashable, int] = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, create: Callable[[], SerializedResponse]) -> SerializedResponse:
+        """Gets the response cached under `key`. Creates and caches it if there is none."""
+        with self.lock:
+            response = self.entries.get(key)
+            if response is not None:
+                self.entries.move_to_end(key)
+                return response
+            generation = self.generations[key]
+
+        response = create()
+        with self.lock:
+            if self.generations[key] == generation:
+                self.discard(key)
+                self.entries[key] = response
+                self.size += len(response.data)
+                while self.size > self.budget and len(self.entries) > 1:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted.data)
+        return response
+
+    def get_json(self, key: Hashable, create: Callable[[], Any]) -> SerializedResponse:
+        """Gets the response cached under `key`. Creates, serializes and caches it if there is none."""
+        return self.get(key, lambda: SerializedResponse(serialize(create())))
+
+    def invalidate(self, *keys: Hashable):
+        """Drops the responses cached under `keys`. Must be called after the data they were
+           serialized from has changed."""
+        with self.lock:
+            for key in keys:
+                self.generations[key] += 1
+                self.discard(key)
+
+    def discard(self, key: Hashable):
+        """Drops the response cached under `key`, if there is one. Must be called with the lock
+           held."""
+        response = self.entries.pop(key, None)
+        if response is not None:
+            self.size -= len(response.data)
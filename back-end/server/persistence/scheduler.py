@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+from .helpers import send_to_log
+
+# The maximal amount of time the scheduler sleeps before it re-checks the wall clock. This keeps
+# deadlines reasonably accurate when the system clock is adjusted while the scheduler waits.
+MAX_SLEEP_SECONDS = 60
+
+
+class DeadlineScheduler(object):
+    """Runs callbacks on a background thread once their deadlines pass. Deadlines are wall-clock
+       timestamps, as produced by `clock`. A scheduler created with `background=False` has no
+       thread; its callbacks run when `run_due` is called, which lets tests control time."""
+
+    def __init__(self, name: str = 'deadline-scheduler', clock: Callable[[], float] = time.time, background: bool = True):
+        self.name = name
+        self.clock = clock
+        self.queue: List[Tuple[float, int, Callable, Tuple[Any, ...]]] = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+            self.thread.start()
+
+    def schedule(self, deadline: float, callback: Callable, *args):
+        """Schedules `callback(*args)` to run once `deadline` has passed."""
+        with self.condition:
+            heapq.heappush(self.queue, (deadline, next(self.counter), callback, args))
+            self.condition.notify()
+
+    def stop(self):
+        """Stops the scheduler. Callbacks that have not run yet are discarded."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run_due(self, now: Optional[float] = None) -> int:
+        """Runs the callbacks whose deadlines have passed at `now`, which defaults to the current
+           time, in the order of their deadlines. Returns the number of callbacks that ran."""
+        if now is None:
+            now = self.clock()
+
+        count = 0
+        while True:
+            with self.condition:
+                if self.stopped or not self.queue or self.queue[0][0] > now:
+                    return count
+                _, _, callback, args = heapq.heappop(self.queue)
+
+            self.run_callback(callback, args)
+            count += 1
+
+    def run(self):
+        """Runs callbacks as their deadlines pass."""
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.queue or self.queue[0][0] > self.clock()):
+                    if self.queue:
+                        timeout = min(self.queue[0][0] - self.clock(), MAX_SLEEP_SECONDS)
+                    else:
+                        timeout = None
+                    self.condition.wait(timeout)
+
+                if self.stopped:
+                    return
+
+                _, _, callback, args = heapq.heappop(self.queue)
+
+            self.run_callback(callback, args)
+
+    def run_callback(self, callback: Callable, args: Tuple[Any, ...]):
+        try:
+            callback(*args)
+        except Exception as e:
+            send_to_log(f'Scheduled task {callback.__name__} failed: {e}', name=self.name)
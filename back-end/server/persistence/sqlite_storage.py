@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""An SQLite storage backend. Ballots, devices, registered voters and permissions are stored as
+   indexed rows, so casting a ballot or registering a device updates a single row rather than
+   rewriting a file."""
+
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .commit import GroupCommitter, DEFAULT_FSYNC_POLICY
+from .storage import VoteStorage, DeviceStorage, VoteId, UserId, DeviceId
+
+# Maps fsync policies to SQLite's synchronous settings. In WAL mode, NORMAL syncs the log at
+# checkpoints rather than at every commit, which matches the 'batched' policy's guarantees.
+SYNCHRONOUS_SETTINGS = {
+    'always': 'FULL',
+    'batched': 'NORMAL',
+    'off': 'OFF'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS votes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    secret TEXT,
+    header TEXT,
+    option_table TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ballots (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    vote_id TEXT NOT NULL,
+    ballot_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (vote_id, ballot_id)
+);
+
+CREATE INDEX IF NOT EXISTS ballots_by_vote ON ballots (vote_id, seq);
+
+CREATE TABLE IF NOT EXISTS results (
+    vote_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS suspicious_ballots (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    vote_id TEXT NOT NULL,
+    report TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS devices (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    expiry REAL NOT NULL,
+    info TEXT
+);
+
+CREATE INDEX IF NOT EXISTS devices_by_user ON devices (user_id);
+
+CREATE TABLE IF NOT EXISTS registered_voters (user_id TEXT PRIMARY KEY);
+
+CREATE TABLE IF NOT EXISTS admins (user_id TEXT PRIMARY KEY);
+
+CREATE TABLE IF NOT EXISTS developers (user_id TEXT PRIMARY KEY);
+
+CREATE TABLE IF NOT EXISTS permissions (
+    scope TEXT NOT NULL,
+    permission TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (scope, permission, user_id)
+);
+"""
+
+Statement = Tuple[str, Iterable]
+
+
+class SqliteDatabase(object):
+    """A connection to an SQLite database in WAL mode that is shared by the vote and device
+       storage. The connection is used from several threads, so all access is serialized."""
+
+    def __init__(self, path: str, fsync_policy: str = DEFAULT_FSYNC_POLICY):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(f'PRAGMA synchronous={SYNCHRONOUS_SETTINGS[fsync_policy]}')
+        self.connection.executescript(SCHEMA)
+
+    def query(self, sql: str, parameters: Iterable = ()) -> List[tuple]:
+        """Runs a query and returns all rows it produces."""
+        with self.lock:
+            return self.connection.execute(sql, tuple(parameters)).fetchall()
+
+    def execute(self, *statements: Statement):
+        """Runs a sequence of statements in a single transaction."""
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                for sql, parameters in statements:
+                    self.connection.execute(sql, tuple(parameters))
+            except:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def execute_many(self, sql: str, rows: Iterable[Iterable], *statements: Statement):
+        """Runs `statements` followed by `sql` for every row in `rows`, in a single transaction."""
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                for statement, parameters in statements:
+                    self.connection.execute(statement, tuple(parameters))
+                self.connection.executemany(sql, (tuple(row) for row in rows))
+            except:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SqliteVoteStorage(VoteStorage):
+    """Stores votes in an SQLite database. Every ballot is a row, so ballots are cast with a single
+       insert and votes never need to be compacted."""
+
+    appends_suspicious_ballots = True
+
+    def __init__(self, database: SqliteDatabase, committer: GroupCommitter = None):
+        super().__init__(committer)
+        self.database = database
+
+    def read_index(self) -> Optional[Dict[VoteId, str]]:
+        rows = self.database.query('SELECT id, secret FROM votes WHERE secret IS NOT NULL ORDER BY seq')
+        if not rows:
+            return None
+        return dict(rows)
+
+    def write_index(self, vote_secrets: Dict[VoteId, str]):
+        # Only upserts: a snapshot of the index may be older than a vote created since, so rows
+        # are deleted by `delete_vote` when a vote is cancelled rather than by diffing.
+        self.database.execute_many(
+            'INSERT INTO votes (id, secret) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET secret = excluded.secret',
+            vote_secrets.items())
+
+    def read_summaries(self) -> Optional[Dict[VoteId, Any]]:
+        rows = self.database.query('SELECT id, header FROM votes WHERE header IS NOT NULL ORDER BY seq')
+        if not rows:
+            return None
+        return {vote_id: json.loads(header) for vote_id, header in rows}
+
+    def write_summaries(self, summaries: Dict[VoteId, Any]):
+        self.database.execute_many(
+            'INSERT INTO votes (id, header) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET header = excluded.header',
+            ((vote_id, json.dumps(vote)) for vote_id, vote in summaries.items()))
+
+    def read_suspicious_ballots(self) -> Dict[VoteId, List[Any]]:
+        results = {}
+        for vote_id, report in self.database.query('SELECT vote_id, report FROM suspicious_ballots ORDER BY seq'):
+            results.setdefault(vote_id, []).append(json.loads(report))
+        return results
+
+    def write_suspicious_ballots(self, suspicious_ballots: Dict[VoteId, List[Any]]):
+        self.database.execute_many(
+            'INSERT INTO suspicious_ballots (vote_id, report) VALUES (?, ?)',
+            ((vote_id, json.dumps(report)) for vote_id, reports in suspicious_ballots.items() for report in reports),
+            ('DELETE FROM suspicious_ballots', ()))
+
+    def append_suspicious_ballot(self, vote_id: VoteId, report: Any):
+        self.database.execute((
+            'INSERT INTO suspicious_ballots (vote_id, report) VALUES (?, ?)', (vote_id, json.dumps(report))))
+
+    def read_vote(self, vote_id: VoteId) -> Tuple[Any, int]:
+        rows = self.database.query(
+            'SELECT header, option_table FROM votes WHERE id = ? AND header IS NOT NULL', (vote_id,))
+        if not rows:
+            raise KeyError(vote_id)
+
+        header, option_table = rows[0]
+        ballots = self.database.query('SELECT data FROM ballots WHERE vote_id = ? ORDER BY seq', (vote_id,))
+        vote = {'vote': json.loads(header), 'ballots': [json.loads(data) for data, in ballots]}
+        if option_table is not None:
+            vote['optionTable'] = json.loads(option_table)
+        return vote, 0
+
+    def append_ballot(self, vote_id: VoteId, ballot: Any):
+        # Replacing a row gives it a new sequence number, so ballots stay ordered by cast time.
+        self.database.execute((
+            'INSERT OR REPLACE INTO ballots (vote_id, ballot_id, data) VALUES (?, ?, ?)',
+            (vote_id, ballot['id'], json.dumps(ballot))))
+
+    def append_header(self, vote_id: VoteId, header: Any):
+        self.database.execute((
+            'INSERT INTO votes (id, header, option_table) VALUES (?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET header = excluded.header, option_table = excluded.option_table',
+            (vote_id, json.dumps(header['vote']), json.dumps(header['optionTable']))))
+
+    def write_vote(self, vote_id: VoteId, vote: Any):
+        # Every ballot was stored by `append_ballot` as it was cast, and stored ballots are at least
+        # as recent as the ones passed in, so existing rows are left alone.
+        self.database.execute_many(
+            'INSERT OR IGNORE INTO ballots (vote_id, ballot_id, data) VALUES (?, ?, ?)',
+            ((vote_id, ballot['id'], json.dumps(ballot)) for ballot in vote['ballots']),
+            ('INSERT INTO votes (id, header, option_table) VALUES (?, ?, ?) '
+             'ON CONFLICT (id) DO UPDATE SET header = excluded.header, option_table = excluded.option_table',
+             (vote_id, json.dumps(vote['vote']), json.dumps(vote.get('optionTable')))))
+
+    def delete_vote(self, vote_id: VoteId):
+        self.database.execute(
+            ('DELETE FROM votes WHERE id = ?', (vote_id,)),
+            ('DELETE FROM ballots WHERE vote_id = ?', (vote_id,)),
+            ('DELETE FROM results WHERE vote_id = ?', (vote_id,)))
+
+    def read_results(self, vote_id: VoteId) -> Optional[Any]:
+        rows = self.database.query('SELECT data FROM results WHERE vote_id = ?', (vote_id,))
+        if not rows:
+            return None
+        return json.loads(rows[0][0])
+
+    def write_results(self, vote_id: VoteId, results: Any):
+        self.database.execute((
+            'INSERT OR REPLACE INTO results (vote_id, data) VALUES (?, ?)', (vote_id, json.dumps(results))))
+
+
+class SqliteDeviceStorage(DeviceStorage):
+    """Stores the device index in an SQLite database, one row per device, registered voter and
+       granted permission."""
+
+    def __init__(self, database: SqliteDatabase, committer: GroupCommitter = None):
+        super().__init__(committer)
+        self.database = database
+
+    def read(self) -> Optional[Any]:
+        permissions = {}
+        for scope, permission, user_id in self.database.query('SELECT scope, permission, user_id FROM permissions'):
+            permissions.setdefault(scope, {}).setdefault(permission, []).append(user_id)
+
+        return {
+            'devices': {
+                device_id: {'id': device_id, 'user': user_id, 'expiry': expiry, 'info': json.loads(info)}
+                for device_id, user_id, expiry, info in self.database.query(
+                    'SELECT id, user_id, expiry, info FROM devices')
+            },
+            'permissions': permissions,
+            'admins': [user_id for user_id, in self.database.query('SELECT user_id FROM admins')],
+            'developers': [user_id for user_id, in self.database.query('SELECT user_id FROM developers')],
+            'registered-voters': [
+                user_id for user_id, in self.database.query('SELECT user_id FROM registered_voters')
+            ]
+        }
+
+    def save_all(self, index):
+        data = index.to_json()
+        self.database.execute(
+            *[('DELETE FROM ' + table, ()) for table in
+              ['devices', 'permissions', 'admins', 'developers', 'registered_voters']],
+            *[('INSERT INTO devices (id, user_id, expiry, info) VALUES (?, ?, ?, ?)',
+               (device['id'], device['user'], device['expiry'], json.dumps(device['info'])))
+              for device in data['devices'].values()],
+            *[('INSERT INTO permissions (scope, permission, user_id) VALUES (?, ?, ?)', (scope, permission, user_id))
+              for scope, permissions in data['permissions'].items()
+              for permission, user_ids in permissions.items()
+              for user_id in user_ids],
+            *[('INSERT INTO admins (user_id) VALUES (?)', (user_id,)) for user_id in data['admins']],
+            *[('INSERT INTO developers (user_id) VALUES (?)', (user_id,)) for user_id in data['developers']],
+            *[('INSERT INTO registered_voters (user_id) VALUES (?)', (user_id,))
+              for user_id in data['registered-voters']])
+
+    def save_device(self, index, device):
+        self.database.execute((
+            'INSERT OR REPLACE INTO devices (id, user_id, expiry, info) VALUES (?, ?, ?, ?)',
+            (device.device_id, device.user_id, device.expiry, json.dumps(device.device_info))))
+
+    def delete_device(self, index, device_id: DeviceId):
+        self.database.execute(('DELETE FROM devices WHERE id = ?', (device_id,)))
+
+    def delete_devices(self, index, device_ids: List[DeviceId]):
+        self.database.execute_many('DELETE FROM devices WHERE id = ?', ((device_id,) for device_id in device_ids))
+
+    def save_registered_voter(self, index, user_id: UserId):
+        self.database.execute(('INSERT OR IGNORE INTO registered_voters (user_id) VALUES (?)', (user_id,)))
+
+    def delete_registered_voter(self, index, user_id: UserId):
+        self.database.execute(('DELETE FROM registered_voters WHERE user_id = ?', (user_id,)))
+
+    def save_permission(self, index, permission, user_id: UserId):
+        self.database.execute((
+            'INSERT OR IGNORE INTO permissions (scope, permission, user_id) VALUES (?, ?, ?)',
+            (permission.scope, permission.permission, user_id)))
+
+    def delete_permission(self, index, permission, user_id: UserId):
+        self.database.execute((
+            'DELETE FROM permissions WHERE scope = ? AND permission = ? AND user_id = ?',
+            (permission.scope, permission.permission, user_id)))
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+
+"""Storage backends for the vote index and the device index. `VoteStorage` and `DeviceStorage`
+   describe what the indexes need from a backend; the JSON backend keeps the historical layout of
+   the `data/` directory and the SQLite backend lives in `sqlite_storage`."""
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from .commit import GroupCommitter
+from .helpers import read_json, write_json, append_json_line, read_json_lines, repair_json_lines
+
+VoteId = str
+UserId = str
+DeviceId = str
+
+# Valid storage kinds, as accepted by `open_storage`.
+STORAGE_KINDS = ['json', 'sqlite']
+
+DEFAULT_STORAGE = 'json'
+
+# The minimal number of records the device index's journal must hold before it is compacted into
+# the snapshot. It is also compacted only once it outgrows the number of registered devices, which
+# keeps the amortized cost of a login constant.
+DEVICE_JOURNAL_COMPACTION_THRESHOLD = 1000
+
+
+class VoteStorage(object):
+    """Stores votes, their ballots, vote secrets and suspicious ballot reports. Votes are read
+       and written in their JSON representation."""
+
+    # Tells if cast ballots are kept in a journal that must periodically be compacted by
+    # rewriting the vote.
+    uses_journal = False
+
+    # Tells if suspicious ballot reports can be stored one at a time with
+    # `append_suspicious_ballot`, rather than by rewriting all reports.
+    appends_suspicious_ballots = False
+
+    def __init__(self, committer: GroupCommitter = None):
+        self.committer = committer or GroupCommitter()
+
+    def read_index(self) -> Optional[Dict[VoteId, str]]:
+        """Reads the vote secrets of all votes. Returns None if there is no index yet."""
+        raise NotImplementedError()
+
+    def write_index(self, vote_secrets: Dict[VoteId, str]):
+        """Writes the vote secrets of all votes."""
+        raise NotImplementedError()
+
+    def read_summaries(self) -> Optional[Dict[VoteId, Any]]:
+        """Reads the summaries of all votes. Returns None if there are no summaries yet."""
+        raise NotImplementedError()
+
+    def write_summaries(self, summaries: Dict[VoteId, Any]):
+        """Writes the summaries of all votes."""
+        raise NotImplementedError()
+
+    def read_suspicious_ballots(self) -> Dict[VoteId, List[Any]]:
+        """Reads all suspicious ballot reports."""
+        raise NotImplementedError()
+
+    def write_suspicious_ballots(self, suspicious_ballots: Dict[VoteId, List[Any]]):
+        """Writes all suspicious ballot reports."""
+        raise NotImplementedError()
+
+    def append_suspicious_ballot(self, vote_id: VoteId, report: Any):
+        """Stores a new suspicious ballot report."""
+        raise NotImplementedError()
+
+    def read_vote(self, vote_id: VoteId) -> Tuple[Any, int]:
+        """Reads a vote and its ballots. Returns the vote and the number of ballots that were
+           read from the vote's journal."""
+        raise NotImplementedError()
+
+    def append_ballot(self, vote_id: VoteId, ballot: Any):
+        """Stores a newly cast ballot, replacing any earlier ballot with the same ID."""
+        raise NotImplementedError()
+
+    def append_header(self, vote_id: VoteId, header: Any):
+        """Stores a vote's edited header, option table and revision number, without rewriting the
+           vote's ballots."""
+        raise NotImplementedError()
+
+    def prepare_vote_write(self, vote_id: VoteId):
+        """Prepares for a call to `write_vote`. Runs while the vote's lock is held; ballots
+           appended afterwards must not be lost when the write completes."""
+        pass
+
+    def write_vote(self, vote_id: VoteId, vote: Any):
+        """Writes a vote and all of its ballots."""
+        raise NotImplementedError()
+
+    def delete_vote(self, vote_id: VoteId):
+        """Deletes a cancelled vote, its ballots and anything else stored for it."""
+        raise NotImplementedError()
+
+    def read_results(self, vote_id: VoteId) -> Optional[Any]:
+        """Reads a closed vote's cached tally results. Returns None if there are none."""
+        raise NotImplementedError()
+
+    def write_results(self, vote_id: VoteId, results: Any):
+        """Caches a closed vote's tally results."""
+        raise NotImplementedError()
+
+
+class DeviceStorage(object):
+    """Stores the device index: registered devices, registered voters, admins, developers and
+       permissions. Changes are reported one at a time, so backends can update single records."""
+
+    def __init__(self, committer: GroupCommitter = None):
+        self.committer = committer or GroupCommitter()
+
+    def read(self) -> Optional[Any]:
+        """Reads the device index in its JSON representation. Returns None if there is no
+           device index yet."""
+        raise NotImplementedError()
+
+    def save_all(self, index):
+        """Writes the entire device index."""
+        raise NotImplementedError()
+
+    def save_device(self, index, device):
+        """Records that a device was registered."""
+        self.save_all(index)
+
+    def delete_device(self, index, device_id: DeviceId):
+        """Records that a device was unregistered."""
+        self.save_all(index)
+
+    def delete_devices(self, index, device_ids: List[DeviceId]):
+        """Records that a batch of devices was unregistered."""
+        self.save_all(index)
+
+    def save_registered_voter(self, index, user_id: UserId):
+        """Records that a user was registered as a voter."""
+        self.save_all(index)
+
+    def delete_registered_voter(self, index, user_id: UserId):
+        """Records that a user is no longer a registered voter."""
+        self.save_all(index)
+
+    def save_permission(self, index, permission, user_id: UserId):
+        """Records that a user was granted a permission."""
+        self.save_all(index)
+
+    def delete_permission(self, index, permission, user_id: UserId):
+        """Records that a permission was revoked from a user."""
+        self.save_all(index)
+
+
+class JsonVoteStorage(VoteStorage):
+    """Stores votes as JSON files. The index maps vote IDs to secrets; every vote has a snapshot
+       in `votes/<id>.json` and a journal of ballots cast and edits made since the snapshot was
+       written."""
+
+    uses_journal = True
+
+    def __init__(self, index_path: str, committer: GroupCommitter = None):
+        super().__init__(committer)
+        self.index_path = index_path
+        Path(get_votes_directory(index_path)).mkdir(parents=True, exist_ok=True)
+
+    def read_index(self) -> Optional[Dict[VoteId, str]]:
+        try:
+            return read_json(self.index_path)
+        except FileNotFoundError:
+            return None
+
+    def write_index(self, vote_secrets: Dict[VoteId, str]):
+        write_json(vote_secrets, self.index_path, self.committer.fsync_writes)
+
+    def read_summaries(self) -> Optional[Dict[VoteId, Any]]:
+        try:
+            return read_json(get_summaries_path(self.index_path))
+        except FileNotFoundError:
+            return None
+
+    def write_summaries(self, summaries: Dict[VoteId, Any]):
+        write_json(summaries, get_summaries_path(self.index_path), self.committer.fsync_writes)
+
+    def read_suspicious_ballots(self) -> Dict[VoteId, List[Any]]:
+        try:
+            return read_json(get_suspicious_ballots_path(self.index_path))
+        except FileNotFoundError:
+            return {}
+
+    def write_suspicious_ballots(self, suspicious_ballots: Dict[VoteId, List[Any]]):
+        write_json(
+            suspicious_ballots,
+            get_suspicious_ballots_path(self.index_path),
+            self.committer.fsync_writes)
+
+    def read_vote(self, vote_id: VoteId) -> Tuple[Any, int]:
+        """Reads a vote's snapshot and replays its journals on top of it. A journal record that
+           was cut short by a crash is dropped from the journal."""
+        vote = read_json(vote_id_to_path(self.index_path, vote_id))
+        journal = []
+        for journal_path in [
+                vote_id_to_compacting_journal_path(self.index_path, vote_id),
+                vote_id_to_journal_path(self.index_path, vote_id)]:
+            repair_json_lines(journal_path)
+            try:
+                journal.extend(read_json_lines(journal_path))
+            except FileNotFoundError:
+                pass
+
+        if journal:
+            # A journaled ballot replaces any earlier ballot with the same ID. A journaled header
+            # replaces the vote's header unless the snapshot has a more recent revision, which
+            # happens if the snapshot was written but its journal was not yet deleted.
+            ballots = {ballot['id']: ballot for ballot in vote['ballots']}
+            for record in journal:
+                if 'vote' in record:
+                    if record['revision'] > vote.get('revision', 0):
+                        vote.update(record)
+                else:
+                    ballots.pop(record['id'], None)
+                    ballots[record['id']] = record
+            vote['ballots'] = list(ballots.values())
+
+        return vote, len(journal)
+
+    def append_ballot(self, vote_id: VoteId, ballot: Any):
+        journal_path = vote_id_to_journal_path(self.index_path, vote_id)
+        append_json_line(ballot, journal_path)
+        self.committer.appended(journal_path)
+
+    def append_header(self, vote_id: VoteId, header: Any):
+        # Headers are journaled alongside ballots and told apart by their 'vote' key.
+        self.append_ballot(vote_id, header)
+
+    def prepare_vote_write(self, vote_id: VoteId):
+        """Sets the vote's journal aside. Ballots cast from now on go to a fresh journal."""
+        set_aside_journal(self.index_path, vote_id)
+
+    def write_vote(self, vote_id: VoteId, vote: Any):
+        """Writes a vote's snapshot and deletes the journal that was set aside for it."""
+        write_json(vote, vote_id_to_path(self.index_path, vote_id), self.committer.fsync_writes)
+
+        try:
+            os.remove(vote_id_to_compacting_journal_path(self.index_path, vote_id))
+        except FileNotFoundError:
+            pass
+
+    def delete_vote(self, vote_id: VoteId):
+        """Deletes a vote's snapshot, its journals and its cached tally results."""
+        remove_file(vote_id_to_journal_path(self.index_path, vote_id))
+        remove_file(vote_id_to_compacting_journal_path(self.index_path, vote_id))
+        remove_file(vote_id_to_path(self.index_path, vote_id))
+        remove_file(vote_id_to_results_path(self.index_path, vote_id))
+
+    def read_results(self, vote_id: VoteId) -> Optional[Any]:
+        try:
+            return read_json(vote_id_to_results_path(self.index_path, vote_id))
+        except FileNotFoundError:
+            return None
+
+    def write_results(self, vote_id: VoteId, results: Any):
+        write_json(results, vote_id_to_results_path(self.index_path, vote_id), self.committer.fsync_writes)
+
+
+class JsonDeviceStorage(DeviceStorage):
+    """Stores the device index as a JSON snapshot in `device-index.json` and a journal of the
+       changes made since the snapshot was written. Registering a device appends a line to the
+       journal instead of rewriting every device; the journal is compacted into the snapshot once
+       it grows large compared to the index itself."""
+
+    def __init__(self, path: str, committer: GroupCommitter = None):
+        super().__init__(committer)
+        self.path = path
+        self.journal_path = get_device_journal_path(path)
+        self.compacting_journal_path = self.journal_path + '.compacting'
+
+        # The number of records appended to the journal since a compaction was last scheduled.
+        self.journal_length = 0
+        self.journal_lock = threading.Lock()
+
+    def read(self) -> Optional[Any]:
+        """Reads the device index's snapshot and replays its journals on top of it. A journal
+           record that was cut short by a crash is dropped from the journal."""
+        try:
+            data = read_json(self.path)
+        except FileNotFoundError:
+            data = None
+
+        journal = []
+        for journal_path in [self.compacting_journal_path, self.journal_path]:
+            repair_json_lines(journal_path)
+            try:
+                journal.extend(read_json_lines(journal_path))
+            except FileNotFoundError:
+                pass
+
+        with self.journal_lock:
+            self.journal_length = len(journal)
+
+        if not journal:
+            return data
+
+        data = data or {}
+        devices = data.setdefault('devices', {})
+        permissions = data.setdefault('permissions', {})
+        voters = set(data.get('registered-voters', []))
+        for record in journal:
+            kind = record['kind']
+            if kind == 'save-device':
+                devices.pop(record['device']['id'], None)
+                devices[record['device']['id']] = record['device']
+            elif kind == 'delete-device':
+                devices.pop(record['id'], None)
+            elif kind == 'delete-devices':
+                for device_id in record['ids']:
+                    devices.pop(device_id, None)
+            elif kind == 'save-registered-voter':
+                voters.add(record['user'])
+            elif kind == 'delete-registered-voter':
+                voters.discard(record['user'])
+            elif kind == 'save-permission':
+                user_ids = permissions.setdefault(record['scope'], {}).setdefault(record['permission'], [])
+                if record['user'] not in user_ids:
+                    user_ids.append(record['user'])
+            elif kind == 'delete-permission':
+                user_ids = permissions.get(record['scope'], {}).get(record['permission'], [])
+                if record['user'] in user_ids:
+                    user_ids.remove(record['user'])
+
+        data['registered-voters'] = list(sorted(voters))
+        return data
+
+    def save_all(self, index):
+        """Schedules the device index to be written to disk. The journal is folded into the
+           snapshot when the write happens."""
+        self.committer.mark_dirty('device-index', lambda: self.write_snapshot(index))
+
+    def write_snapshot(self, index):
+        """Writes the device index's snapshot. The journal is set aside before the index is
+           serialized, so every change it records is part of the snapshot; changes made in the
+           meantime go to a fresh journal and are replayed on top of the snapshot when it is read."""
+        set_aside_file(self.journal_path, self.compacting_journal_path)
+        write_json(index.to_json(), self.path, self.committer.fsync_writes)
+
+        try:
+            os.remove(self.compacting_journal_path)
+        except FileNotFoundError:
+            pass
+
+    def append_record(self, index, record: Any):
+        """Appends a change to the journal and schedules a compaction if the journal has grown
+           large compared to the device index."""
+        append_json_line(record, self.journal_path)
+        self.committer.appended(self.journal_path)
+
+        with self.journal_lock:
+            self.journal_length += 1
+            compact = self.journal_length >= DEVICE_JOURNAL_COMPACTION_THRESHOLD \
+                and self.journal_length >= len(index.devices)
+            if compact:
+                self.journal_length = 0
+
+        if compact:
+            self.save_all(index)
+
+    def save_device(self, index, device):
+        self.append_record(index, {'kind': 'save-device', 'device': device.to_json()})
+
+    def delete_device(self, index, device_id: DeviceId):
+        self.append_record(index, {'kind': 'delete-device', 'id': device_id})
+
+    def delete_devices(self, index, device_ids: List[DeviceId]):
+        self.append_record(index, {'kind': 'delete-devices', 'ids': device_ids})
+
+    def save_registered_voter(self, index, user_id: UserId):
+        self.append_record(index, {'kind': 'save-registered-voter', 'user': user_id})
+
+    def delete_registered_voter(self, index, user_id: UserId):
+        self.append_record(index, {'kind': 'delete-registered-voter', 'user': user_id})
+
+    def save_permission(self, index, permission, user_id: UserId):
+        self.append_record(index, {
+            'kind': 'save-permission',
+            'scope': permission.scope,
+            'permission': permission.permission,
+            'user': user_id
+        })
+
+    def delete_permission(self, index, permission, user_id: UserId):
+        self.append_record(index, {
+            'kind': 'delete-permission',
+            'scope': permission.scope,
+            'permission': permission.permission,
+            'user': user_id
+        })
+
+
+def get_device_journal_path(device_index_path: str) -> str:
+    """Takes the path to the device index's snapshot and turns it into a path to its journal. The
+       journal holds one change to the device index per line, in the order they were made."""
+    return os.path.splitext(device_index_path)[0] + '.journal'
+
+
+def get_suspicious_ballots_path(index_path: str) -> str:
+    return Path(index_path).parent.joinpath('suspicious-ballots.json')
+
+
+def get_summaries_path(index_path: str) -> str:
+    return Path(index_path).parent.joinpath('vote-summaries.json')
+
+
+def get_votes_directory(index_path: str) -> str:
+    return os.path.join(os.path.dirname(index_path), 'votes')
+
+
+def vote_id_to_path(index_path: str, vote_id: VoteId) -> str:
+    """Takes a vote ID and an index path and turns it into a path to the location
+       where the vote's data is stored."""
+    return os.path.join(get_votes_directory(index_path), vote_id) + '.json'
+
+
+def vote_id_to_journal_path(index_path: str, vote_id: VoteId) -> str:
+    """Takes a vote ID and an index path and turns it into a path to the vote's journal. The journal
+       holds one cast ballot or edited header per line, in the order in which they were recorded."""
+    return os.path.join(get_votes_directory(index_path), vote_id) + '.journal'
+
+
+def vote_id_to_compacting_journal_path(index_path: str, vote_id: VoteId) -> str:
+    """Takes a vote ID and an index path and turns it into a path to the journal that is set aside
+       while the vote's snapshot is being written."""
+    return vote_id_to_journal_path(index_path, vote_id) + '.compacting'
+
+
+def vote_id_to_results_path(index_path: str, vote_id: VoteId) -> str:
+    """Takes a vote ID and an index path and turns it into a path to the vote's cached tally
+       results."""
+    return os.path.join(get_votes_directory(index_path), vote_id) + '.results.json'
+
+
+def set_aside_journal(index_path: str, vote_id: VoteId):
+    """Moves a vote's journal out of the way so a snapshot can be written. If an earlier journal
+       is still set aside, the two are merged."""
+    set_aside_file(
+        vote_id_to_journal_path(index_path, vote_id),
+        vote_id_to_compacting_journal_path(index_path, vote_id))
+
+
+def remove_file(path: str):
+    """Deletes the file at `path`, if there is one."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def set_aside_file(journal_path: str, compacting_path: str):
+    """Moves a journal to `compacting_path`. If an earlier journal is still there, the two are
+       merged."""
+    if not os.path.exists(journal_path):
+        return
+    elif os.path.exists(compacting_path):
+        with open(journal_path, 'r') as journal, open(compacting_path, 'a') as compacting:
+            compacting.write(journal.read())
+        os.remove(journal_path)
+    else:
+        os.replace(journal_path, compacting_path)
+
+
+def open_storage(
+        kind: str,
+        data_path: str,
+        committer: GroupCommitter = None) -> Tuple[VoteStorage, DeviceStorage]:
+    """Opens the vote and device storage of kind `kind` in the data directory at `data_path`."""
+    committer = committer or GroupCommitter()
+    if kind == 'json':
+        return (
+            JsonVoteStorage(os.path.join(data_path, 'vote-index.json'), committer),
+            JsonDeviceStorage(os.path.join(data_path, 'device-index.json'), committer)
+        )
+    elif kind == 'sqlite':
+        from .sqlite_storage import SqliteDatabase, SqliteVoteStorage, SqliteDeviceStorage
+        database = SqliteDatabase(os.path.join(data_path, 'res-publica.db'), committer.fsync_policy)
+        return SqliteVoteStorage(database, committer), SqliteDeviceStorage(database, committer)
+    else:
+        raise ValueError(f'Invalid storage kind: {kind}')
@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 
+import bisect
+import json
 import random
+import threading
 import time
-import os
 from Crypto.Hash import SHA3_256
-from pathlib import Path
-from typing import Any, DefaultDict, Dict, List, Union, Optional
-from .helpers import read_json, write_json, send_to_log
+from typing import Any, DefaultDict, Dict, Iterator, List, Set, Tuple, Union, Optional
+from .helpers import send_to_log
 from .authentication import DeviceIndex, RegisteredDevice, UserId
+from .ballots import \
+    create_option_table, compact_ballot, expand_ballot, expand_ballots, expand_vote, ballot_to_json, ballot_from_json
+from .cache import PinnedLRUCache
+from .events import EventBroadcaster
+from .responses import ResponseCache, SerializedResponse, join_responses, serialize
+from .scheduler import DeadlineScheduler
+from .storage import VoteStorage
+from ..tally.live import create_live_tally
+from ..tally.outcomes import tally
+from ..tally.workers import TallyJob, TallyPool, is_pooled
 
 VoteId = str
 OptionId = str
@@ -17,9 +28,28 @@ VoteAndBallots = Any
 Ballot = Any
 SuspiciousBallot = Any
 
+# The minimal number of records a ballot journal must hold before it is compacted into its vote's
+# snapshot. Journals are also compacted once they outgrow the snapshot itself, which keeps the
+# amortized cost of casting a ballot constant.
+JOURNAL_COMPACTION_THRESHOLD = 1000
 
-def is_vote_active(vote: VoteAndBallots) -> bool:
-    return vote['vote']['deadline'] > time.time()
+# The default number of bytes' worth of closed votes to keep in memory, as measured by the size of
+# their JSON representation. Open votes are always kept in memory.
+DEFAULT_CLOSED_VOTE_CACHE_BUDGET = 64 * 1024 * 1024
+
+# The number of ballots that are serialized at a time when a closed vote is streamed to a client.
+BALLOT_STREAM_CHUNK_SIZE = 1000
+
+# Closed votes with more ballots than this are streamed to clients rather than kept in memory in
+# serialized form.
+MAX_CACHED_BALLOTS = 10000
+
+# The minimal number of seconds between two turnout events for the same vote.
+TURNOUT_EVENT_INTERVAL = 1.0
+
+
+def is_vote_active(vote: VoteAndBallots, now: float) -> bool:
+    return vote['vote']['deadline'] > now
 
 
 def get_ballot_kind(ballot_type: Any) -> str:
@@ -34,124 +64,549 @@ def get_ballot_kind(ballot_type: Any) -> str:
         raise Exception(f'Unknown tallying algorithm {tally}.')
 
 
-def get_suspicious_ballots_path(index_path: str) -> str:
-    return Path(index_path).parent.joinpath('suspicious-ballots.json')
+# The field a client-sent ballot must have, by ballot kind.
+BALLOT_FIELDS = {
+    'choose-one': 'selectedOptionId',
+    'rate-options': 'ratingPerOption',
+    'rank-options': 'optionRanking'
+}
 
 
 class VoteIndex(object):
     """Keeps track of votes."""
 
     def __init__(self,
-                 index_path: str,
+                 storage: VoteStorage,
                  devices: DeviceIndex,
                  votes: Dict[VoteId, VoteAndBallots],
                  vote_secrets: Dict[VoteId, str],
-                 suspicious_ballots: Dict[VoteId, List[SuspiciousBallot]]):
-
-        self.index_path = index_path
+                 suspicious_ballots: Dict[VoteId, List[SuspiciousBallot]],
+                 journal_lengths: Dict[VoteId, int] = None,
+                 summaries: Dict[VoteId, Vote] = None,
+                 cache_budget: int = DEFAULT_CLOSED_VOTE_CACHE_BUDGET,
+                 tally_pool: Optional[TallyPool] = None,
+                 scheduler: Optional[DeadlineScheduler] = None):
+
+        self.storage = storage
+        self.committer = storage.committer
         self.devices = devices
-        self.votes = votes
         self.vote_secrets = vote_secrets
         self.suspicious_ballots = suspicious_ballots
-        self.last_heartbeat = time.monotonic()
 
-        # The ballot ID cache remembers ballot IDs.
+        # The scheduler runs deferred work such as closing votes. Whether a vote is still active is
+        # decided by the scheduler's clock, so both agree on the time.
+        self.scheduler = scheduler or DeadlineScheduler('votes')
+        self.clock = self.scheduler.clock
+
+        # Every vote has a lock that serializes changes to that vote. The index lock serializes
+        # changes to state that is shared by all votes: the vote secrets, the summaries, the list
+        # of open votes and the suspicious ballot reports. A thread that needs both locks must
+        # acquire the vote lock first.
+        #
+        # Readers do not lock. Ballots are never modified once they have been cast, and votes,
+        # summaries and the list of open votes are replaced rather than modified in place, so
+        # readers always see a consistent snapshot.
+        self.index_lock = threading.RLock()
+        self.vote_locks: Dict[VoteId, threading.RLock] = {}
+
+        # Open votes are pinned in memory. Closed votes are loaded when they are first accessed and
+        # evicted when they have not been used in a while.
+        self.votes = PinnedLRUCache(self.load_vote, cache_budget)
+        for vote_id, vote in votes.items():
+            self.votes[vote_id] = vote
+            if not vote_secrets.get(vote_id):
+                self.votes.unpin(vote_id, estimate_vote_size(vote))
+
+        # Vote summaries are the votes without their ballots. They are kept in memory for all votes.
+        if summaries is None:
+            summaries = {vote_id: vote['vote'] for vote_id, vote in votes.items()}
+        self.summaries = summaries
+
+        # The number of ballots recorded in each vote's journal since its last snapshot.
+        self.journal_lengths = DefaultDict(int)
+        self.journal_lengths.update(journal_lengths or {})
+
+        # The ballot ID cache remembers ballot IDs. The voter index maps the ballot IDs of active
+        # votes back to the users who cast them.
         self.ballot_id_cache = DefaultDict(dict)
-        self.ballot_to_voter_cache = DefaultDict(dict)
+        self.ballot_to_voter_index = DefaultDict(dict)
+
+        # The device indexes map the persistent IDs and visitor IDs of devices belonging to users
+        # who voted in an active vote to those users and their devices.
+        self.persistent_id_index = DefaultDict(lambda: DefaultDict(dict))
+        self.visitor_id_index = DefaultDict(lambda: DefaultDict(dict))
+
+        self.rebuild_voter_index()
+        self.devices.add_registration_listener(self.index_new_device)
+
+        # Open votes that can be tallied incrementally have a live tally, which is updated as
+        # ballots are cast.
+        self.live_tallies: Dict[VoteId, Any] = {}
+
+        # Closed votes' tally results, along with the key they were computed for. Ballots are
+        # frozen once a vote closes, so the key only changes when the vote's options or
+        # resignations do. Digests of closed votes' ballots are kept so keys are cheap to compute.
+        self.results: Dict[VoteId, Tuple[str, Any]] = {}
+        self.ballot_digests: Dict[VoteId, str] = {}
+
+        # Expensive tallies run in the tally pool, if there is one, rather than on the thread that
+        # asks for a vote's results.
+        self.tally_pool = tally_pool
+
+        # Serialized responses for votes and vote listings. They are invalidated whenever the data
+        # they were serialized from is written to storage.
+        self.responses = ResponseCache()
+
+        # Every change to a vote bumps the index's version, and each vote records the version at
+        # which it last changed. Versions never lag behind the current time in microseconds, so
+        # they keep increasing across restarts and can be compared with ballot timestamps.
+        # Cancelled votes leave a tombstone behind: the version at which they were cancelled.
+        self.start_version = time.time_ns() // 1000
+        self.version = self.start_version
+        self.vote_versions: Dict[VoteId, int] = {}
+        self.cancelled_votes: Dict[VoteId, int] = {}
+
+        # Changes to votes are broadcast to subscribers as they happen. Turnout events are sent
+        # at most once per interval for each vote; these are the votes that have one scheduled.
+        self.events = EventBroadcaster()
+        self.pending_turnout_events: Set[VoteId] = set()
+
+        # Open votes are kept in a list of (deadline, vote ID) pairs, sorted by deadline. The
+        # scheduler closes them as their deadlines pass.
+        self.open_votes: List[Tuple[float, VoteId]] = []
+        for vote_id, secret in self.vote_secrets.items():
+            if secret:
+                self.track_open_vote(vote_id)
+
+    def get_vote_lock(self, vote_id: VoteId) -> threading.RLock:
+        """Gets the lock that guards changes to a vote."""
+        lock = self.vote_locks.get(vote_id)
+        if lock is None:
+            lock = self.vote_locks.setdefault(vote_id, threading.RLock())
+        return lock
+
+    def track_open_vote(self, vote_id: VoteId):
+        """Adds a vote to the list of open votes and schedules it to be closed at its deadline."""
+        vote = self.votes[vote_id]
+        deadline = vote['vote']['deadline']
+        if vote_id not in self.live_tallies:
+            self.live_tallies[vote_id] = create_live_tally(vote)
+        with self.index_lock:
+            open_votes = list(self.open_votes)
+            bisect.insort(open_votes, (deadline, vote_id))
+            self.open_votes = open_votes
+        self.scheduler.schedule(deadline, self.close_vote, vote_id)
+
+    def untrack_open_vote(self, vote_id: VoteId, deadline: float):
+        """Removes a vote from the list of open votes."""
+        with self.index_lock:
+            self.open_votes = [entry for entry in self.open_votes if entry != (deadline, vote_id)]
+
+    def rebuild_voter_index(self):
+        """Recovers the voter behind every ballot cast in an active vote. This is done once, when
+           the vote index is loaded; afterwards, voters are recorded as they cast their ballots."""
+        users = set(self.devices.registered_voters).union(self.devices.users_to_devices.keys())
+        for vote_id, secret in self.vote_secrets.items():
+            if not secret:
+                continue
 
-    def heartbeat(self):
-        """Allows the vote index to perform cleanup. In practice, this means that vote secrets
-           for closed votes are deleted."""
-        if time.monotonic() - self.last_heartbeat < 10:
-            # Do nothing if the last heartbeat was less than ten seconds ago.
-            return
+            ballots = self.votes[vote_id]['ballots']
+            if not ballots:
+                continue
 
-        # Otherwise, scan for closed votes and delete their vote secrets.
-        closed_votes = {
-            name
-            for name, vote in self.votes.items()
-            if not is_vote_active(vote) and self.vote_secrets[name]
-        }
-        if closed_votes:
-            # Clear caches.
-            for vote_id in closed_votes:
-                self.ballot_id_cache[vote_id].clear()
-                self.ballot_to_voter_cache[vote_id].clear()
-
-            # Delete vote secrets.
-            self.vote_secrets = {
-                k: '' if k in closed_votes else v
-                for k, v in self.vote_secrets.items()
-            }
-            self.write_index()
+            for user_id in users:
+                ballot_id = self.get_ballot_id(vote_id, user_id)
+                if ballot_id in ballots:
+                    self.ballot_to_voter_index[vote_id][ballot_id] = user_id
+                    self.index_voter_devices(vote_id, user_id)
+
+    def index_voter_devices(self, vote_id: VoteId, user_id: UserId):
+        """Records the devices of a user who voted in `vote_id` in the vote's device indexes."""
+        for device in list(self.devices.users_to_devices.get(user_id, [])):
+            self.index_voter_device(vote_id, device)
 
-        self.last_heartbeat = time.monotonic()
+    def index_voter_device(self, vote_id: VoteId, device: RegisteredDevice):
+        """Records a device of a user who voted in `vote_id` in the vote's device indexes."""
+        persistent_id = device.persistent_id()
+        if persistent_id is not None:
+            self.persistent_id_index[vote_id][persistent_id][device.user_id] = device
+
+        visitor_id = device.visitor_id()
+        if visitor_id is not None:
+            self.visitor_id_index[vote_id][visitor_id][device.user_id] = device
+
+    def index_new_device(self, device: RegisteredDevice):
+        """Records a newly registered device in the device indexes of the active votes its user
+           has voted in, so ballots later cast from it by other users are reported."""
+        for _, vote_id in self.open_votes:
+            with self.get_vote_lock(vote_id):
+                if not self.vote_secrets.get(vote_id):
+                    continue
+
+                if self.get_ballot_id(vote_id, device) in self.ballot_to_voter_index[vote_id]:
+                    self.index_voter_device(vote_id, device)
+
+    def close_vote(self, vote_id: VoteId):
+        """Closes a vote once its deadline has passed. This deletes the vote's secret and clears
+           the caches and indexes that depend on it. Runs on the scheduler's thread."""
+        with self.get_vote_lock(vote_id):
+            vote = self.votes.get(vote_id)
+            if vote is None or not self.vote_secrets.get(vote_id) or is_vote_active(vote, self.clock()):
+                # The vote was cancelled, has been closed already or had its deadline pushed back.
+                return
+
+            self.untrack_open_vote(vote_id, vote['vote']['deadline'])
+
+            # Fold outstanding journal records into the vote snapshot.
+            if self.journal_lengths[vote_id] > 0:
+                self.write_vote(vote)
+
+            # Delete the vote secret and clear the caches and indexes that depend on it.
+            with self.index_lock:
+                self.vote_secrets[vote_id] = ''
+                self.write_index()
+            self.responses.invalidate(('header', vote_id), ('vote', vote_id))
+
+            # The live tally already knows the vote's outcome, so its results need not be counted.
+            live_tally = self.live_tallies.pop(vote_id, None)
+            if live_tally is not None:
+                results = {'outcome': live_tally.get_outcome(vote)}
+                key = self.get_results_key(vote)
+                self.results[vote_id] = (key, results)
+                self.write_results(vote_id, {'key': key, 'results': results})
+            elif self.tally_pool is not None and is_pooled(vote):
+                # Start counting right away so the results are ready by the time they are requested.
+                self.start_tally(vote)
+
+            self.ballot_id_cache[vote_id].clear()
+            self.ballot_to_voter_index[vote_id].clear()
+            self.persistent_id_index[vote_id].clear()
+            self.visitor_id_index[vote_id].clear()
+
+            # The vote no longer needs to stay in memory.
+            self.votes.unpin(vote_id, estimate_vote_size(vote))
+            version = self.bump_version(vote_id)
+            self.events.publish('vote-closed', {'voteId': vote_id}, version)
+
+    def load_vote(self, vote_id: VoteId) -> Tuple[VoteAndBallots, int]:
+        """Loads a closed vote from storage. Returns the vote and its size."""
+        if vote_id not in self.vote_secrets:
+            raise KeyError(vote_id)
+
+        vote, journal_length = read_vote(self.storage, vote_id)
+        if journal_length > 0:
+            # Compact journals that were left behind by an unclean shutdown.
+            self.journal_lengths[vote_id] = journal_length
+            self.write_vote(vote)
+
+        return vote, estimate_vote_size(vote)
+
+    def get_all_votes(self) -> List[Vote]:
+        """Gets all votes, without their ballots."""
+        return list(self.summaries.values())
 
     def get_active_votes(self, device: RegisteredDevice) -> List[VoteAndBallots]:
-        """Gets all currently active votes."""
-        self.heartbeat()
-        return [
-            self.prepare_for_transmission(vote, device)
-            for vote in self.votes.values()
-            if is_vote_active(vote)
-        ]
+        """Gets all currently active votes, ordered by deadline."""
+        return [self.prepare_for_transmission(vote, device) for vote in self.get_active_vote_list()]
+
+    def get_active_vote_changes(self, device: RegisteredDevice, since: int) -> Any:
+        """Gets the changes to the active votes after version `since`: the active votes that were
+           created or edited since, or in which the device's user voted since, and the IDs of the
+           votes that were closed or cancelled since. Clients that last synced before the server
+           started are sent all active votes, with `reset` set."""
+        # Any change that is not visible yet gets a later version than the current time.
+        version = max(self.version, time.time_ns() // 1000 - 1)
+        if since < self.start_version:
+            return {
+                'version': version,
+                'reset': True,
+                'votes': self.get_active_votes(device),
+                'closed': [],
+                'cancelled': []
+            }
 
-    def get_vote(self, vote_id: VoteId, device: RegisteredDevice) -> Vote:
-        """Gets a vote."""
-        self.heartbeat()
+        votes = []
+        for vote in self.get_active_vote_list():
+            own_ballot = vote['ballots'].get(self.get_ballot_id(vote['vote']['id'], device))
+            if self.vote_versions.get(vote['vote']['id'], self.start_version) > since \
+                    or (own_ballot is not None and own_ballot['timestamp'] * 1000000 > since):
+                votes.append(self.prepare_for_transmission(vote, device))
+
+        with self.index_lock:
+            closed = [
+                vote_id for vote_id, vote_version in self.vote_versions.items()
+                if vote_version > since and self.vote_secrets.get(vote_id) == ''
+            ]
+            cancelled = [vote_id for vote_id, vote_version in self.cancelled_votes.items() if vote_version > since]
+
+        return {'version': version, 'reset': False, 'votes': votes, 'closed': closed, 'cancelled': cancelled}
+
+    def get_active_vote_list(self) -> List[VoteAndBallots]:
+        """Gets all currently active votes in their in-memory representation, ordered by deadline."""
+        results = []
+        for _, vote_id in self.open_votes:
+            vote = self.votes.get(vote_id)
+            if vote is not None and is_vote_active(vote, self.clock()):
+                results.append(vote)
+        return results
+
+    def get_vote(self, vote_id: VoteId, device: RegisteredDevice, offset: int = 0, limit: Optional[int] = None) -> Vote:
+        """Gets a vote. `offset` and `limit` select a page of its ballots."""
         try:
-            return self.prepare_for_transmission(self.votes[vote_id], device)
+            return self.prepare_for_transmission(self.votes[vote_id], device, offset, limit)
         except KeyError:
             send_to_log(f'Attempted to get nonexistent vote {vote_id}', name='votes')
             raise
 
+    def get_serialized_vote(self, vote_id: VoteId, device: RegisteredDevice) -> Optional[SerializedResponse]:
+        """Gets a vote as a serialized response. The parts of a vote that all devices see are
+           serialized once and cached; a device's own ballot is spliced in. Returns None for closed
+           votes that are too large to be kept in serialized form; those are best streamed."""
+        try:
+            vote = self.votes[vote_id]
+        except KeyError:
+            send_to_log(f'Attempted to get nonexistent vote {vote_id}', name='votes')
+            raise
+
+        if is_vote_active(vote, self.clock()):
+            return self.splice_own_ballot(self.get_serialized_header(vote), vote, device)
+        elif self.vote_secrets.get(vote_id):
+            # The vote is being closed.
+            return SerializedResponse(serialize(self.prepare_for_transmission(vote, device)))
+        elif len(vote['ballots']) > MAX_CACHED_BALLOTS:
+            return None
+        else:
+            return self.responses.get_json(('vote', vote_id), lambda: expand_vote(vote))
+
+    def get_serialized_active_votes(self, device: RegisteredDevice) -> SerializedResponse:
+        """Gets all currently active votes as a serialized response. Devices that have not voted
+           in any of them share a cached listing."""
+        votes = self.get_active_vote_list()
+        if not any(self.get_own_ballot(vote, device) is not None for vote in votes):
+            return self.responses.get('active-votes', lambda: join_responses([
+                self.get_serialized_header(vote) for vote in self.get_active_vote_list()
+            ]))
+
+        return join_responses([
+            self.splice_own_ballot(self.get_serialized_header(vote), vote, device) for vote in votes
+        ])
+
+    def get_serialized_all_votes(self) -> SerializedResponse:
+        """Gets all votes, without their ballots, as a serialized response."""
+        return self.responses.get_json('all-votes', self.get_all_votes)
+
+    def get_vote_etag(self, vote_id: VoteId, device: RegisteredDevice) -> str:
+        """Gets an entity tag for a vote as `get_vote` would return it to a device. It changes
+           whenever the vote does, and when the device's user casts a ballot in it. Must be read
+           before the vote itself."""
+        version = self.vote_versions.get(vote_id, self.start_version)
+        if not self.vote_secrets.get(vote_id):
+            # Closed votes need not be loaded. Nothing about them depends on the device.
+            if vote_id not in self.vote_secrets:
+                raise KeyError(vote_id)
+            return f'{version}'
+
+        vote = self.votes[vote_id]
+        own_ballot = vote['ballots'].get(self.get_ballot_id(vote_id, device)) if is_vote_active(vote, self.clock()) else None
+        return f'{version}' if own_ballot is None else f'{version}-{own_ballot["timestamp"]}'
+
+    def get_active_votes_etag(self, device: RegisteredDevice) -> str:
+        """Gets an entity tag for the active votes as `get_active_votes` would return them to a
+           device. Must be read before the votes themselves."""
+        version = self.version
+        hash_obj = None
+        for vote in self.get_active_vote_list():
+            own_ballot = vote['ballots'].get(self.get_ballot_id(vote['vote']['id'], device))
+            if own_ballot is not None:
+                hash_obj = hash_obj or SHA3_256.new()
+                hash_obj.update(f'{vote["vote"]["id"]}:{own_ballot["timestamp"]};'.encode('utf-8'))
+
+        return f'{version}' if hash_obj is None else f'{version}-{hash_obj.hexdigest()[:16]}'
+
+    def get_all_votes_etag(self) -> str:
+        """Gets an entity tag for the list of all votes. Must be read before the list itself."""
+        return f'{self.version}'
+
+    def get_serialized_header(self, vote: VoteAndBallots) -> SerializedResponse:
+        """Gets an active vote as it is sent to devices that have not voted in it yet."""
+        return self.responses.get_json(('header', vote['vote']['id']), lambda: {'vote': vote['vote'], 'ballots': []})
+
+    def splice_own_ballot(
+            self,
+            response: SerializedResponse,
+            vote: VoteAndBallots,
+            device: RegisteredDevice) -> SerializedResponse:
+        """Adds a device's own ballot to a serialized active vote, if the device voted."""
+        own_ballot = self.get_own_ballot(vote, device)
+        return response if own_ballot is None else response.splice('ownBallot', own_ballot)
+
+    def stream_vote(
+            self,
+            vote_id: VoteId,
+            device: RegisteredDevice,
+            offset: int = 0,
+            limit: Optional[int] = None) -> Iterator[str]:
+        """Gets a vote as a sequence of JSON fragments. A closed vote's ballots are serialized in
+           chunks as the fragments are consumed, so the memory needed to send a vote does not grow
+           with its number of ballots. Other votes are serialized in one go."""
+        if self.vote_secrets.get(vote_id):
+            return iter([json.dumps(self.get_vote(vote_id, device, offset, limit))])
+
+        try:
+            vote = self.votes[vote_id]
+        except KeyError:
+            send_to_log(f'Attempted to get nonexistent vote {vote_id}', name='votes')
+            raise
+
+        return stream_closed_vote(vote, offset, limit)
+
+    def get_results(self, vote_id: VoteId) -> Any:
+        """Tallies a vote's ballots. Only votes whose deadline has passed can be tallied. The
+           results of closed votes are computed once and cached, both in memory and in storage.
+           Expensive tallies run in the tally pool; until they finish, this returns the status of
+           their job instead."""
+        vote = self.votes[vote_id]
+        if is_vote_active(vote, self.clock()):
+            return {'error': 'Vote is still active.'}
+        elif self.vote_secrets.get(vote_id):
+            # The vote has not been closed yet, so a ballot may still be in the process of being cast.
+            with self.get_vote_lock(vote_id):
+                return {'outcome': tally(vote)}
+
+        key = self.get_results_key(vote)
+        cached = self.results.get(vote_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        with self.get_vote_lock(vote_id):
+            # Another thread may have computed the results while this one was waiting for the lock.
+            vote = self.votes[vote_id]
+            key = self.get_results_key(vote)
+            cached = self.results.get(vote_id)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+
+            stored = self.storage.read_results(vote_id)
+            if stored is not None and stored['key'] == key:
+                results = stored['results']
+            elif self.tally_pool is not None and is_pooled(vote):
+                # The tally is counted in the background. Clients poll its job for the outcome.
+                status = self.start_tally(vote).get_status()
+                if status['status'] != 'done':
+                    return status
+                results = {'outcome': status['outcome']}
+            else:
+                results = {'outcome': tally(vote)}
+                self.write_results(vote_id, {'key': key, 'results': results})
+
+            self.results[vote_id] = (key, results)
+            return results
+
+    def start_tally(self, vote: VoteAndBallots) -> TallyJob:
+        """Submits a closed vote's tally to the tally pool. The job's ID is the key of the results
+           it computes, so a vote whose tally is already underway is not tallied twice."""
+        vote_id = vote['vote']['id']
+        key = self.get_results_key(vote)
+        return self.tally_pool.submit(key, vote, lambda outcome: self.store_results(vote_id, key, {'outcome': outcome}))
+
+    def store_results(self, vote_id: VoteId, key: str, results: Any):
+        """Caches a closed vote's results once its tally job finishes, unless the vote changed
+           in the meantime."""
+        with self.get_vote_lock(vote_id):
+            if self.get_results_key(self.votes[vote_id]) == key:
+                self.results[vote_id] = (key, results)
+                self.write_results(vote_id, {'key': key, 'results': results})
+
+    def get_tally_job(self, job_id: str) -> Optional[Any]:
+        """Gets the status of a tally job, or None if there is no such job."""
+        job = self.tally_pool.get_job(job_id) if self.tally_pool is not None else None
+        return job.get_status() if job is not None else None
+
+    def get_live_tally(self, vote_id: VoteId) -> Any:
+        """Gets an open vote's current standings and the outcome it would have if it closed now."""
+        with self.get_vote_lock(vote_id):
+            vote = self.votes[vote_id]
+            live_tally = self.live_tallies.get(vote_id)
+            if live_tally is None:
+                return {'error': 'Vote is closed or cannot be tallied live.'}
+
+            return {
+                'standings': live_tally.get_standings(vote),
+                'outcome': live_tally.get_outcome(vote)
+            }
+
+    def get_results_key(self, vote: VoteAndBallots) -> str:
+        """Computes the key under which a closed vote's results are cached. It changes whenever the
+           vote's ballots, options, resignations or tallying parameters do."""
+        vote_id = vote['vote']['id']
+        ballot_digest = self.ballot_digests.get(vote_id)
+        if ballot_digest is None:
+            ballot_digest = self.ballot_digests[vote_id] = hash_ballots(vote)
+        return get_results_key(vote, ballot_digest)
+
     def get_suspicious_ballots_report(self, vote_id: VoteId) -> List[SuspiciousBallot]:
         """Gets the suspicious ballot report for `vote_id`."""
-        self.heartbeat()
         return self.suspicious_ballots.get(vote_id, [])
 
     def cast_ballot(self, vote_id: VoteId, ballot: Ballot, device: RegisteredDevice) -> Ballot:
         """Casts a ballot."""
-        self.heartbeat()
+        with self.get_vote_lock(vote_id):
+            vote = self.votes[vote_id]
+            if not is_vote_active(vote, self.clock()):
+                return {'error': 'Vote already closed. Sorry!'}
 
-        vote = self.votes[vote_id]
-        if not is_vote_active(vote):
-            return {'error': 'Vote already closed. Sorry!'}
+            field = BALLOT_FIELDS[get_ballot_kind(vote['vote']['type'])]
+            if field not in ballot:
+                return {'error': f'Ballot must have a {field} field.'}
+
+            ballot_id = self.get_ballot_id(vote_id, device)
+            try:
+                ballot = compact_ballot({**ballot, 'id': ballot_id, 'timestamp': time.time()}, vote)
+            except TypeError:
+                return {'error': 'Ratings must be integers.'}
 
-        ballot_id = self.get_ballot_id(vote_id, device)
-        vote['ballots'] = [ballot for ballot in vote['ballots'] if ballot['id'] != ballot_id]
-        ballot['id'] = ballot_id
-        ballot['timestamp'] = time.time()
+            self.ballot_to_voter_index[vote_id][ballot_id] = device.user_id
 
-        self.check_if_suspicious(vote_id, ballot, device)
+            self.check_if_suspicious(vote_id, ballot, device)
+            self.index_voter_devices(vote_id, device.user_id)
 
-        vote['ballots'].append(ballot)
-        self.write_vote(vote)
+            # Update the live tally first, so a ballot it cannot count is never stored.
+            replaced = vote['ballots'].get(ballot_id)
+            live_tally = self.live_tallies.get(vote_id)
+            if live_tally is not None:
+                live_tally.cast(vote, ballot, replaced)
 
-        return ballot
+            vote['ballots'].pop(ballot_id, None)
+            vote['ballots'][ballot_id] = ballot
+            self.journal_ballot(vote, ballot)
+
+            self.schedule_turnout_event(vote_id)
+            return expand_ballot(ballot, vote)
 
     def check_if_suspicious(self, vote_id: VoteId, ballot: Ballot, device: RegisteredDevice):
         """Checks if `ballot` looks suspicious. Suspicion is cast when another voter seems to have
            cast a ballot already from the same device."""
         vote = self.votes[vote_id]
 
-        persistent_id = device.persistent_id()
-        visitor_id = device.visitor_id()
-
-        # Iterate through all other ballots and check if they seem to be originating from the same
-        # source.
-        for other_ballot in vote['ballots']:
-            if other_ballot['id'] == ballot['id']:
+        # Look up other voters whose devices share an identifier with `device`.
+        candidates = [
+            (self.persistent_id_index, device.persistent_id()),
+            (self.visitor_id_index, device.visitor_id())
+        ]
+        for device_index, key in candidates:
+            if key is None:
                 continue
 
-            voter_id = self.find_voter(vote_id, other_ballot)
-            if voter_id == None:
-                continue
+            for voter_id, other_device in device_index[vote_id].get(key, {}).items():
+                if voter_id == device.user_id:
+                    continue
+
+                other_ballot = vote['ballots'].get(self.get_ballot_id(vote_id, voter_id))
+                if other_ballot is None:
+                    continue
 
-            for other_device in self.devices.users_to_devices.get(voter_id, []):
-                if other_device.persistent_id() == persistent_id or other_device.visitor_id() == visitor_id:
-                    self.log_suspicious_ballot(vote_id, ballot, other_ballot, device, other_device)
-                    return
+                self.log_suspicious_ballot(vote_id, ballot, other_ballot, device, other_device)
+                return
 
     def log_suspicious_ballot(
         self,
@@ -162,152 +617,170 @@ class VoteIndex(object):
         second_device: RegisteredDevice):
         """Logs the arrival of a suspicious ballot."""
 
+        vote = self.votes[vote_id]
         report = {
-            'firstBallot': first_ballot,
-            'secondBallot': second_ballot,
+            'firstBallot': expand_ballot(first_ballot, vote) or ballot_to_json(first_ballot),
+            'secondBallot': expand_ballot(second_ballot, vote) or ballot_to_json(second_ballot),
             'firstDevice': first_device.to_json(),
             'secondDevice': second_device.to_json()
         }
 
-        self.suspicious_ballots.setdefault(vote_id, []).append(report)
-        self.write_suspicious_ballots()
+        with self.index_lock:
+            self.suspicious_ballots.setdefault(vote_id, []).append(report)
+            if self.storage.appends_suspicious_ballots:
+                self.storage.append_suspicious_ballot(vote_id, report)
+            else:
+                self.write_suspicious_ballots()
 
     def find_voter(self, vote_id: VoteId, ballot: Ballot) -> Optional[str]:
-        """Finds the user that cast `ballot`."""
-        ballot_id = ballot['id']
-        memoized_result = self.ballot_to_voter_cache[vote_id].get(ballot_id)
-        if memoized_result:
-            return memoized_result
-
-        for user_id in self.devices.users_to_devices.keys():
-            if ballot_id == self.get_ballot_id(vote_id, user_id):
-                self.ballot_to_voter_cache[vote_id][ballot_id] = user_id
-                return user_id
-
-        return None
+        """Finds the user that cast `ballot`. Voters can only be found for active votes."""
+        return self.ballot_to_voter_index[vote_id].get(ballot['id'])
 
     def add_option(self, vote_id: VoteId, option, device: RegisteredDevice) -> Vote:
         """Adds a vote option to a vote that may already be active."""
-        self.heartbeat()
-
-        vote_and_ballots = self.votes[vote_id]
-        vote = vote_and_ballots['vote']
-        if not is_vote_active(vote_and_ballots):
-            return {'error': 'Vote already closed. Sorry!'}
-        elif any(opt['id'] == option['id'] for opt in vote['options']):
-            return {'error': f'A vote option with ID {option["id"]} already exists.'}
-
-        vote['options'].append(option)
-
-        if 'min' in vote['type']:
-            # Fix all ballots by autofilling them with a rating of zero
-            # for the new candidate.
-            for ballot in vote_and_ballots['ballots']:
-                ballot['ratingPerOption'].append({
-                    'optionId': option['id'],
-                    'rating': vote['type']['min']
-                })
-
-        # Write the updated vote to disk.
-        self.write_vote(vote_and_ballots)
-
-        # Transmit the new vote.
-        return self.prepare_for_transmission(vote_and_ballots, device)['vote']
+        with self.get_vote_lock(vote_id):
+            vote_and_ballots = self.votes[vote_id]
+            vote = vote_and_ballots['vote']
+            if not is_vote_active(vote_and_ballots, self.clock()):
+                return {'error': 'Vote already closed. Sorry!'}
+            elif any(opt['id'] == option['id'] for opt in vote['options']):
+                return {'error': f'A vote option with ID {option["id"]} already exists.'}
+
+            # Give the new candidate a slot in the option table. Ballots are left alone; ballots
+            # that were cast before the candidate was added rate it with the minimal rating.
+            # Readers do not lock, so the option table must be updated before the vote itself.
+            vote_and_ballots['optionTable'] = vote_and_ballots['optionTable'] + [option['id']]
+            vote_and_ballots['vote'] = {**vote, 'options': vote['options'] + [option]}
+
+            # Write the updated vote to disk.
+            self.write_header(vote_and_ballots)
+            self.write_summary(vote_and_ballots)
+
+            # Transmit the new vote.
+            version = self.bump_version(vote_id)
+            self.events.publish('option-added', {'voteId': vote_id, 'option': option}, version)
+            return self.prepare_for_transmission(vote_and_ballots, device)['vote']
 
     def edit_vote(self, vote: Vote, device: RegisteredDevice) -> Vote:
         """Edits a vote. The ballot type must not change."""
-        self.heartbeat()
-
-        vote_and_ballots = self.votes[vote['id']]
-        old_vote = vote_and_ballots['vote']
-
-        old_option_ids = [opt['id'] for opt in old_vote['options']]
-        new_option_ids = [opt['id'] for opt in vote['options']]
-
-        if old_option_ids != new_option_ids and old_vote['deadline'] < time.time():
-            return {'error': 'Candidates cannot be added or removed after the election has ended.'}
-        elif get_ballot_kind(old_vote['type']) != get_ballot_kind(vote['type']):
-            return {
-                'error': f'Cannot change ballots of type {get_ballot_kind(old_vote["type"])} '
-                         f'to type {get_ballot_kind(vote["type"])}.'
-            }
-
-        # Update the vote.
-        vote_and_ballots['vote'] = vote
-
-        # Add/remove candidates from ballots.
-        added_candidates = set(new_option_ids).difference(old_option_ids)
-        removed_candidates = set(old_option_ids).difference(new_option_ids)
-
-        new_ballots = []
-        for ballot in vote_and_ballots['ballots']:
-            if 'ratingPerOption' in ballot:
-                # Remove deleted candidates.
-                ratings = [r for r in ballot['ratingPerOption'] if r['optionId'] not in removed_candidates]
-
-                # Add new candidates by giving them the minimal score.
-                for candidate_id in added_candidates:
-                    ratings.append({
-                        'optionId': candidate_id,
-                        'rating': vote['type']['min']
-                    })
-
-                # Update ballot.
-                ballot['ratingPerOption'] = ratings
-                new_ballots.append(ballot)
-            elif 'selectedOptionId' in ballot and ballot['selectedOptionId'] in removed_candidates:
-                # Drop ballots that voted only for a removed candidate.
-                pass
-            else:
-                new_ballots.append(ballot)
-
-        # Write the updated vote to disk.
-        self.write_vote(vote_and_ballots)
-
-        # Transmit the new vote.
-        return self.prepare_for_transmission(vote_and_ballots, device)['vote']
+        with self.get_vote_lock(vote['id']):
+            vote_and_ballots = self.votes[vote['id']]
+            old_vote = vote_and_ballots['vote']
+
+            old_option_ids = [opt['id'] for opt in old_vote['options']]
+            new_option_ids = [opt['id'] for opt in vote['options']]
+
+            if old_option_ids != new_option_ids and old_vote['deadline'] < self.clock():
+                return {'error': 'Candidates cannot be added or removed after the election has ended.'}
+            elif get_ballot_kind(old_vote['type']) != get_ballot_kind(vote['type']):
+                return {
+                    'error': f'Cannot change ballots of type {get_ballot_kind(old_vote["type"])} '
+                             f'to type {get_ballot_kind(vote["type"])}.'
+                }
+
+            # Give new candidates a fresh slot in the option table. Removed candidates keep their
+            # slot, but are no longer transmitted. Ballots are resolved against the new options when
+            # they are read, so they need not change.
+            added_candidates = [option_id for option_id in new_option_ids if option_id not in old_option_ids]
+            vote_and_ballots['optionTable'] = vote_and_ballots['optionTable'] + added_candidates
+
+            # Update the vote. Live tallies depend on the tallying algorithm and rating range.
+            vote_and_ballots['vote'] = vote
+            if vote['type'] != old_vote['type'] and vote['id'] in self.live_tallies:
+                self.live_tallies[vote['id']] = create_live_tally(vote_and_ballots)
+            if vote['deadline'] != old_vote['deadline'] and self.vote_secrets.get(vote['id']):
+                self.untrack_open_vote(vote['id'], old_vote['deadline'])
+                self.track_open_vote(vote['id'])
+
+            # Write the updated vote to disk.
+            self.write_header(vote_and_ballots)
+            self.write_summary(vote_and_ballots)
+
+            # Transmit the new vote.
+            self.bump_version(vote_and_ballots['vote']['id'])
+            return self.prepare_for_transmission(vote_and_ballots, device)['vote']
 
     def mark_resignation(self, vote_id: VoteId, option_id: OptionId, device: RegisteredDevice) -> Vote:
         """Indicates that a candidate has resigned from their seat."""
-        self.heartbeat()
-
-        vote = self.votes[vote_id]
-        if is_vote_active(vote):
-            return {'error': 'Vote not closed yet.'}
-
-        resignations = vote['vote'].get('resigned', [])
-        if option_id in resignations:
-            return {'error': 'Candidate has already resigned.'}
-
-        # Make the candidate resign.
-        resignations.append(option_id)
-        vote['vote']['resigned'] = resignations
-        self.write_vote(vote)
-
-        # Return the vote.
-        return self.prepare_for_transmission(vote, device)['vote']
-
-    def prepare_for_transmission(self, vote: VoteAndBallots, device: RegisteredDevice) -> VoteAndBallots:
-        """Prepares a vote for transmission."""
-        self.heartbeat()
-        if is_vote_active(vote):
+        with self.get_vote_lock(vote_id):
+            vote = self.votes[vote_id]
+            if is_vote_active(vote, self.clock()):
+                return {'error': 'Vote not closed yet.'}
+
+            resignations = vote['vote'].get('resigned', [])
+            if option_id in resignations:
+                return {'error': 'Candidate has already resigned.'}
+
+            # Make the candidate resign.
+            vote['vote'] = {**vote['vote'], 'resigned': resignations + [option_id]}
+            self.write_header(vote)
+            self.write_summary(vote)
+
+            # Return the vote.
+            self.bump_version(vote_id)
+            return self.prepare_for_transmission(vote, device)['vote']
+
+    def prepare_for_transmission(
+            self,
+            vote: VoteAndBallots,
+            device: RegisteredDevice,
+            offset: int = 0,
+            limit: Optional[int] = None) -> VoteAndBallots:
+        """Prepares a vote for transmission. `offset` and `limit` select a page of a closed vote's
+           ballots."""
+        if is_vote_active(vote, self.clock()):
             result = {
                 'vote': vote['vote'],
                 'ballots': []
             }
-            ballot_id = self.get_ballot_id(vote['vote']['id'], device)
-            for ballot in vote['ballots']:
-                if ballot['id'] == ballot_id:
-                    result['ownBallot'] = ballot
-                    break
+            own_ballot = self.get_own_ballot(vote, device)
+            if own_ballot is not None:
+                result['ownBallot'] = own_ballot
 
             return result
+        elif self.vote_secrets.get(vote['vote']['id']):
+            # The vote's deadline has passed but the vote has not been closed yet, so a ballot may
+            # still be in the process of being cast.
+            with self.get_vote_lock(vote['vote']['id']):
+                return expand_vote(vote, offset, limit)
         else:
-            return vote
+            return expand_vote(vote, offset, limit)
+
+    def get_own_ballot(self, vote: VoteAndBallots, device: RegisteredDevice) -> Optional[Ballot]:
+        """Gets the ballot that a device's user cast in an active vote, as it is sent to clients."""
+        own_ballot = vote['ballots'].get(self.get_ballot_id(vote['vote']['id'], device))
+        return expand_ballot(own_ballot, vote) if own_ballot is not None else None
+
+    def bump_version(self, vote_id: VoteId) -> int:
+        """Records that a vote has changed. Must be called once the change is complete and the
+           responses that include the vote have been invalidated, so no client is ever sent a
+           stale response under a new version. Ballots cast in active votes do not change any
+           vote's version, since they are not part of the votes that clients see."""
+        with self.index_lock:
+            self.version = max(self.version + 1, time.time_ns() // 1000)
+            self.vote_versions[vote_id] = self.version
+            return self.version
+
+    def schedule_turnout_event(self, vote_id: VoteId):
+        """Schedules an event that reports a vote's turnout, unless one is scheduled already."""
+        with self.index_lock:
+            if vote_id in self.pending_turnout_events:
+                return
+            self.pending_turnout_events.add(vote_id)
+
+        self.scheduler.schedule(self.clock() + TURNOUT_EVENT_INTERVAL, self.publish_turnout, vote_id)
+
+    def publish_turnout(self, vote_id: VoteId):
+        """Broadcasts the number of ballots cast in a vote. Runs on the scheduler's thread."""
+        with self.index_lock:
+            self.pending_turnout_events.discard(vote_id)
+
+        vote = self.votes.get(vote_id)
+        if vote is not None:
+            self.events.publish('turnout', {'voteId': vote_id, 'ballots': len(vote['ballots'])})
 
     def get_ballot_id(self, vote_id: VoteId, user: Union[RegisteredDevice, UserId]) -> BallotId:
         """Gets a user's ballot ID for a particular vote."""
-        self.heartbeat()
         if not self.vote_secrets.get(vote_id):
             raise ValueError(f'Vote with ID {vote_id} either does not exist or is no longer active.')
 
@@ -325,7 +798,6 @@ class VoteIndex(object):
 
     def create_vote(self, proposal: Vote) -> Vote:
         """Creates a new vote based on a proposal."""
-        self.heartbeat()
         new_vote = proposal.copy()
 
         # Create an ID for the vote.
@@ -338,84 +810,319 @@ class VoteIndex(object):
 
         new_base_id = ''.join(new_id_parts)
 
-        if new_base_id in self.votes:
-            # If a vote with that name already exists, then we'll add a suffix.
-            dup_count = 1
-            while True:
-                dup_count += 1
-                new_id = f'{new_base_id}-{dup_count}'
-                if new_id not in self.votes:
-                    break
-        else:
-            new_id = new_base_id
+        with self.index_lock:
+            if new_base_id in self.vote_secrets:
+                # If a vote with that name already exists, then we'll add a suffix.
+                dup_count = 1
+                while True:
+                    dup_count += 1
+                    new_id = f'{new_base_id}-{dup_count}'
+                    if new_id not in self.vote_secrets:
+                        break
+            else:
+                new_id = new_base_id
 
-        new_vote['id'] = new_id
+            new_vote['id'] = new_id
 
-        self.votes[new_id] = {'vote': new_vote, 'ballots': []}
+            # A cancelled vote may have had the same ID. Whatever it left behind, like its journal,
+            # must not be replayed into the new vote.
+            self.storage.delete_vote(new_id)
+            self.journal_lengths.pop(new_id, None)
 
-        # Generate a secret.
-        secret_hash = SHA3_256.new(new_id.encode('utf-8'))
-        for _ in range(1, 20):
-            secret_hash.update(str(random.randint(0, 100000000)).encode('utf-8'))
+            self.votes[new_id] = {
+                'vote': new_vote,
+                'ballots': {},
+                'optionTable': create_option_table(new_vote),
+                'revision': 0
+            }
 
-        self.vote_secrets[new_id] = secret_hash.hexdigest()
-        self.write_vote(self.votes[new_id])
-        self.write_index()
+            # Generate a secret.
+            secret_hash = SHA3_256.new(new_id.encode('utf-8'))
+            for _ in range(1, 20):
+                secret_hash.update(str(random.randint(0, 100000000)).encode('utf-8'))
 
+            self.vote_secrets[new_id] = secret_hash.hexdigest()
+            self.responses.invalidate(('header', new_id), ('vote', new_id))
+            self.write_index()
+            self.write_summary(self.votes[new_id])
+            self.track_open_vote(new_id)
+            self.cancelled_votes.pop(new_id, None)
+            version = self.bump_version(new_id)
+            self.events.publish('vote-created', {'vote': new_vote}, version)
+            vote = self.votes[new_id]
+
+        # Votes are created and cancelled rarely, and a vote that is lost from the index cannot be
+        # recovered, so the vote and the index are written right away rather than at the next
+        # group commit. The writes go through the committer, which serializes them with group
+        # commits, and no lock is held, since the committer's writes take the vote and index locks.
+        self.committer.write_now(('vote', new_id), lambda: self.commit_vote(vote))
+        self.committer.write_now('vote-index', self.commit_index)
         return new_vote
 
     def cancel_vote(self, vote_id: VoteId) -> bool:
         """Cancels a vote."""
-        self.heartbeat()
-        if vote_id in self.votes:
+        with self.get_vote_lock(vote_id):
+            if vote_id not in self.vote_secrets:
+                return False
+
             vote = self.votes[vote_id]
-            if is_vote_active(vote):
+            if not is_vote_active(vote, self.clock()):
+                return False
+
+            self.untrack_open_vote(vote_id, vote['vote']['deadline'])
+            with self.index_lock:
                 del self.votes[vote_id]
                 del self.vote_secrets[vote_id]
+                self.summaries = {k: v for k, v in self.summaries.items() if k != vote_id}
                 self.write_index()
-                return True
-
-        return False
+                self.write_summaries()
+            self.responses.invalidate(('header', vote_id), ('vote', vote_id))
+            self.journal_lengths.pop(vote_id, None)
+
+            self.live_tallies.pop(vote_id, None)
+            self.ballot_id_cache.pop(vote_id, None)
+            self.ballot_to_voter_index.pop(vote_id, None)
+            self.persistent_id_index.pop(vote_id, None)
+            self.visitor_id_index.pop(vote_id, None)
+            self.bump_version(vote_id)
+            with self.index_lock:
+                self.cancelled_votes[vote_id] = self.vote_versions[vote_id]
+
+        # The index is written before the vote is deleted, so it never refers to a missing vote.
+        # Deleting the vote's ballots keeps them from resurfacing in a new vote with the same ID.
+        # Like in `create_vote`, both writes go through the committer without holding a lock.
+        self.committer.write_now('vote-index', self.commit_index)
+        self.committer.write_now(('vote', vote_id), lambda: self.delete_vote(vote_id))
+        return True
+
+    def delete_vote(self, vote_id: VoteId):
+        """Deletes a cancelled vote from storage, unless a new vote with the same ID was created
+           in the meantime."""
+        with self.index_lock:
+            if vote_id not in self.vote_secrets:
+                self.storage.delete_vote(vote_id)
 
     def write_index(self):
+        """Schedules the index itself to be written to disk. The set of open votes may have
+           changed, so the cached listing of active votes is dropped."""
+        self.responses.invalidate('active-votes')
+        self.committer.mark_dirty('vote-index', self.commit_index)
+
+    def commit_index(self):
         """Writes the index itself to disk."""
-        write_json(self.vote_secrets, self.index_path)
+        with self.index_lock:
+            vote_secrets = dict(self.vote_secrets)
+        self.storage.write_index(vote_secrets)
 
     def write_suspicious_ballots(self):
+        """Schedules suspicious ballot reports to be written to disk."""
+        self.committer.mark_dirty('suspicious-ballots', self.commit_suspicious_ballots)
+
+    def commit_suspicious_ballots(self):
         """Writes suspicious ballot reports to disk."""
-        write_json(self.suspicious_ballots, get_suspicious_ballots_path(self.index_path))
+        with self.index_lock:
+            suspicious_ballots = {k: list(v) for k, v in self.suspicious_ballots.items()}
+        self.storage.write_suspicious_ballots(suspicious_ballots)
+
+    def write_summary(self, vote: VoteAndBallots):
+        """Updates a vote's summary and schedules all summaries to be written to disk."""
+        with self.index_lock:
+            self.summaries = {**self.summaries, vote['vote']['id']: vote['vote']}
+            self.write_summaries()
+
+    def write_summaries(self):
+        """Schedules all vote summaries to be written to disk."""
+        self.responses.invalidate('all-votes')
+        self.committer.mark_dirty('vote-summaries', self.commit_summaries)
+
+    def commit_summaries(self):
+        """Writes all vote summaries to disk."""
+        self.storage.write_summaries(self.summaries)
 
     def write_vote(self, vote: VoteAndBallots):
-        """Writes a vote to disk."""
+        """Schedules a vote to be written to disk. This compacts the vote's ballot journal into
+           the snapshot."""
+        self.committer.mark_dirty(('vote', vote['vote']['id']), lambda: self.commit_vote(vote))
+
+    def commit_vote(self, vote: VoteAndBallots):
+        """Writes a vote to disk and compacts its ballot journal into the snapshot.
+
+           While holding the vote's lock, the journal is set aside and the vote's current ballots are
+           captured. Ballots cast from then on go to a fresh journal. Since ballots and votes are
+           never modified in place, the snapshot can then be written without holding the lock. The
+           journal that was set aside is deleted once the snapshot is safely on disk.
+
+           Storage without a journal has nothing to set aside, so the vote is written while the
+           lock is held. Ballots cast in the meantime could otherwise be overwritten by the
+           snapshot's older ballots, and the header of an edit by an older header."""
         vote_id = vote['vote']['id']
-        vote_path = vote_id_to_path(self.index_path, vote_id)
-        Path(vote_path).parent.mkdir(parents=True, exist_ok=True)
-        write_json(vote, vote_path)
+        with self.get_vote_lock(vote_id):
+            if vote_id not in self.vote_secrets:
+                # The vote was cancelled.
+                return
 
+            data = vote_to_json(vote)
+            if not self.storage.uses_journal:
+                self.storage.write_vote(vote_id, data)
+                return
 
-def vote_id_to_path(index_path: str, vote_id: VoteId) -> str:
-    """Takes a vote ID and an index path and turns it into a path to the location
-       where the vote's data is stored."""
-    return os.path.join(os.path.dirname(index_path), 'votes', vote_id) + '.json'
+            if self.journal_lengths[vote_id] > 0:
+                self.storage.prepare_vote_write(vote_id)
+                self.journal_lengths[vote_id] = 0
 
+        self.storage.write_vote(vote_id, data)
 
-def read_or_create_vote_index(path: str, devices: DeviceIndex) -> VoteIndex:
-    """Reads a vote index from a file; creates a blank vote index if
-       the file does not exist."""
-    try:
-        vote_secrets = read_json(path)
-    except FileNotFoundError:
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
-        return VoteIndex(path, devices, {}, {}, {})
+    def write_results(self, vote_id: VoteId, results: Any):
+        """Schedules a closed vote's tally results to be written to disk."""
+        self.committer.mark_dirty(('results', vote_id), lambda: self.storage.write_results(vote_id, results))
 
-    votes = {
-        vote_id: read_json(vote_id_to_path(path, vote_id))
-        for vote_id in vote_secrets.keys()
+    def write_header(self, vote: VoteAndBallots):
+        """Writes a vote's header and option table to storage without rewriting its ballots. Every
+           header that is written gets a new revision number."""
+        vote_id = vote['vote']['id']
+        vote['revision'] = vote['revision'] + 1
+        self.responses.invalidate(('header', vote_id), ('vote', vote_id), 'active-votes')
+        self.storage.append_header(vote_id, header_to_json(vote))
+        self.count_journal_record(vote)
+
+    def journal_ballot(self, vote: VoteAndBallots, ballot: Ballot):
+        """Appends a newly cast ballot to storage rather than rewriting the entire vote."""
+        self.storage.append_ballot(vote['vote']['id'], ballot_to_json(ballot))
+        self.count_journal_record(vote)
+
+    def count_journal_record(self, vote: VoteAndBallots):
+        """Counts a record that was appended to a vote's journal, if the storage keeps journals.
+           Journals are compacted once they grow large compared to the vote itself."""
+        if not self.storage.uses_journal:
+            return
+
+        vote_id = vote['vote']['id']
+        self.journal_lengths[vote_id] += 1
+
+        journal_length = self.journal_lengths[vote_id]
+        if journal_length >= JOURNAL_COMPACTION_THRESHOLD and journal_length >= len(vote['ballots']):
+            self.write_vote(vote)
+
+
+def estimate_vote_size(vote: VoteAndBallots) -> int:
+    """Estimates how much memory a vote takes up from the size of its JSON representation."""
+    return len(json.dumps(vote_to_json(vote)))
+
+
+def hash_ballots(vote: VoteAndBallots) -> str:
+    """Computes a digest of a vote's ballots and the option table they refer to."""
+    hash_obj = SHA3_256.new(json.dumps(vote['optionTable']).encode('utf-8'))
+    for ballot in vote['ballots'].values():
+        hash_obj.update(json.dumps(ballot_to_json(ballot), sort_keys=True).encode('utf-8'))
+    return hash_obj.hexdigest()
+
+
+def get_results_key(vote: VoteAndBallots, ballot_digest: str) -> str:
+    """Computes the key for a vote's tally results from a digest of its ballots and the parts of
+       its header that affect the tally."""
+    header = vote['vote']
+    hash_obj = SHA3_256.new(ballot_digest.encode('utf-8'))
+    hash_obj.update(json.dumps({
+        'id': header['id'],
+        'options': [option['id'] for option in header['options']],
+        'resigned': header.get('resigned', []),
+        'type': header['type']
+    }, sort_keys=True).encode('utf-8'))
+    return hash_obj.hexdigest()
+
+
+def stream_closed_vote(vote: VoteAndBallots, offset: int = 0, limit: Optional[int] = None) -> Iterator[str]:
+    """Serializes a closed vote as it is sent to clients, one chunk of ballots at a time. The
+       fragments join up to the JSON representation of `expand_vote(vote, offset, limit)`."""
+    yield '{"vote": ' + json.dumps(vote['vote']) + ', "ballots": ['
+    separator = ''
+    chunk = []
+    for ballot in expand_ballots(vote, offset, limit):
+        chunk.append(json.dumps(ballot))
+        if len(chunk) == BALLOT_STREAM_CHUNK_SIZE:
+            yield separator + ', '.join(chunk)
+            separator = ', '
+            chunk = []
+
+    if chunk:
+        yield separator + ', '.join(chunk)
+    yield ']}'
+
+
+def vote_to_json(vote: VoteAndBallots) -> VoteAndBallots:
+    """Turns a vote as it is kept in memory into the JSON representation that is stored on disk. In
+       memory, ballots are indexed by their ID; in JSON, they are a list in the order in which they
+       were cast."""
+    return {
+        **header_to_json(vote),
+        'ballots': [ballot_to_json(ballot) for ballot in vote['ballots'].values()]
     }
 
-    try:
-        suspicious_ballots = read_json(get_suspicious_ballots_path(path))
-    except FileNotFoundError:
-        suspicious_ballots = {}
 
-    return VoteIndex(path, devices, votes, vote_secrets, suspicious_ballots)
+def header_to_json(vote: VoteAndBallots) -> Any:
+    """Gets the parts of a vote that change when the vote is edited: the vote itself, its option
+       table and its revision number."""
+    return {'vote': vote['vote'], 'optionTable': vote['optionTable'], 'revision': vote['revision']}
+
+
+def vote_from_json(data: VoteAndBallots) -> VoteAndBallots:
+    """Turns a vote's JSON representation into the representation that is kept in memory. Votes
+       that were stored without an option table get one based on their current options."""
+    vote = {
+        'vote': data['vote'],
+        'ballots': {},
+        'optionTable': data.get('optionTable') or create_option_table(data['vote']),
+        'revision': data.get('revision', 0)
+    }
+    vote['ballots'] = {ballot['id']: ballot_from_json(ballot, vote) for ballot in data['ballots']}
+    return vote
+
+
+def read_vote(storage: VoteStorage, vote_id: VoteId) -> Tuple[VoteAndBallots, int]:
+    """Reads a vote from storage. Returns the vote in its in-memory representation and the number
+       of ballots that were replayed from its journal."""
+    vote, journal_length = storage.read_vote(vote_id)
+    return vote_from_json(vote), journal_length
+
+
+def read_or_create_vote_index(
+        storage: VoteStorage,
+        devices: DeviceIndex,
+        cache_budget: int = DEFAULT_CLOSED_VOTE_CACHE_BUDGET,
+        tally_pool: Optional[TallyPool] = None,
+        scheduler: Optional[DeadlineScheduler] = None) -> VoteIndex:
+    """Reads a vote index from storage; creates a blank vote index if
+       there is none yet. Only open votes are read eagerly."""
+    vote_secrets = storage.read_index()
+    if vote_secrets is None:
+        return VoteIndex(storage, devices, {}, {}, {}, cache_budget=cache_budget, tally_pool=tally_pool, scheduler=scheduler)
+
+    summaries = storage.read_summaries() or {}
+
+    votes = {}
+    journal_lengths = {}
+    missing_summaries = False
+    for vote_id, secret in vote_secrets.items():
+        if secret:
+            votes[vote_id], journal_lengths[vote_id] = read_vote(storage, vote_id)
+            summaries[vote_id] = votes[vote_id]['vote']
+        elif vote_id not in summaries:
+            # Summaries are created on the fly for votes that predate the summary manifest.
+            summaries[vote_id] = read_vote(storage, vote_id)[0]['vote']
+            missing_summaries = True
+
+    summaries = {vote_id: summaries[vote_id] for vote_id in vote_secrets}
+    if missing_summaries:
+        storage.write_summaries(summaries)
+
+    return VoteIndex(
+        storage,
+        devices,
+        votes,
+        vote_secrets,
+        storage.read_suspicious_ballots(),
+        journal_lengths,
+        summaries,
+        cache_budget,
+        tally_pool,
+        scheduler)
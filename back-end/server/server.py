@@ -9,16 +9,20 @@ from typing import List
 
 import praw
 import prawcore.exceptions
-from flask import Flask, request, redirect, send_from_directory, jsonify, abort
+from flask import Flask, Response, request, redirect, send_from_directory, jsonify, abort
 from werkzeug.exceptions import NotFound
 from werkzeug.urls import url_encode
 
 from .api.core import create_core_blueprint, get_auth_level, authenticate
 from .api.election_management import create_election_management_blueprint
 from .persistence.authentication import read_or_create_device_index, RegisteredDevice, Permission
+from .persistence.commit import GroupCommitter, DEFAULT_COMMIT_INTERVAL, DEFAULT_FSYNC_POLICY
+from .persistence.events import KEEP_ALIVE_SECONDS, RECONNECT_MILLISECONDS
 from .persistence.helpers import write_json, send_to_log
-from .persistence.votes import read_or_create_vote_index
+from .persistence.storage import open_storage, DEFAULT_STORAGE
+from .persistence.votes import read_or_create_vote_index, DEFAULT_CLOSED_VOTE_CACHE_BUDGET
 from .scrape import scrape_cfc
+from .tally.workers import TallyPool, DEFAULT_TALLY_WORKERS
 
 DEFAULT_STATIC_FOLDER = os.path.join(
     os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
@@ -36,11 +40,21 @@ def create_app(config, bottle_path, data_path='data', static_folder=DEFAULT_STAT
     log.disabled = not log_status
 
     Path(data_path).mkdir(parents=True, exist_ok=True)
-    device_index = read_or_create_device_index(
-        os.path.join(data_path, 'device-index.json'),
-        config.get('voter-requirements', [])
+    committer = GroupCommitter(
+        config.get('commit-interval', DEFAULT_COMMIT_INTERVAL),
+        config.get('fsync-policy', DEFAULT_FSYNC_POLICY)
+    )
+    committer.stop_at_exit()
+    vote_storage, device_storage = open_storage(config.get('storage', DEFAULT_STORAGE), data_path, committer)
+    device_index = read_or_create_device_index(device_storage, config.get('voter-requirements', []))
+    device_index.start_reaper()
+    tally_workers = config.get('tally-workers', DEFAULT_TALLY_WORKERS)
+    vote_index = read_or_create_vote_index(
+        vote_storage,
+        device_index,
+        config.get('closed-vote-cache-budget', DEFAULT_CLOSED_VOTE_CACHE_BUDGET),
+        TallyPool(tally_workers) if tally_workers > 0 else None
     )
-    vote_index = read_or_create_vote_index(os.path.join(data_path, 'vote-index.json'), device_index)
 
     def get_json_arg(req, key: str):
         try:
@@ -58,6 +72,34 @@ def create_app(config, bottle_path, data_path='data', static_folder=DEFAULT_STAT
     def get_client_id():
         return jsonify(config['webapp-credentials']['client_id'])
 
+    # Add `/api/core/events` as a special case since its responses stream for as long as clients
+    # stay connected.
+    @app.route('/api/core/events')
+    def stream_events():
+        """Streams changes to votes as server-sent events: vote-created, option-added, vote-closed
+           and turnout. Browsers' EventSource cannot send a request body, so the device ID is
+           passed as a query argument."""
+        if not authenticate(request, device_index, permission=Permission.VOTE_VIEW):
+            abort(403)
+
+        subscription = vote_index.events.subscribe()
+        if subscription is None:
+            abort(503)
+
+        def generate():
+            try:
+                yield f'retry: {RECONNECT_MILLISECONDS}\n\n'
+                while not subscription.closed:
+                    message = subscription.get(KEEP_ALIVE_SECONDS)
+                    yield ': keep-alive\n\n' if message is None else message
+            finally:
+                vote_index.events.unsubscribe(subscription)
+
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     # Register the election management APIs.
     app.register_blueprint(
         create_election_management_blueprint(device_index, vote_index),
@@ -107,9 +149,23 @@ def create_app(config, bottle_path, data_path='data', static_folder=DEFAULT_STAT
 
         # Ask the manager to upgrade and restart us after we shut down.
         write_json({'action': 'restart'}, bottle_path)
+        device_index.stop_reaper()
+        committer.stop()
+        if vote_index.tally_pool is not None:
+            vote_index.tally_pool.stop()
         os._exit(0)
         return jsonify({})
 
+    @app.route('/api/optional/metrics', methods=['POST'])
+    def process_get_metrics():
+        if not authenticate(request, device_index, permission=Permission.ADMINISTRATION_VIEW_METRICS):
+            abort(403)
+
+        return jsonify({
+            'persistence': committer.metrics(),
+            'devices': device_index.metrics()
+        })
+
     @app.route('/reddit-auth')
     def process_auth():
         # Make sure that there's been no error.
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+"""First-past-the-post: the options with the most votes win."""
+
+import numpy as np
+from typing import Any, List, Optional
+from .matrices import get_choice_counts, get_option_ids
+
+OptionId = str
+VoteAndBallots = Any
+
+
+def elect_by_count(counts: np.ndarray, option_ids: List[OptionId], seats: int) -> List[OptionId]:
+    """Elects the `seats` options with the highest vote counts. Ties are broken in favor of the
+       option with the lexicographically smallest ID."""
+    # np.argmax picks the first maximum, so sorting the candidates by ID breaks ties.
+    candidates = sorted(range(len(option_ids)), key=lambda column: option_ids[column])
+    results = []
+    while len(results) < seats and candidates:
+        winner = candidates.pop(int(np.argmax(counts[candidates])))
+        results.append(option_ids[winner])
+    return results
+
+
+def tally_fptp(vote: VoteAndBallots, seats: Optional[int] = None) -> List[OptionId]:
+    """Tallies a first-past-the-post vote."""
+    counts, _ = get_choice_counts(vote)
+    return elect_by_count(counts, get_option_ids(vote), seats or vote['vote']['type'].get('positions') or 1)
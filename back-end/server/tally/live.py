@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""Live tallies of open votes. A live tally accumulates the statistics a tallying algorithm needs
+   as ballots are cast, so a vote's current standing and its outcome at close can be read without
+   recounting its ballots.
+
+   Statistics are kept per option table slot rather than per option, so editing a vote's options
+   never touches them: options that are added later start out with every earlier ballot's minimal
+   rating, and removed options are simply no longer read."""
+
+import numpy as np
+from typing import Any, Dict, List, Optional
+from ..persistence.ballots import get_option_slots
+from .fptp import elect_by_count
+from .matrices import get_option_ids
+from .outcomes import VoteOutcome, individual_to_party
+from .sainte_lague import allocate_seats
+from .simdem_sainte_lague import allocate_simdem_seats
+from .star import StarTally, elect_star
+
+OptionId = str
+VoteAndBallots = Any
+Ballot = Any
+
+
+def get_cast_slot(option_table: List[OptionId], ballot: Ballot) -> Optional[int]:
+    """Gets the option table slot a choose-one ballot was cast for, if any."""
+    return get_option_slots(option_table[:ballot['optionVersion']]).get(ballot['selectedOptionId'])
+
+
+class LiveChoiceTally(object):
+    """A live tally of a choose-one vote: the number of ballots cast for every slot."""
+
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+
+        # Ballots for options that were not part of the vote when they were cast. They count
+        # towards the number of ballots cast until the option is added.
+        self.unknown_choices: Dict[OptionId, int] = {}
+
+    def cast(self, vote: VoteAndBallots, ballot: Ballot, replaced: Optional[Ballot]):
+        """Updates the tally when `ballot` is cast, replacing `replaced`."""
+        option_table = vote['optionTable']
+        if len(self.counts) < len(option_table):
+            self.counts = np.concatenate([self.counts, np.zeros(len(option_table) - len(self.counts), dtype=np.int64)])
+
+        if replaced is not None:
+            self.count(option_table, replaced, -1)
+        self.count(option_table, ballot, 1)
+
+    def count(self, option_table: List[OptionId], ballot: Ballot, weight: int):
+        slot = get_cast_slot(option_table, ballot)
+        if slot is not None:
+            self.counts[slot] += weight
+        else:
+            option_id = ballot['selectedOptionId']
+            self.unknown_choices[option_id] = self.unknown_choices.get(option_id, 0) + weight
+
+    def get_counts(self, vote: VoteAndBallots):
+        """Gets the number of ballots cast for every current option, excluding ballots for
+           resigned candidates, and the number of ballots that count."""
+        slots = get_option_slots(vote['optionTable'])
+        option_ids = get_option_ids(vote)
+        counts = np.array([self.counts[slots[option_id]] if slots[option_id] < len(self.counts) else 0
+                           for option_id in option_ids], dtype=np.int64)
+        ballot_count = int(counts.sum()) + sum(
+            count for option_id, count in self.unknown_choices.items() if option_id not in slots)
+
+        resigned = vote['vote'].get('resigned') or []
+        counts[[column for column, option_id in enumerate(option_ids) if option_id in resigned]] = 0
+        return counts, ballot_count
+
+    def get_standings(self, vote: VoteAndBallots) -> Any:
+        counts, ballot_count = self.get_counts(vote)
+        return {
+            'ballots': ballot_count,
+            'counts': dict(zip(get_option_ids(vote), counts.tolist()))
+        }
+
+    def get_outcome(self, vote: VoteAndBallots) -> VoteOutcome:
+        counts, ballot_count = self.get_counts(vote)
+        option_ids = get_option_ids(vote)
+        ballot_type = vote['vote']['type']
+        algorithm = ballot_type['tally']
+        if algorithm == 'first-past-the-post':
+            return individual_to_party(elect_by_count(counts, option_ids, ballot_type.get('positions') or 1))
+        elif algorithm == 'sainte-lague':
+            return allocate_seats(counts, option_ids, ballot_type.get('positions') or 1)
+        else:
+            return allocate_simdem_seats(counts, ballot_count, option_ids, ballot_type.get('positions'))
+
+
+class LiveStarTally(object):
+    """A live tally of a STAR vote: every slot's total score and the number of ballots that rate
+       one slot higher than another."""
+
+    def __init__(self, ballot_type: Any):
+        self.minimum = ballot_type['min']
+        self.ballot_count = 0
+        self.scores = np.zeros(0, dtype=np.int64)
+        self.preferences = np.zeros((0, 0), dtype=np.int64)
+
+        # The number of ballots that rate each slot above the minimum. Slots that are added later
+        # are rated the minimum by all earlier ballots, so these are exactly the ballots that
+        # prefer an existing slot over a new one.
+        self.above_minimum = np.zeros(0, dtype=np.int64)
+
+    def grow(self, size: int):
+        """Extends the tally to an option table of `size` slots."""
+        old_size = len(self.scores)
+        if size <= old_size:
+            return
+
+        added = size - old_size
+        self.scores = np.concatenate([self.scores, np.full(added, self.minimum * self.ballot_count, dtype=np.int64)])
+        preferences = np.zeros((size, size), dtype=np.int64)
+        preferences[:old_size, :old_size] = self.preferences
+        preferences[:old_size, old_size:] = self.above_minimum[:, None]
+        self.preferences = preferences
+        self.above_minimum = np.concatenate([self.above_minimum, np.zeros(added, dtype=np.int64)])
+
+    def cast(self, vote: VoteAndBallots, ballot: Ballot, replaced: Optional[Ballot]):
+        """Updates the tally when `ballot` is cast, replacing `replaced`."""
+        self.grow(len(vote['optionTable']))
+        if replaced is not None:
+            self.count(replaced, -1)
+        self.count(ballot, 1)
+
+    def count(self, ballot: Ballot, weight: int):
+        ratings = np.full(len(self.scores), self.minimum, dtype=np.int64)
+        ratings[:len(ballot['ratings'])] = ballot['ratings']
+
+        self.ballot_count += weight
+        self.scores += weight * ratings
+        self.above_minimum += weight * (ratings > self.minimum)
+        self.preferences += weight * (ratings[:, None] > ratings[None, :])
+
+    def get_tally(self, vote: VoteAndBallots) -> StarTally:
+        """Gets the scores and preferences of the vote's current options."""
+        self.grow(len(vote['optionTable']))
+        slots = get_option_slots(vote['optionTable'])
+        columns = [slots[option_id] for option_id in get_option_ids(vote)]
+        return StarTally(self.scores[columns], self.preferences[np.ix_(columns, columns)])
+
+    def get_standings(self, vote: VoteAndBallots) -> Any:
+        option_ids = get_option_ids(vote)
+        tally = self.get_tally(vote)
+        return {
+            'ballots': self.ballot_count,
+            'scores': dict(zip(option_ids, tally.scores)),
+            'preferences': {
+                option_id: dict(zip(option_ids, row))
+                for option_id, row in zip(option_ids, tally.preferences)
+            }
+        }
+
+    def get_outcome(self, vote: VoteAndBallots) -> VoteOutcome:
+        header = vote['vote']
+        return individual_to_party(elect_star(
+            self.get_tally(vote),
+            header['id'],
+            get_option_ids(vote),
+            header.get('resigned') or [],
+            header['type']['positions']))
+
+
+def create_live_tally(vote: VoteAndBallots):
+    """Creates a live tally for a vote and counts the ballots that were already cast. Returns None
+       if the vote's tallying algorithm cannot be tallied incrementally."""
+    ballot_type = vote['vote']['type']
+    if ballot_type['tally'] in ('first-past-the-post', 'sainte-lague', 'simdem-sainte-lague'):
+        live_tally = LiveChoiceTally()
+    elif ballot_type['tally'] == 'star':
+        live_tally = LiveStarTally(ballot_type)
+    else:
+        return None
+
+    for ballot in vote['ballots'].values():
+        live_tally.cast(vote, ballot, None)
+    return live_tally
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""Turns a vote's in-memory ballots into NumPy matrices that the tallying algorithms operate on.
+   Columns always refer to the vote's current options, in the order in which the vote lists them.
+   Ballots are resolved against the current options the same way `expand_vote` resolves them, so
+   a tally sees exactly the ballots that clients see."""
+
+import numpy as np
+from typing import Any, Dict, List, Tuple
+from ..persistence.ballots import OptionResolver
+
+OptionId = str
+VoteAndBallots = Any
+
+
+def get_option_ids(vote: VoteAndBallots) -> List[OptionId]:
+    """Gets the IDs of a vote's current options, in order."""
+    return [option['id'] for option in vote['vote']['options']]
+
+
+def get_option_columns(vote: VoteAndBallots) -> Dict[OptionId, int]:
+    """Maps the IDs of a vote's current options to their column in a ballot matrix."""
+    return {option_id: column for column, option_id in enumerate(get_option_ids(vote))}
+
+
+def get_choice_counts(vote: VoteAndBallots) -> Tuple[np.ndarray, int]:
+    """Counts the choose-one ballots cast for each of a vote's current options. Ballots for
+       candidates who have resigned are not counted. Returns the counts and the number of ballots
+       that still count, including those for resigned candidates."""
+    resolver = OptionResolver(vote)
+    columns = get_option_columns(vote)
+    resigned = set(vote['vote'].get('resigned') or [])
+
+    ballot_count = 0
+    choices = []
+    for ballot in vote['ballots'].values():
+        if not resolver.is_counted(ballot):
+            continue
+
+        ballot_count += 1
+        option_id = ballot['selectedOptionId']
+        if option_id in columns and option_id not in resigned:
+            choices.append(columns[option_id])
+
+    counts = np.bincount(np.array(choices, dtype=np.int64), minlength=len(columns))
+    return counts, ballot_count
+
+
+def get_rating_matrix(vote: VoteAndBallots) -> np.ndarray:
+    """Builds a matrix of rate-options ballots. Every row is a ballot and every column one of the
+       vote's current options. Options added after a ballot was cast get the minimal rating."""
+    resolver = OptionResolver(vote)
+    minimum = vote['vote']['type']['min']
+    table_size = len(vote['optionTable'])
+
+    # Ballots cast against the same option set have ratings arrays of the same length, so they
+    # can be stacked in one go.
+    by_version: Dict[int, list] = {}
+    for ballot in vote['ballots'].values():
+        by_version.setdefault(len(ballot['ratings']), []).append(ballot['ratings'])
+
+    blocks = []
+    for version, ratings in by_version.items():
+        block = np.full((len(ratings), table_size), minimum, dtype=np.int64)
+        if version > 0:
+            block[:, :version] = np.array(ratings, dtype=np.int64)
+        blocks.append(block)
+
+    if not blocks:
+        return np.empty((0, len(resolver.options)), dtype=np.int64)
+
+    matrix = np.concatenate(blocks)
+    return matrix[:, [resolver.slots[option_id] for option_id in resolver.options]]
+
+
+def get_ranking_matrix(vote: VoteAndBallots) -> np.ndarray:
+    """Builds a matrix of ranked-choice ballots, in the order in which they were cast. Row `i`
+       lists the columns of the options ballot `i` ranks, from most to least preferred, padded
+       with -1. Options that are no longer part of the vote are left out."""
+    columns = get_option_columns(vote)
+    rankings = [
+        [columns[option_id] for option_id in ballot['optionRanking'] if option_id in columns]
+        for ballot in vote['ballots'].values()
+    ]
+
+    width = max((len(ranking) for ranking in rankings), default=0)
+    matrix = np.full((len(rankings), width), -1, dtype=np.int64)
+    for row, ranking in enumerate(rankings):
+        matrix[row, :len(ranking)] = ranking
+    return matrix
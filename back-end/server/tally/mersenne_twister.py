@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""A port of the front-end's Mersenne Twister (MT19937) and the shuffling helpers built on top of
+   it. Tie breaks that are resolved pseudorandomly must come out the same on the server as in the
+   browser, so this deliberately mirrors the front-end rather than using Python's `random`, which
+   seeds its generator differently."""
+
+from functools import cmp_to_key
+from typing import Callable, List, TypeVar
+
+T = TypeVar('T')
+
+N = 624
+M = 397
+MATRIX_A = 0x9908b0df
+UPPER_MASK = 0x80000000
+LOWER_MASK = 0x7fffffff
+
+
+class MersenneTwister(object):
+    """The MT19937 pseudorandom number generator, seeded with `init_genrand`."""
+
+    def __init__(self, seed: int):
+        self.mt = [0] * N
+        self.mt[0] = seed & 0xffffffff
+        for i in range(1, N):
+            s = self.mt[i - 1] ^ (self.mt[i - 1] >> 30)
+            self.mt[i] = (1812433253 * s + i) & 0xffffffff
+        self.mti = N
+
+    def genrand_int32(self) -> int:
+        """Generates a random number on the [0, 0xffffffff] interval."""
+        mt = self.mt
+        if self.mti >= N:
+            for kk in range(N):
+                y = (mt[kk] & UPPER_MASK) | (mt[(kk + 1) % N] & LOWER_MASK)
+                mt[kk] = mt[(kk + M) % N] ^ (y >> 1) ^ (MATRIX_A if y & 1 else 0)
+            self.mti = 0
+
+        y = mt[self.mti]
+        self.mti += 1
+
+        # Tempering.
+        y ^= y >> 11
+        y ^= (y << 7) & 0x9d2c5680
+        y ^= (y << 15) & 0xefc60000
+        y ^= y >> 18
+        return y & 0xffffffff
+
+    def random(self) -> float:
+        """Generates a random number on the [0, 1) interval."""
+        return self.genrand_int32() * (1.0 / 4294967296.0)
+
+
+def hash_string(data: str) -> int:
+    """Hashes a string the way the front-end does to seed its generators: Java's string hash over
+       UTF-16 code units, as a signed 32-bit integer."""
+    encoded = data.encode('utf-16-le')
+    result = 0
+    for i in range(0, len(encoded), 2):
+        result = (31 * result + int.from_bytes(encoded[i:i + 2], 'little')) & 0xffffffff
+    return result - (1 << 32) if result & 0x80000000 else result
+
+
+def shuffle(data: List[T], rng: MersenneTwister) -> List[T]:
+    """Shuffles a list in place with the Fisher-Yates shuffle."""
+    current_index = len(data)
+    while current_index != 0:
+        random_index = int(rng.random() * current_index)
+        current_index -= 1
+        data[current_index], data[random_index] = data[random_index], data[current_index]
+    return data
+
+
+def sort_and_shuffle(data: List[T], compare: Callable[[T, T], int], rng: MersenneTwister) -> List[T]:
+    """Sorts a list. Runs of equivalent elements are permuted randomly.
+
+       Python's sort and the browser's are both stable TimSorts, so the elements are sorted in the
+       same order as in the front-end. A run of equivalent elements at the very end of the list is
+       left as is, just like the front-end does."""
+    result = sorted(data, key=cmp_to_key(compare))
+
+    start = 0
+    in_slice = False
+    for i in range(1, len(result)):
+        if compare(result[i - 1], result[i]) == 0:
+            if not in_slice:
+                in_slice = True
+                start = i - 1
+        elif in_slice:
+            in_slice = False
+            result[start:i] = shuffle(result[start:i], rng)
+
+    return result
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""Tallies votes. This mirrors the front-end's `tally` so the server can compute results itself;
+   algorithms produce the same outcomes as their front-end counterparts."""
+
+from typing import Any, List, Optional
+from .fptp import tally_fptp
+from .sainte_lague import tally_sainte_lague
+from .simdem_sainte_lague import tally_simdem_sainte_lague
+from .spsv import tally_spsv
+from .star import tally_star
+from .stv import tally_stv
+
+OptionId = str
+VoteAndBallots = Any
+
+# A list of `{'optionId', 'seats'}` objects.
+VoteOutcome = List[Any]
+
+# Tallying algorithms that elect individuals rather than allocate seats to parties.
+INDIVIDUAL_ALGORITHMS = {
+    'first-past-the-post': tally_fptp,
+    'spsv': tally_spsv,
+    'star': tally_star,
+    'stv': tally_stv
+}
+
+# Tallying algorithms that allocate seats to parties.
+PARTY_ALGORITHMS = {
+    'sainte-lague': tally_sainte_lague,
+    'simdem-sainte-lague': tally_simdem_sainte_lague
+}
+
+
+def elects_individuals(algorithm: str) -> bool:
+    """Tells if a tallying algorithm elects individuals rather than allocate seats to parties."""
+    if algorithm in INDIVIDUAL_ALGORITHMS:
+        return True
+    elif algorithm in PARTY_ALGORITHMS:
+        return False
+    else:
+        raise Exception(f'Unknown tallying algorithm {algorithm}.')
+
+
+def individual_to_party(outcome: List[OptionId]) -> VoteOutcome:
+    return [{'optionId': option_id, 'seats': 1} for option_id in outcome]
+
+
+def party_to_individual(outcome: VoteOutcome) -> List[OptionId]:
+    return [result['optionId'] for result in outcome for _ in range(result['seats'])]
+
+
+def tally(vote: VoteAndBallots, seats: Optional[int] = None) -> VoteOutcome:
+    """Tallies a vote's ballots, given the vote in its in-memory representation."""
+    algorithm = vote['vote']['type']['tally']
+    if elects_individuals(algorithm):
+        return individual_to_party(INDIVIDUAL_ALGORITHMS[algorithm](vote, seats))
+    else:
+        return PARTY_ALGORITHMS[algorithm](vote, seats)
+
+
+def tally_individual(vote: VoteAndBallots, seats: Optional[int] = None) -> List[OptionId]:
+    """Tallies a vote's ballots and lists the elected options, one entry per seat."""
+    return party_to_individual(tally(vote, seats))
+
+
+def tally_order(vote: VoteAndBallots) -> List[OptionId]:
+    """Orders a vote's options based on how well they did during a hypothetical election where
+       the number of seats is equal to the number of candidates and no one resigns."""
+    if elects_individuals(vote['vote']['type']['tally']):
+        hypothetical = {**vote, 'vote': {**vote['vote'], 'resigned': []}}
+        return list(dict.fromkeys(tally_individual(hypothetical, len(vote['vote']['options']))))
+    else:
+        return [result['optionId'] for result in sorted(tally(vote), key=lambda result: result['seats'], reverse=True)]
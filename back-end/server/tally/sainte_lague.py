@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+"""The Sainte-Laguë method, which allocates seats to parties proportionally."""
+
+import numpy as np
+from typing import Any, List, Optional
+from .matrices import get_choice_counts, get_option_ids
+
+VoteAndBallots = Any
+VoteOutcome = List[Any]
+
+
+def allocate_seats(counts: np.ndarray, option_ids: List[str], seats: int) -> VoteOutcome:
+    """Allocates seats to options based on their vote counts. Lists every option along with its
+       seats, from most to fewest seats."""
+    candidates = np.array(sorted(range(len(option_ids)), key=lambda column: option_ids[column]), dtype=np.int64)
+    if len(candidates) == 0:
+        return []
+
+    # Every seat goes to the option with the highest quotient. np.argmax picks the first maximum,
+    # so ties are broken in favor of the option with the smallest ID.
+    won = np.zeros(len(option_ids), dtype=np.int64)
+    for _ in range(seats):
+        quotients = counts[candidates] / (2 * won[candidates] + 1)
+        won[candidates[np.argmax(quotients)]] += 1
+
+    results = [{'optionId': option_ids[column], 'seats': int(won[column])} for column in candidates]
+    return sorted(results, key=lambda result: result['seats'], reverse=True)
+
+
+def tally_sainte_lague(vote: VoteAndBallots, seats: Optional[int] = None) -> VoteOutcome:
+    """Tallies a Sainte-Laguë vote."""
+    seats = seats or vote['vote']['type'].get('positions') or 1
+    counts, _ = get_choice_counts(vote)
+    return allocate_seats(counts, get_option_ids(vote), seats)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""A Sainte-Laguë variant for SimDemocracy's parliament: the number of seats scales with the
+   number of ballots cast and a party that wins a majority of votes also wins a majority of seats."""
+
+import math
+import numpy as np
+from typing import Any, List, Optional
+from .matrices import get_choice_counts, get_option_ids
+from .sainte_lague import allocate_seats
+
+VoteAndBallots = Any
+VoteOutcome = List[Any]
+
+
+def compute_seat_count(ballots_cast: int) -> int:
+    """Computes the number of seats in a parliament for which `ballots_cast` ballots were cast."""
+    if ballots_cast > 1:
+        # Round half up, like JavaScript's Math.round, so the front-end gets the same seat count.
+        return max(3, 2 * math.floor(ballots_cast / (3.5 * math.log(ballots_cast)) + 0.5) + 1)
+    else:
+        return 3
+
+
+def has_majority(outcome: VoteOutcome, option_id: str) -> bool:
+    """Tells if an option holds more than half of all seats."""
+    seats = sum(result['seats'] for result in outcome if result['optionId'] == option_id)
+    return seats > sum(result['seats'] for result in outcome) / 2
+
+
+def allocate_simdem_seats(
+        counts: np.ndarray,
+        ballot_count: int,
+        option_ids: List[str],
+        seats: Optional[int]) -> VoteOutcome:
+    """Allocates seats to options based on their vote counts and the number of ballots cast. If
+       `seats` is None, the number of seats is derived from the number of ballots."""
+    seats = seats or compute_seat_count(ballot_count)
+    outcome = allocate_seats(counts, option_ids, seats)
+    if len(option_ids) == 0:
+        return outcome
+
+    largest_party = int(np.argmax(counts))
+    if counts[largest_party] <= ballot_count / 2:
+        return outcome
+
+    # If a party has a majority in terms of ballots but not in terms of seats, then pad the number
+    # of seats until they have a majority.
+    while not has_majority(outcome, option_ids[largest_party]):
+        seats += 1
+        outcome = allocate_seats(counts, option_ids, seats)
+
+    return outcome
+
+
+def tally_simdem_sainte_lague(vote: VoteAndBallots, seats: Optional[int] = None) -> VoteOutcome:
+    """Tallies a SimDemocracy Sainte-Laguë vote."""
+    counts, ballot_count = get_choice_counts(vote)
+    seats = seats or vote['vote']['type'].get('positions')
+    return allocate_simdem_seats(counts, ballot_count, get_option_ids(vote), seats)
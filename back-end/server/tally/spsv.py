@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""Sequential Proportional Score Voting. Every rate-options ballot is split into Kotze-Pereira
+   virtual ballots, one per rating threshold, that approve of all candidates rated at or above the
+   threshold. Seats are filled one at a time; a virtual ballot's weight is 1 / (k + 1), where k is
+   the number of elected candidates it approves of."""
+
+import math
+import numpy as np
+from typing import Any, List, Optional
+from .matrices import get_rating_matrix
+
+OptionId = str
+VoteAndBallots = Any
+
+
+class SpsvTally(object):
+    """The Kotze-Pereira approvals of an SPSV vote, indexed by column."""
+
+    def __init__(self, ratings: np.ndarray, ballot_type: Any):
+        self.approvals = [
+            ratings >= threshold
+            for threshold in range(ballot_type['min'] + 1, ballot_type['max'] + 1)
+        ]
+
+    def get_scores(self, elected: List[int], candidates: List[int]) -> List[int]:
+        """Computes the candidates' scores in a round, scaled by a common factor so they can be
+           compared exactly."""
+        # Count the virtual ballots that approve of each candidate, grouped by the number of
+        # elected candidates those ballots approve of.
+        counts = np.zeros((len(elected) + 1, len(candidates)), dtype=np.int64)
+        for approvals in self.approvals:
+            elected_approvals = np.count_nonzero(approvals[:, elected], axis=1)
+            weights = np.zeros((len(elected_approvals), len(elected) + 1), dtype=np.int64)
+            weights[np.arange(len(elected_approvals)), elected_approvals] = 1
+            counts += weights.T @ approvals[:, candidates].astype(np.int64)
+
+        # Weights are unit fractions, so scaling by their least common multiple makes all scores
+        # integers. Python's integers do not overflow.
+        scale = math.lcm(*range(1, len(elected) + 2))
+        return [
+            sum(int(count) * (scale // (weight + 1)) for weight, count in enumerate(column))
+            for column in counts.T
+        ]
+
+    def elect(self, option_ids: List[OptionId], seats: int, elected: List[int], resigned: List[OptionId]) -> List[int]:
+        """Fills seats one at a time until `seats` candidates are elected. Ties are broken in favor
+           of the candidate with the lexicographically smallest ID."""
+        sorted_candidates = sorted(
+            (column for column, option_id in enumerate(option_ids) if option_id not in resigned),
+            key=lambda column: option_ids[column])
+
+        elected = list(elected)
+        while len(elected) < seats:
+            candidates = [column for column in sorted_candidates if column not in elected]
+            if not candidates:
+                break
+
+            scores = self.get_scores(elected, candidates)
+            elected.append(candidates[scores.index(max(scores))])
+        return elected
+
+
+def elect_spsv(ratings: np.ndarray, header: Any, seats: Optional[int] = None) -> List[OptionId]:
+    """Runs SPSV on a matrix of ratings for the options of the vote whose header is `header`. A
+       candidate who resigns is replaced by running a single-seat election in which the candidates
+       who did not resign count as already elected."""
+    ballot_type = header['type']
+    option_ids = [option['id'] for option in header['options']]
+    seats = min(seats or ballot_type['positions'], len(option_ids))
+    tally = SpsvTally(ratings, ballot_type)
+
+    elected = tally.elect(option_ids, seats, [], [])
+    if not elected:
+        return []
+
+    resigned = header.get('resigned') or []
+    for i in range(1, len(resigned) + 1):
+        resigned_slice = resigned[:i]
+        pre_elected = [column for column in elected if option_ids[column] not in resigned_slice]
+
+        # If all candidates are already elected, then we can't appoint a replacement.
+        if len(option_ids) - len(resigned_slice) - len(pre_elected) == 0:
+            break
+
+        elected = tally.elect(option_ids, seats, pre_elected, resigned_slice)
+
+    return [option_ids[column] for column in elected]
+
+
+def tally_spsv(vote: VoteAndBallots, seats: Optional[int] = None) -> List[OptionId]:
+    """Tallies an SPSV vote."""
+    return elect_spsv(get_rating_matrix(vote), vote['vote'], seats)
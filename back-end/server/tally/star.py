@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""STAR (Score Then Automatic Runoff) voting. The two candidates with the highest total scores
+   enter a runoff, which is won by the candidate who is rated higher on more ballots."""
+
+import numpy as np
+from typing import Any, List, Optional
+from .matrices import get_option_ids, get_rating_matrix
+from .mersenne_twister import MersenneTwister, hash_string, sort_and_shuffle
+
+OptionId = str
+VoteAndBallots = Any
+
+
+def get_preference_matrix(ratings: np.ndarray) -> np.ndarray:
+    """Computes a matrix whose entry `(a, b)` counts the ballots that rate option `a` higher than
+       option `b`."""
+    option_count = ratings.shape[1]
+    preferences = np.zeros((option_count, option_count), dtype=np.int64)
+    for column in range(option_count):
+        preferences[column] = np.count_nonzero(ratings[:, column, None] > ratings, axis=0)
+    return preferences
+
+
+class StarTally(object):
+    """Scores and pairwise preferences of a STAR vote's candidates, indexed by column."""
+
+    def __init__(self, scores: np.ndarray, preferences: np.ndarray):
+        self.scores = scores.tolist()
+        self.preferences = preferences.tolist()
+
+    @staticmethod
+    def from_ratings(ratings: np.ndarray) -> 'StarTally':
+        """Computes scores and pairwise preferences from a matrix of ratings."""
+        return StarTally(ratings.sum(axis=0), get_preference_matrix(ratings))
+
+    def compare_for_runoff(self, a: int, b: int) -> int:
+        """Orders two candidates by how many ballots prefer one over the other. Ties are broken by
+           total score."""
+        wins_for_a = self.preferences[a][b]
+        wins_for_b = self.preferences[b][a]
+        if wins_for_a == wins_for_b:
+            return self.scores[b] - self.scores[a]
+        else:
+            return wins_for_b - wins_for_a
+
+    def compare_for_first_round(self, a: int, b: int) -> int:
+        """Orders two candidates by total score. Ties are broken pairwise."""
+        return self.scores[b] - self.scores[a] or self.compare_for_runoff(a, b)
+
+    def first_round(self, candidates: List[int], rng: MersenneTwister) -> List[int]:
+        """Picks the two candidates that enter the runoff."""
+        return sort_and_shuffle(candidates, self.compare_for_first_round, rng)[:2]
+
+    def runoff_round(self, a: int, b: int, rng: MersenneTwister) -> int:
+        """Picks the winner of a runoff."""
+        return sort_and_shuffle([a, b], self.compare_for_runoff, rng)[0]
+
+
+def elect_star(
+        tally: StarTally,
+        vote_id: str,
+        option_ids: List[OptionId],
+        resignations: List[OptionId],
+        seats: int) -> List[OptionId]:
+    """Runs the STAR algorithm once per seat.
+
+       Ties during the first round are broken in favor of the candidate that beats the other tied
+       candidates pairwise; ties during the runoff are broken in favor of the candidate with the
+       highest score. Remaining ties are broken pseudorandomly, seeded by the vote's ID."""
+    rng = MersenneTwister(hash_string(vote_id))
+
+    winners: List[int] = []
+    seats = min(seats, len(option_ids) - len(resignations))
+    while len(winners) < seats:
+        eligible = [
+            column for column, option_id in enumerate(option_ids)
+            if column not in winners and option_id not in resignations
+        ]
+
+        if len(eligible) <= 1:
+            winners.extend(eligible)
+            break
+
+        a, b = tally.first_round(eligible, rng)
+        winners.append(tally.runoff_round(a, b, rng))
+
+    return [option_ids[column] for column in winners]
+
+
+def tally_star(vote: VoteAndBallots, seats: Optional[int] = None) -> List[OptionId]:
+    """Tallies a STAR vote. If more than one candidate is to be elected, then the STAR algorithm
+       is run once per seat."""
+    return elect_star(
+        StarTally.from_ratings(get_rating_matrix(vote)),
+        vote['vote']['id'],
+        get_option_ids(vote),
+        vote['vote'].get('resigned') or [],
+        seats or vote['vote']['type']['positions'])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""Single Transferable Vote with the Droop quota. Ranked-choice ballots count towards their first
+   remaining choice; candidates who reach the quota are elected and the ballots that elected them
+   are set aside, and otherwise the least popular candidate is eliminated."""
+
+import numpy as np
+from typing import Any, Dict, List, Optional
+from .matrices import get_ranking_matrix
+
+OptionId = str
+VoteAndBallots = Any
+
+
+class StvTally(object):
+    """The state of an STV tally. Candidates are identified by column and ballots by row."""
+
+    def __init__(self, rankings: np.ndarray, option_ids: List[OptionId], seats: int):
+        self.rankings = rankings
+        self.option_ids = option_ids
+        self.columns = {option_id: column for column, option_id in enumerate(option_ids)}
+        self.seats = seats
+        self.quota = len(rankings) // (seats + 1) + 1
+
+        self.ballots = np.arange(len(rankings))
+        self.ineligible: List[OptionId] = []
+        self.results: List[OptionId] = []
+        self.used: Dict[OptionId, np.ndarray] = {}
+
+    def get_first_choices(self) -> np.ndarray:
+        """Gets every remaining ballot's first choice among the eligible candidates, or -1 for
+           ballots that rank no eligible candidate."""
+        ineligible = np.zeros(len(self.option_ids) + 1, dtype=bool)
+        ineligible[[self.columns[x] for x in self.ineligible if x in self.columns]] = True
+        # Padding is -1, which indexes the extra entry at the end of the mask.
+        ineligible[-1] = True
+
+        rows = self.rankings[self.ballots]
+        if rows.shape[1] == 0:
+            return np.full(len(rows), -1, dtype=np.int64)
+
+        eligible = ~ineligible[rows]
+        first = rows[np.arange(len(rows)), eligible.argmax(axis=1)]
+        return np.where(eligible.any(axis=1), first, -1)
+
+    def run_round(self) -> bool:
+        """Elects or eliminates a candidate. Returns False if there are no candidates left."""
+        first_choices = self.get_first_choices()
+
+        # Candidates are listed in the order in which they are first encountered, followed by the
+        # eligible candidates that are no one's first remaining choice. Sorting by score is stable.
+        counted = first_choices[first_choices >= 0]
+        columns, first_seen, counts = np.unique(counted, return_index=True, return_counts=True)
+        order = np.argsort(first_seen, kind='stable')
+        scores = [(int(columns[i]), int(counts[i])) for i in order]
+        scored = {column for column, _ in scores}
+        scores.extend(
+            (column, 0) for column, option_id in enumerate(self.option_ids)
+            if option_id not in self.ineligible and column not in scored)
+        if not scores:
+            return False
+
+        scores.sort(key=lambda entry: entry[1], reverse=True)
+        best, best_score = scores[0]
+        if best_score >= self.quota if self.quota == len(self.ballots) else best_score > self.quota:
+            elected = self.option_ids[best]
+            used = np.flatnonzero(first_choices == best)[:self.quota]
+            self.results.append(elected)
+            self.ineligible.append(elected)
+            self.used[elected] = self.ballots[used]
+            self.ballots = np.delete(self.ballots, used)
+        else:
+            # No candidate exceeded the quota. Eliminate a candidate instead.
+            self.ineligible.append(self.option_ids[scores[-1][0]])
+        return True
+
+    def fill_seats(self):
+        """Runs rounds until all seats are filled or no candidates are left."""
+        option_count = len(self.option_ids)
+        while len(self.results) < self.seats and len(self.ineligible) < option_count:
+            if len(self.ineligible) == option_count - 1:
+                # If we're down to the last eligible candidate, just choose that candidate.
+                remaining = [x for x in self.option_ids if x not in self.ineligible]
+                if not remaining:
+                    break
+
+                winner = remaining[0]
+                self.results.append(winner)
+                self.ineligible.append(winner)
+                self.used[winner] = self.ballots
+                self.ballots = self.ballots[:0]
+            elif not self.run_round():
+                break
+
+    def resign(self, resigned: List[OptionId]):
+        """Appoints a replacement for every candidate who resigns by adding their ballots back to
+           the pot and filling the seats with the remaining candidates."""
+        already_resigned = []
+        for resignation in resigned:
+            already_resigned.append(resignation)
+            self.results = [x for x in self.results if x != resignation]
+            self.ineligible = [*self.results, *already_resigned]
+            if resignation in self.used:
+                self.ballots = np.concatenate([self.ballots, self.used[resignation]])
+            self.fill_seats()
+
+
+def elect_stv(rankings: np.ndarray, header: Any, seats: Optional[int] = None) -> List[OptionId]:
+    """Runs STV on a matrix of rankings for the options of the vote whose header is `header`."""
+    option_ids = [option['id'] for option in header['options']]
+    seats = min(seats or header['type']['positions'], len(option_ids))
+
+    tally = StvTally(rankings, option_ids, seats)
+    tally.fill_seats()
+    tally.resign(header.get('resigned') or [])
+    return tally.results
+
+
+def tally_stv(vote: VoteAndBallots, seats: Optional[int] = None) -> List[OptionId]:
+    """Tallies an STV vote."""
+    return elect_stv(get_ranking_matrix(vote), vote['vote'], seats)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""Runs expensive tallies in worker processes. STV and SPSV tallies of large elections take long
+   enough to block the request handlers that ask for them, so they are run in a process pool and
+   clients poll for their outcome. Ballot matrices are built in the server process, which means
+   workers only receive a vote header and a NumPy matrix rather than the vote's ballots."""
+
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple
+import numpy as np
+from .matrices import get_ranking_matrix, get_rating_matrix
+from .outcomes import VoteOutcome, individual_to_party
+from .spsv import elect_spsv
+from .stv import elect_stv
+
+VoteAndBallots = Any
+
+# The number of worker processes tallies run in by default. Zero disables the pool, in which case
+# votes are tallied on the thread that asks for their results.
+DEFAULT_TALLY_WORKERS = 2
+
+# The maximal number of finished jobs whose status is remembered.
+MAX_FINISHED_JOBS = 256
+
+# Tallying algorithms whose tallies run in the pool. The others are cheap enough to run inline.
+POOLED_ALGORITHMS = {
+    'spsv': (get_rating_matrix, elect_spsv),
+    'stv': (get_ranking_matrix, elect_stv)
+}
+
+
+def is_pooled(vote: VoteAndBallots) -> bool:
+    """Tells if a vote's tallies run in the tally pool."""
+    return vote['vote']['type']['tally'] in POOLED_ALGORITHMS
+
+
+def get_tally_input(vote: VoteAndBallots) -> Tuple[Any, np.ndarray]:
+    """Gets the header and ballot matrix that a worker needs to tally a vote."""
+    get_matrix, _ = POOLED_ALGORITHMS[vote['vote']['type']['tally']]
+    return vote['vote'], get_matrix(vote)
+
+
+def run_tally(header: Any, matrix: np.ndarray) -> VoteOutcome:
+    """Tallies a vote from its header and ballot matrix. Runs in a worker process."""
+    _, elect = POOLED_ALGORITHMS[header['type']['tally']]
+    return individual_to_party(elect(matrix, header))
+
+
+class TallyJob(object):
+    """A tally that was submitted to the pool."""
+
+    def __init__(self, job_id: str, future: Future):
+        self.job_id = job_id
+        self.future = future
+
+    def failed(self) -> bool:
+        return self.future.done() and self.future.exception() is not None
+
+    def get_status(self) -> Any:
+        """Describes the job's status. Finished jobs include the vote's outcome."""
+        if not self.future.done():
+            return {'jobId': self.job_id, 'status': 'running' if self.future.running() else 'pending'}
+
+        error = self.future.exception()
+        if error is not None:
+            return {'jobId': self.job_id, 'status': 'failed', 'error': str(error)}
+
+        return {'jobId': self.job_id, 'status': 'done', 'outcome': self.future.result()}
+
+
+class TallyPool(object):
+    """Tallies votes in a pool of worker processes. Jobs are identified by the key of the results
+       they compute, so concurrent requests for the same vote's results share a single job."""
+
+    def __init__(self, workers: int = DEFAULT_TALLY_WORKERS):
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.jobs: 'OrderedDict[str, TallyJob]' = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Gets the pool's executor. Worker processes are spawned rather than forked, as forking a
+           multithreaded server is unsafe, and only once the first job is submitted."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def submit(self, job_id: str, vote: VoteAndBallots, on_done: Callable[[VoteOutcome], None]) -> TallyJob:
+        """Submits a vote's tally, unless a job with the same ID is already pending, running or
+           done. `on_done` is called with the vote's outcome once a new job finishes."""
+        job = self.get_job(job_id)
+        if job is not None and not job.failed():
+            return job
+
+        header, matrix = get_tally_input(vote)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and not job.failed():
+                return job
+
+            try:
+                future = self.get_executor().submit(run_tally, header, matrix)
+            except BrokenProcessPool:
+                # A worker died, which leaves the executor unusable. Replace it.
+                self.executor = None
+                future = self.get_executor().submit(run_tally, header, matrix)
+
+            job = TallyJob(job_id, future)
+            self.jobs[job_id] = job
+            self.jobs.move_to_end(job_id)
+            self.evict_finished_jobs()
+
+        def complete(future: Future):
+            if future.exception() is None:
+                on_done(future.result())
+
+        job.future.add_done_callback(complete)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[TallyJob]:
+        """Gets a job by its ID."""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def evict_finished_jobs(self):
+        """Forgets the oldest finished jobs once there are too many of them."""
+        finished = [job_id for job_id, job in self.jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def stop(self):
+        """Shuts the worker processes down. Jobs that have not started yet are cancelled."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import pytest
+from ..persistence.scheduler import DeadlineScheduler
+from ..persistence.storage import JsonVoteStorage
+from ..persistence.votes import read_or_create_vote_index
+from .helpers import FakeClock, create_devices
+
+
+@pytest.fixture
+def data_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def index_path(data_dir):
+    return os.path.join(data_dir, 'vote-index.json')
+
+
+@pytest.fixture
+def registered_devices(data_dir):
+    return create_devices(data_dir)
+
+
+@pytest.fixture
+def registered(registered_devices):
+    """The devices of three registered voters."""
+    return registered_devices[0]
+
+
+@pytest.fixture
+def devices(registered_devices):
+    """A device index to which `registered` belong."""
+    return registered_devices[1]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def scheduler(clock):
+    """A scheduler that runs what is due on `clock` when its `run_due` method is called."""
+    return DeadlineScheduler('votes', clock, background=False)
+
+
+@pytest.fixture
+def votes(index_path, devices, scheduler):
+    """A vote index stored as JSON in `data_dir`."""
+    return read_or_create_vote_index(JsonVoteStorage(index_path), devices, scheduler=scheduler)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import os
+import time
+from ..persistence.authentication import DeviceIndex
+from ..persistence.storage import JsonDeviceStorage
+
+
+def create_proposal(name='Test Vote', deadline_offset=60 * 60):
+    return {
+        'name': name,
+        'description': 'A test vote.',
+        'deadline': time.time() + deadline_offset,
+        'type': {'tally': 'first-past-the-post', 'positions': 1},
+        'options': [
+            {'id': 'a', 'name': 'A', 'description': ''},
+            {'id': 'b', 'name': 'B', 'description': ''}
+        ]
+    }
+
+
+def create_devices(data_dir, user_count=3):
+    devices = DeviceIndex({}, {}, set(), set(), set(), [], JsonDeviceStorage(os.path.join(data_dir, 'device-index.json')))
+    return [
+        devices.register(f'device-{i}', f'user-{i}', {'deviceId': f'device-{i}', 'persistentId': f'p-{i}'})
+        for i in range(user_count)
+    ], devices
+
+
+class FakeClock(object):
+    """A wall clock that only moves when it is told to."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
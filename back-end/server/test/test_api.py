@@ -4,6 +4,9 @@ import os
 import shutil
 import tempfile
 import pytest
+from ..api import core
+from ..persistence.authentication import DeviceIndex, Permission
+from ..persistence.storage import JsonDeviceStorage
 from ..server import create_app
 
 
@@ -54,3 +57,28 @@ def test_not_initially_authenticated(client):
         'deviceId': 'test'
     })
     assert rv.json == 'unauthenticated'
+
+
+def test_permissions_are_cached(tmp_path, monkeypatch):
+    """Tests that users' permission sets are cached and recomputed when permissions change."""
+    monkeypatch.setattr(core, '_default_permissions', {
+        'authenticated': [Permission.VOTE_VIEW],
+        'authenticated-admin': [Permission.ELECTION_CREATE],
+        'authenticated-developer': []
+    })
+    devices = DeviceIndex({}, {}, {'admin'}, set(), set(), [], JsonDeviceStorage(str(tmp_path / 'device-index.json')))
+
+    permissions = core.get_user_permissions('admin', devices)
+    assert permissions == {Permission.VOTE_VIEW, Permission.ELECTION_CREATE}
+    assert core.get_user_permissions('admin', devices) is permissions
+
+    # Logging in again does not change a user's permissions.
+    devices.register('device-0', 'admin', {})
+    permissions = core.get_user_permissions('admin', devices)
+    devices.register('device-1', 'admin', {})
+    assert core.get_user_permissions('admin', devices) is permissions
+
+    devices.add_permission(Permission.ELECTION_EDIT, 'admin')
+    assert Permission.ELECTION_EDIT in core.get_user_permissions('admin', devices)
+    devices.remove_permission(Permission.ELECTION_EDIT, 'admin')
+    assert Permission.ELECTION_EDIT not in core.get_user_permissions('admin', devices)
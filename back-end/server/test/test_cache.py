@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from ..persistence.cache import PinnedLRUCache
+from ..persistence.responses import ResponseCache, SerializedResponse
+
+
+def test_entries_load_without_holding_the_lock():
+    """Tests that a slow load neither blocks access to other entries nor runs twice for threads
+       that miss the same entry."""
+    started = threading.Event()
+    finish = threading.Event()
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        if key == 'slow':
+            started.set()
+            finish.wait(5)
+        return f'value-{key}', 1
+
+    cache = PinnedLRUCache(load, 100)
+    cache['pinned'] = 'value-pinned'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache['slow'])) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+
+    start = time.perf_counter()
+    assert cache['pinned'] == 'value-pinned'
+    assert cache['fast'] == 'value-fast'
+    assert time.perf_counter() - start < 1
+
+    time.sleep(0.1)
+    finish.set()
+    for thread in threads:
+        thread.join()
+    assert results == ['value-slow'] * 3
+    assert loads.count('slow') == 1
+    assert 'slow' in cache
+
+
+def test_discarded_loads_are_not_inserted():
+    """Tests that an entry that is replaced while it is being loaded keeps its new value."""
+    started = threading.Event()
+    finish = threading.Event()
+
+    def load(key):
+        started.set()
+        finish.wait(5)
+        return 'stale', 1
+
+    cache = PinnedLRUCache(load, 100)
+    thread = threading.Thread(target=lambda: cache['key'])
+    thread.start()
+    assert started.wait(5)
+
+    cache['key'] = 'fresh'
+    finish.set()
+    thread.join()
+    assert cache['key'] == 'fresh'
+
+
+def test_response_cache():
+    """Tests that cached responses are evicted once they exceed the budget and that a response
+       whose key is invalidated while it is being created is not cached."""
+    cache = ResponseCache(budget=8)
+    cache.get('a', lambda: SerializedResponse(b'aaaa'))
+    cache.get('b', lambda: SerializedResponse(b'bbbb'))
+    assert cache.get('a', lambda: SerializedResponse(b'new')).data == b'aaaa'
+    cache.get('c', lambda: SerializedResponse(b'cccc'))
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.size == 8
+
+    def create():
+        cache.invalidate('d')
+        return SerializedResponse(b'stale')
+    assert cache.get('d', create).data == b'stale'
+    assert cache.get('d', lambda: SerializedResponse(b'fresh')).data == b'fresh'
+    assert cache.get('d', lambda: SerializedResponse(b'newer')).data == b'fresh'
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import os
+import time
+from ..persistence import storage as storage_module
+from ..persistence.authentication import DeviceIndex, Permission, read_or_create_device_index
+from ..persistence.commit import GroupCommitter
+from ..persistence.helpers import read_json, read_json_lines, write_json
+from ..persistence.storage import JsonDeviceStorage
+
+
+def test_device_index_journal(data_dir, monkeypatch):
+    """Tests that device changes are journaled, survive a restart and are compacted into the
+       device index's snapshot."""
+    path = os.path.join(data_dir, 'device-index.json')
+    devices = DeviceIndex({}, {}, set(), set(), set(), [], JsonDeviceStorage(path, GroupCommitter(fsync_policy='always')))
+    for i in range(3):
+        devices.register(f'device-{i}', f'user-{i}', {'persistentId': f'p-{i}'})
+    devices.add_permission(Permission.VOTE_CAST, 'user-0')
+    devices.unregister_user('user-2')
+    assert not os.path.exists(path)
+
+    reloaded = read_or_create_device_index(JsonDeviceStorage(path), [])
+    assert set(reloaded.devices) == {'device-0', 'device-1'}
+    assert reloaded.registered_voters == {'user-0', 'user-1'}
+    assert Permission.VOTE_CAST('user-0', reloaded)
+
+    monkeypatch.setattr(storage_module, 'DEVICE_JOURNAL_COMPACTION_THRESHOLD', 2)
+    devices.register('device-3', 'user-3', {'persistentId': 'p-3'})
+    assert set(read_json(path)['devices']) == {'device-0', 'device-1', 'device-3'}
+
+    devices.unregister('device-0')
+    reloaded = read_or_create_device_index(JsonDeviceStorage(path), [])
+    assert set(reloaded.devices) == {'device-1', 'device-3'}
+    assert reloaded.registered_voters == {'user-0', 'user-1', 'user-3'}
+
+
+def test_truncated_device_journal_record_is_dropped(data_dir):
+    """Tests that a device journal record that was cut short by a crash does not corrupt the
+       records appended after a restart."""
+    path = os.path.join(data_dir, 'device-index.json')
+    devices = DeviceIndex({}, {}, set(), set(), set(), [], JsonDeviceStorage(path, GroupCommitter(fsync_policy='always')))
+    devices.register('device-0', 'user-0', {'persistentId': 'p-0'})
+    with open(storage_module.get_device_journal_path(path), 'a') as f:
+        f.write('{"kind":"save-device","dev')
+
+    reloaded = read_or_create_device_index(JsonDeviceStorage(path, GroupCommitter(fsync_policy='always')), [])
+    reloaded.register('device-1', 'user-1', {'persistentId': 'p-1'})
+
+    reloaded = read_or_create_device_index(JsonDeviceStorage(path), [])
+    assert set(reloaded.devices) == {'device-0', 'device-1'}
+    assert reloaded.registered_voters == {'user-0', 'user-1'}
+
+
+def test_expired_devices_are_reaped(data_dir):
+    """Tests that expired devices are unregistered by the reaper, in one persisted batch, and stay
+       unregistered after a restart."""
+    path = os.path.join(data_dir, 'device-index.json')
+    devices = DeviceIndex({}, {}, set(), set(), set(), [], JsonDeviceStorage(path, GroupCommitter(fsync_policy='always')))
+    devices.register('device-0', 'user-0', {'persistentId': 'p-0'})
+    devices.register('device-1', 'user-1', {'persistentId': 'p-1'}, expiry=60)
+    devices.register('device-2', 'user-1', {'persistentId': 'p-2'}, expiry=60)
+    devices.register('device-3', 'user-3', {'persistentId': 'p-3'}, expiry=60)
+    devices.register('device-3', 'user-3', {'persistentId': 'p-3'})
+    assert devices.reap_expired_devices() == 0
+
+    assert devices.reap_expired_devices(now=time.time() + 120) == 2
+    assert set(devices.devices) == {'device-0', 'device-3'}
+    assert set(devices.users_to_devices) == {'user-0', 'user-3'}
+    assert devices.registered_voters == {'user-0', 'user-1', 'user-3'}
+    assert devices.metrics()['liveDevices'] == 2
+    assert devices.metrics()['reapedDevices'] == 2
+
+    reloaded = read_or_create_device_index(JsonDeviceStorage(path), [])
+    assert set(reloaded.devices) == {'device-0', 'device-3'}
+    assert read_json_lines(storage_module.get_device_journal_path(path))[-1] == \
+        {'kind': 'delete-devices', 'ids': ['device-1', 'device-2']}
+
+
+def test_legacy_device_expiry(data_dir):
+    """Tests that device expiry timestamps taken from the monotonic clock are converted to
+       wall-clock timestamps."""
+    path = os.path.join(data_dir, 'device-index.json')
+    write_json({'devices': {
+        'device-0': {'id': 'device-0', 'user': 'user-0', 'expiry': time.monotonic() + 60, 'info': {}}
+    }}, path)
+
+    devices = read_or_create_device_index(JsonDeviceStorage(path), [])
+    assert time.time() < devices.devices['device-0'].expiry <= time.time() + 60
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+from ..persistence.events import EventBroadcaster, MAX_QUEUED_EVENTS
+from .helpers import create_proposal
+
+
+def test_vote_events(registered, clock, scheduler, votes):
+    """Tests that changes to votes are broadcast to subscribers."""
+    subscription = votes.events.subscribe()
+
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+    votes.add_option(vote_id, {'id': 'c', 'name': 'C', 'description': ''}, registered[0])
+    for device in registered:
+        votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, device)
+    clock.advance(120)
+    scheduler.run_due()
+
+    messages = []
+    while not subscription.queue.empty():
+        messages.append(subscription.get(0))
+
+    # Turnout is reported once for the burst of ballots.
+    events = [line for message in messages for line in message.split('\n') if line.startswith('event: ')]
+    assert events == ['event: vote-created', 'event: option-added', 'event: turnout', 'event: vote-closed']
+    assert messages[2] == 'event: turnout\ndata: {"voteId": "%s", "ballots": 3}\n\n' % vote_id
+    assert messages[3].startswith(f'id: {votes.vote_versions[vote_id]}\n')
+
+
+def test_slow_subscribers_are_disconnected():
+    """Tests that subscribers whose queue is full are dropped rather than stall publishers."""
+    broadcaster = EventBroadcaster()
+    slow = broadcaster.subscribe()
+    fast = broadcaster.subscribe()
+    for i in range(MAX_QUEUED_EVENTS + 1):
+        broadcaster.publish('turnout', {'ballots': i})
+        fast.get(0)
+
+    assert slow.closed and slow.get(0) is None
+    assert not fast.closed
+    assert broadcaster.subscribers == {fast}
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+from ..persistence.authentication import DeviceIndex, Permission, read_or_create_device_index
+from ..persistence.migrate import migrate_votes, migrate_devices
+from ..persistence.sqlite_storage import SqliteDatabase, SqliteVoteStorage, SqliteDeviceStorage
+from ..persistence.storage import open_storage
+from ..persistence.votes import read_or_create_vote_index
+from .helpers import create_proposal
+
+
+def test_sqlite_storage(data_dir):
+    """Tests that votes, ballots, devices and permissions survive a restart with SQLite storage."""
+    database = SqliteDatabase(os.path.join(data_dir, 'res-publica.db'))
+    devices = DeviceIndex({}, {}, set(), set(), set(), [], SqliteDeviceStorage(database))
+    registered = [devices.register(f'device-{i}', f'user-{i}', {'persistentId': f'p-{i}'}) for i in range(3)]
+    devices.add_permission(Permission.VOTE_CAST, 'user-0')
+    devices.unregister_user('user-2')
+
+    votes = read_or_create_vote_index(SqliteVoteStorage(database), devices)
+    vote_id = votes.create_vote(create_proposal())['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[1])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[0])
+    votes.committer.flush()
+
+    reloaded_devices = read_or_create_device_index(SqliteDeviceStorage(database), [])
+    assert set(reloaded_devices.devices) == {'device-0', 'device-1'}
+    assert reloaded_devices.registered_voters == {'user-0', 'user-1'}
+    assert Permission.VOTE_CAST('user-0', reloaded_devices)
+
+    reloaded = read_or_create_vote_index(SqliteVoteStorage(database), reloaded_devices)
+    vote = reloaded.votes[vote_id]
+    assert [ballot['selectedOptionId'] for ballot in vote['ballots'].values()] == ['a', 'b']
+    assert reloaded.find_voter(vote_id, reloaded.get_vote(vote_id, registered[0])['ownBallot']) == 'user-0'
+
+    storage = SqliteVoteStorage(database)
+    assert storage.read_results(vote_id) is None
+    storage.write_results(vote_id, {'key': 'k', 'results': {'outcome': []}})
+    assert storage.read_results(vote_id) == {'key': 'k', 'results': {'outcome': []}}
+
+
+def test_sqlite_cancelled_votes_are_deleted(data_dir):
+    """Tests that a stale snapshot of the vote index does not delete votes from SQLite storage and
+       that cancelling a vote does."""
+    database = SqliteDatabase(os.path.join(data_dir, 'res-publica.db'))
+    devices = DeviceIndex({}, {}, set(), set(), set(), [], SqliteDeviceStorage(database))
+    device = devices.register('device-0', 'user-0', {'persistentId': 'p-0'})
+    storage = SqliteVoteStorage(database)
+    votes = read_or_create_vote_index(storage, devices)
+    kept_id = votes.create_vote(create_proposal())['id']
+    cancelled_id = votes.create_vote(create_proposal())['id']
+    votes.cast_ballot(cancelled_id, {'selectedOptionId': 'a'}, device)
+    votes.committer.flush()
+
+    storage.write_index({})
+    assert sorted(database.query('SELECT id FROM votes')) == sorted([(kept_id,), (cancelled_id,)])
+
+    assert votes.cancel_vote(cancelled_id)
+    assert database.query('SELECT id FROM votes') == [(kept_id,)]
+    assert database.query('SELECT vote_id FROM ballots') == []
+
+
+def test_sqlite_vote_writes_keep_concurrent_ballots(data_dir):
+    """Tests that writing a vote to SQLite storage neither loses ballots that are cast while it is
+       written nor rewrites suspicious ballot reports."""
+    database = SqliteDatabase(os.path.join(data_dir, 'res-publica.db'))
+    devices = DeviceIndex({}, {}, set(), set(), set(), [], SqliteDeviceStorage(database))
+    registered = [devices.register(f'device-{i}', f'user-{i}', {'persistentId': f'p-{i}'}) for i in range(2)]
+    shared = devices.register('device-shared', 'user-shared', {'persistentId': 'p-0'})
+    storage = SqliteVoteStorage(database)
+    votes = read_or_create_vote_index(storage, devices)
+    vote_id = votes.create_vote(create_proposal())['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+
+    # Cast a ballot from another thread while the vote is being written.
+    write_vote = storage.write_vote
+    caster = threading.Thread(target=lambda: votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[1]))
+    def write_vote_while_casting(*args):
+        caster.start()
+        caster.join(0.2)
+        write_vote(*args)
+    storage.write_vote = write_vote_while_casting
+    votes.commit_vote(votes.votes[vote_id])
+    caster.join()
+
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, shared)
+    assert database.query('SELECT vote_id FROM suspicious_ballots') == [(vote_id,)]
+
+    reloaded = read_or_create_vote_index(SqliteVoteStorage(database), devices)
+    assert sorted(ballot['selectedOptionId'] for ballot in reloaded.votes[vote_id]['ballots'].values()) == ['a', 'b', 'b']
+    assert len(reloaded.get_suspicious_ballots_report(vote_id)) == 1
+
+
+def test_migrate_storage(data_dir, clock, scheduler):
+    """Tests that a JSON data directory can be migrated to SQLite storage."""
+    vote_storage, device_storage = open_storage('json', data_dir)
+    devices = read_or_create_device_index(device_storage, [])
+    registered = [devices.register(f'device-{i}', f'user-{i}', {'persistentId': f'p-{i}'}) for i in range(2)]
+    votes = read_or_create_vote_index(vote_storage, devices, scheduler=scheduler)
+    open_id = votes.create_vote(create_proposal('Open'))['id']
+    closed_id = votes.create_vote(create_proposal('Closed', deadline_offset=60))['id']
+    for device in registered:
+        votes.cast_ballot(open_id, {'selectedOptionId': 'a'}, device)
+        votes.cast_ballot(closed_id, {'selectedOptionId': 'b'}, device)
+    clock.advance(120)
+    scheduler.run_due()
+    votes.committer.flush()
+
+    sqlite_votes, sqlite_devices = open_storage('sqlite', data_dir)
+    migrate_devices(device_storage, sqlite_devices)
+    migrate_votes(vote_storage, sqlite_votes)
+
+    migrated_devices = read_or_create_device_index(sqlite_devices, [])
+    assert set(migrated_devices.devices) == {'device-0', 'device-1'}
+    migrated = read_or_create_vote_index(sqlite_votes, migrated_devices, scheduler=scheduler)
+    assert migrated.vote_secrets == votes.vote_secrets
+    assert migrated.get_all_votes() == votes.get_all_votes()
+    for vote_id in [open_id, closed_id]:
+        assert migrated.get_vote(vote_id, registered[0]) == votes.get_vote(vote_id, registered[0])
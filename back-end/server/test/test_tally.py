@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+"""Tests for the tally engine. Most cases are ported from the front-end's tests, so both sides
+   agree on vote outcomes."""
+
+import random
+import numpy as np
+from ..persistence.ballots import compact_ballot, create_option_table
+from ..tally.live import create_live_tally
+from ..tally.matrices import get_choice_counts, get_rating_matrix
+from ..tally.mersenne_twister import MersenneTwister, hash_string
+from ..tally.outcomes import tally, tally_individual, tally_order
+from ..tally.star import get_preference_matrix
+
+ANIMAL_OPTIONS = [
+    {'description': '', 'id': 'cow', 'name': 'cow'},
+    {'description': '', 'id': 'sheep', 'name': 'sheep'},
+    {'description': 'monke', 'id': 'monkey', 'name': 'monkey'}
+]
+
+
+def create_vote(ballot_type, ballots, options=ANIMAL_OPTIONS, resigned=None, vote_id='41st-presidential-election'):
+    """Creates a vote in its in-memory representation."""
+    vote = {
+        'vote': {
+            'id': vote_id,
+            'name': 'Test Vote',
+            'description': 'A test vote.',
+            'deadline': 0,
+            'options': options,
+            'type': ballot_type,
+            'resigned': resigned or []
+        },
+        'ballots': {},
+        'optionTable': create_option_table({'options': options}),
+        'revision': 0
+    }
+    for i, ballot in enumerate(ballots):
+        ballot = compact_ballot({'id': f'ballot-{i}', 'timestamp': 0, **ballot}, vote)
+        vote['ballots'][ballot['id']] = ballot
+    return vote
+
+
+def create_rated_vote(ratings, tally_algorithm, seats, resigned=None):
+    """Creates a rate-options vote from a matrix of ratings."""
+    options = [
+        {'id': f'option-{i}', 'name': f'Option {i}', 'description': f'Option {i}'}
+        for i in range(len(ratings[0]))
+    ]
+    ballots = [
+        {'ratingPerOption': [{'optionId': f'option-{i}', 'rating': x} for i, x in enumerate(row)]}
+        for row in ratings
+    ]
+    ballot_type = {'tally': tally_algorithm, 'positions': seats, 'min': 0, 'max': 5}
+    return create_vote(ballot_type, ballots, options, resigned, 'test-vote')
+
+
+def with_resignations(vote, resigned):
+    return {**vote, 'vote': {**vote['vote'], 'resigned': resigned}}
+
+
+def test_mersenne_twister():
+    """Tests that the Mersenne Twister produces MT19937's reference output."""
+    rng = MersenneTwister(5489)
+    assert [rng.genrand_int32() for _ in range(3)] == [3499211612, 581869302, 3890346734]
+    assert hash_string('') == 0
+    assert hash_string('ab') == 31 * ord('a') + ord('b')
+    assert hash_string('41st-presidential-election') < 0
+
+
+def test_fptp():
+    ballot_type = {'tally': 'first-past-the-post', 'positions': 1}
+    ballots = [{'selectedOptionId': x} for x in ['sheep', 'monkey', 'monkey', 'cow']]
+    assert tally_individual(create_vote(ballot_type, ballots)) == ['monkey']
+
+    # Ties go to the option with the smallest ID, and resigned candidates' ballots do not count.
+    assert tally_individual(create_vote(ballot_type, ballots[:2])) == ['monkey']
+    assert tally_individual(create_vote(ballot_type, ballots, resigned=['monkey'])) == ['cow']
+    assert tally_individual(create_vote({**ballot_type, 'positions': 2}, ballots)) == ['monkey', 'cow']
+
+
+def test_sainte_lague_allocates_all_seats_to_perfect_winner():
+    vote = create_vote({'positions': 4, 'tally': 'sainte-lague'}, [{'selectedOptionId': 'monkey'}])
+    assert tally(vote) == [
+        {'optionId': 'monkey', 'seats': 4},
+        {'optionId': 'cow', 'seats': 0},
+        {'optionId': 'sheep', 'seats': 0}
+    ]
+
+
+def test_sainte_lague_allocates_proportionately():
+    ballots = [{'selectedOptionId': x} for x in ['monkey', 'monkey', 'sheep', 'cow']]
+    vote = create_vote({'positions': 4, 'tally': 'sainte-lague'}, ballots)
+    assert tally(vote) == [
+        {'optionId': 'monkey', 'seats': 2},
+        {'optionId': 'cow', 'seats': 1},
+        {'optionId': 'sheep', 'seats': 1}
+    ]
+
+
+def test_simdem_sainte_lague_grants_majority():
+    """Tests that a party with a majority of votes is padded to a majority of seats."""
+    ballots = [{'selectedOptionId': x} for x in ['monkey'] * 6 + ['sheep'] * 5]
+    assert tally(create_vote({'tally': 'simdem-sainte-lague'}, ballots))[0] == {'optionId': 'monkey', 'seats': 2}
+
+    outcome = tally(create_vote({'tally': 'simdem-sainte-lague', 'positions': 2}, ballots))
+    assert outcome[:2] == [{'optionId': 'monkey', 'seats': 2}, {'optionId': 'sheep', 'seats': 1}]
+
+
+def test_spsv_stops_replacing_when_it_runs_out_of_candidates():
+    ballots = [{
+        'ratingPerOption': [
+            {'optionId': 'cow', 'rating': 1},
+            {'optionId': 'sheep', 'rating': 4},
+            {'optionId': 'monkey', 'rating': 3}
+        ]
+    }]
+    vote = create_vote({'max': 5, 'min': 0, 'positions': 7, 'tally': 'spsv'}, ballots, resigned=['cow'])
+    assert sorted(tally_individual(vote)) == ['cow', 'monkey', 'sheep']
+
+
+def test_spsv_is_proportional():
+    """Tests that SPSV's second seat goes to the faction that did not win the first."""
+    vote = create_rated_vote([[5, 5, 0]] * 3 + [[0, 0, 5]] * 2, 'spsv', 2)
+    assert tally_individual(vote) == ['option-0', 'option-2']
+    assert tally_individual(with_resignations(vote, ['option-0'])) == ['option-2', 'option-1']
+
+
+def test_star_elects_most_popular_candidate():
+    vote = create_rated_vote([[0, 1, 2, 5], [0, 4, 2, 2]], 'star', 1)
+    assert tally_individual(vote) == ['option-3']
+
+
+def test_star_gets_runoff_right():
+    vote = create_rated_vote([[0, 0, 2, 4], [0, 5, 2, 4], [0, 5, 2, 4]], 'star', 1)
+    assert tally_individual(vote) == ['option-1']
+
+    vote = create_rated_vote([[0, 2, 4, 0], [0, 2, 4, 5], [0, 2, 4, 5]], 'star', 1)
+    assert tally_individual(vote) == ['option-3']
+
+
+def test_star_breaks_first_round_tie():
+    vote = create_rated_vote([[0, 0, 4, 4], [1, 3, 4, 4], [1, 4, 2, 4], [0, 5, 2, 0]], 'star', 1)
+    assert tally_individual(vote) == ['option-3']
+
+
+def test_star_breaks_runoff_tie():
+    vote = create_rated_vote(
+        [[0, 0, 2, 2], [0, 5, 2, 4], [0, 4, 2, 4], [0, 5, 1, 4], [0, 3, 1, 5]], 'star', 1)
+    assert tally_individual(vote) == ['option-3']
+
+
+def test_star_generates_sensible_replacements():
+    vote = create_rated_vote([[1, 0, 2, 5]], 'star', 1)
+    [winner] = tally_individual(vote)
+    assert winner == 'option-3'
+    assert tally_individual(with_resignations(vote, [winner])) == ['option-2']
+
+
+def test_star_generates_consistent_replacements():
+    vote = create_rated_vote(
+        [[0, 0, 2, 2]] * 2 + [[0, 5, 2, 4], [0, 4, 2, 4], [0, 5, 1, 4]] + [[0, 3, 1, 5]] * 4, 'star', 1)
+
+    resigned = []
+    for expected_winner in tally_order(vote):
+        [winner] = tally_individual(with_resignations(vote, resigned))
+        assert winner == expected_winner
+        resigned.append(winner)
+
+
+def test_star_counts_options_added_later_as_minimal():
+    """Tests that options added after a ballot was cast are tallied with the minimal rating."""
+    vote = create_rated_vote([[0, 5], [0, 4]], 'star', 1)
+    vote['vote']['options'] = [*vote['vote']['options'], {'id': 'late', 'name': 'Late', 'description': ''}]
+    vote['optionTable'] = [*vote['optionTable'], 'late']
+    assert tally_order(vote) == ['option-1', 'option-0', 'late']
+
+
+STV_BALLOT_TYPE = {'positions': 1, 'tally': 'stv'}
+
+STV_BALLOTS = [
+    {'optionRanking': ['monkey', 'sheep', 'cow']},
+    {'optionRanking': ['sheep', 'monkey', 'cow']},
+    {'optionRanking': ['cow', 'sheep', 'monkey']},
+    {'optionRanking': ['sheep', 'monkey', 'cow']}
+]
+
+
+def test_stv_elects_clearest_winner():
+    assert tally_individual(create_vote(STV_BALLOT_TYPE, STV_BALLOTS[:1])) == ['monkey']
+
+
+def test_stv_elects_clear_winner():
+    assert tally_individual(create_vote(STV_BALLOT_TYPE, STV_BALLOTS[:1] * 3)) == ['monkey']
+
+
+def test_stv_eliminates_least_popular_candidate():
+    assert tally_individual(create_vote(STV_BALLOT_TYPE, STV_BALLOTS)) == ['sheep']
+
+
+def test_stv_elects_most_popular_candidates():
+    vote = create_vote({**STV_BALLOT_TYPE, 'positions': 2}, STV_BALLOTS)
+    assert tally_individual(vote) == ['sheep', 'monkey']
+
+
+def test_stv_appoints_replacement():
+    vote = create_vote(STV_BALLOT_TYPE, STV_BALLOTS, resigned=['sheep'])
+    assert tally_individual(vote) == ['monkey']
+
+
+def test_stv_appoints_second_replacement():
+    vote = create_vote(STV_BALLOT_TYPE, STV_BALLOTS, resigned=['sheep', 'monkey'])
+    assert tally_individual(vote) == ['cow']
+
+
+def test_live_tally_matches_recount():
+    """Tests that live tallies agree with a recount after random sequences of cast and replaced
+       ballots, interleaved with candidates being added and removed."""
+    rng = random.Random(42)
+    for algorithm in ['first-past-the-post', 'sainte-lague', 'simdem-sainte-lague', 'star']:
+        for _ in range(20):
+            ballot_type = {'tally': algorithm, 'positions': rng.randint(1, 3), 'min': 0, 'max': 5}
+            options = [{'id': f'option-{i}', 'name': '', 'description': ''} for i in range(rng.randint(2, 5))]
+            vote = create_vote(ballot_type, [], options, vote_id=f'vote-{rng.random()}')
+            live_tally = create_live_tally(vote)
+            next_option = len(options)
+
+            for _ in range(60):
+                action = rng.random()
+                if action < 0.1:
+                    # Add a new candidate or one that was removed earlier, the way VoteIndex.add_option does.
+                    current = {option['id'] for option in vote['vote']['options']}
+                    removed = [x for x in vote['optionTable'] if x not in current]
+                    if removed and rng.random() < 0.5:
+                        option = {'id': rng.choice(removed), 'name': '', 'description': ''}
+                    else:
+                        option = {'id': f'option-{next_option}', 'name': '', 'description': ''}
+                        next_option += 1
+                    vote['optionTable'] = vote['optionTable'] + [option['id']]
+                    vote['vote'] = {**vote['vote'], 'options': vote['vote']['options'] + [option]}
+                elif action < 0.15 and len(vote['vote']['options']) > 2:
+                    # Remove a candidate.
+                    removed = rng.choice(vote['vote']['options'])
+                    vote['vote'] = {**vote['vote'], 'options': [x for x in vote['vote']['options'] if x is not removed]}
+                else:
+                    # Cast a ballot, replacing an earlier ballot some of the time.
+                    ballot_id = f'ballot-{rng.randint(0, 15)}'
+                    option_ids = [option['id'] for option in vote['vote']['options']]
+                    if algorithm == 'star':
+                        ballot = {'ratingPerOption': [{'optionId': x, 'rating': rng.randint(0, 5)} for x in option_ids]}
+                    else:
+                        ballot = {'selectedOptionId': rng.choice(option_ids + ['write-in'])}
+
+                    ballot = compact_ballot({**ballot, 'id': ballot_id, 'timestamp': 0}, vote)
+                    replaced = vote['ballots'].pop(ballot_id, None)
+                    vote['ballots'][ballot_id] = ballot
+                    live_tally.cast(vote, ballot, replaced)
+
+                assert live_tally.get_outcome(vote) == tally(vote)
+                if algorithm == 'star':
+                    ratings = get_rating_matrix(vote)
+                    live_star = live_tally.get_tally(vote)
+                    assert live_star.scores == ratings.sum(axis=0).tolist()
+                    assert live_star.preferences == get_preference_matrix(ratings).tolist()
+                else:
+                    counts, ballot_count = get_choice_counts(vote)
+                    live_counts, live_ballot_count = live_tally.get_counts(vote)
+                    assert np.array_equal(live_counts, counts) and live_ballot_count == ballot_count
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import os
+import threading
+import time
+import pytest
+from ..persistence import votes as votes_module
+from ..persistence.commit import GroupCommitter
+from ..persistence.helpers import read_json, write_json
+from ..persistence.storage import \
+    JsonVoteStorage, get_summaries_path, vote_id_to_path, vote_id_to_journal_path, vote_id_to_results_path
+from ..persistence.votes import read_or_create_vote_index
+from ..tally.workers import TallyPool
+from .helpers import create_proposal, create_devices
+
+
+def test_ballots_survive_restart(index_path, devices, registered, votes):
+    """Tests that journaled ballots are replayed when the vote index is read back from disk."""
+    vote_id = votes.create_vote(create_proposal())['id']
+
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[1])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[0])
+    assert os.path.exists(vote_id_to_journal_path(index_path, vote_id))
+
+    votes.committer.flush()
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert reloaded.get_vote(vote_id, registered[0])['ownBallot']['selectedOptionId'] == 'b'
+    assert reloaded.get_vote(vote_id, registered[1])['ownBallot']['selectedOptionId'] == 'a'
+    assert 'ownBallot' not in reloaded.get_vote(vote_id, registered[2])
+
+
+def test_truncated_journal_record_is_dropped(index_path, devices, registered, votes):
+    """Tests that a journal record that was cut short by a crash does not corrupt the records
+       appended after a restart."""
+    vote_id = votes.create_vote(create_proposal())['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.committer.flush()
+    with open(vote_id_to_journal_path(index_path, vote_id), 'a') as f:
+        f.write('{"id":"torn","selectedOp')
+
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    reloaded.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[1])
+    reloaded.committer.flush()
+
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert [ballot['selectedOptionId'] for ballot in reloaded.votes[vote_id]['ballots'].values()] == ['a', 'b']
+
+
+def test_cancelled_vote_leaves_no_ballots(index_path, devices, registered, votes):
+    """Tests that a vote that reuses the ID of a cancelled vote does not inherit its ballots."""
+    vote_id = votes.create_vote(create_proposal())['id']
+    for device in registered:
+        votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, device)
+    assert votes.cancel_vote(vote_id)
+    votes.committer.flush()
+    assert not os.path.exists(vote_id_to_journal_path(index_path, vote_id))
+
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert reloaded.create_vote(create_proposal())['id'] == vote_id
+    reloaded.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[0])
+    reloaded.committer.flush()
+
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert [ballot['selectedOptionId'] for ballot in reloaded.votes[vote_id]['ballots'].values()] == ['b']
+
+
+def test_replaced_ballot_is_stored_once(index_path, registered, votes):
+    """Tests that a replaced ballot does not linger on disk or over the wire."""
+    vote_id = votes.create_vote(create_proposal())['id']
+
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[1])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[0])
+    votes.write_vote(votes.votes[vote_id])
+
+    votes.committer.flush()
+    vote = read_json(vote_id_to_path(index_path, vote_id))
+    assert [ballot['selectedOptionId'] for ballot in vote['ballots']] == ['a', 'b']
+    assert not os.path.exists(vote_id_to_journal_path(index_path, vote_id))
+
+
+def test_find_voter(index_path, devices, registered, votes):
+    """Tests that voters can be recovered from their ballots, both before and after a restart."""
+    vote_id = votes.create_vote(create_proposal())['id']
+
+    ballots = [votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, device) for device in registered[:2]]
+    assert [votes.find_voter(vote_id, ballot) for ballot in ballots] == ['user-0', 'user-1']
+
+    votes.committer.flush()
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert [reloaded.find_voter(vote_id, ballot) for ballot in ballots] == ['user-0', 'user-1']
+    assert reloaded.find_voter(vote_id, {'id': 'nonexistent'}) is None
+
+
+def test_shared_device_is_suspicious(devices, registered, votes):
+    """Tests that ballots cast by different users from the same device are reported."""
+    shared = devices.register('device-shared', 'user-shared', {'deviceId': 'device-shared', 'persistentId': 'p-0'})
+    vote_id = votes.create_vote(create_proposal())['id']
+
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[1])
+    assert votes.get_suspicious_ballots_report(vote_id) == []
+
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, shared)
+    report = votes.get_suspicious_ballots_report(vote_id)
+    assert len(report) == 1
+    assert report[0]['firstDevice']['user'] == 'user-shared'
+    assert report[0]['secondDevice']['user'] == 'user-0'
+
+    # A voter who logs in on another device after voting; then another user votes from it.
+    laptop = devices.register('device-laptop', 'user-1', {'deviceId': 'device-laptop', 'persistentId': 'p-laptop'})
+    borrowed = devices.register('device-borrowed', 'user-2', {'deviceId': 'device-borrowed', 'persistentId': 'p-laptop'})
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, borrowed)
+    report = votes.get_suspicious_ballots_report(vote_id)
+    assert len(report) == 2
+    assert report[1]['firstDevice']['user'] == 'user-2'
+    assert report[1]['secondDevice']['id'] == laptop.device_id
+
+
+def test_vote_closes_at_deadline(index_path, registered, clock, scheduler, votes):
+    """Tests that votes are closed and their secrets deleted once their deadline passes."""
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    assert votes.vote_secrets[vote_id]
+
+    clock.advance(120)
+    scheduler.run_due()
+    assert votes.vote_secrets[vote_id] == ''
+    votes.committer.flush()
+    assert read_json(index_path)[vote_id] == ''
+    assert not os.path.exists(vote_id_to_journal_path(index_path, vote_id))
+    assert len(votes.get_vote(vote_id, registered[0])['ballots']) == 1
+
+
+
+def test_vote_results(registered, clock, scheduler, votes):
+    """Tests that votes are tallied once their deadline has passed, but not before."""
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[1])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[2])
+    assert 'error' in votes.get_results(vote_id)
+
+    clock.advance(120)
+    scheduler.run_due()
+    assert votes.get_results(vote_id) == {'outcome': [{'optionId': 'b', 'seats': 1}]}
+
+
+def test_closed_vote_results_are_cached(index_path, devices, registered, clock, scheduler, votes, monkeypatch):
+    """Tests that a closed vote's results are cached and that they are recomputed only when a
+       candidate resigns."""
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[1])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[2])
+    clock.advance(120)
+    scheduler.run_due()
+
+    tallied = []
+    tally = votes_module.tally
+    monkeypatch.setattr(votes_module, 'tally', lambda vote: tallied.append(vote) or tally(vote))
+
+    # The live tally computed the results when the vote closed.
+    assert votes.get_results(vote_id) == {'outcome': [{'optionId': 'b', 'seats': 1}]}
+    assert votes.get_results(vote_id) == {'outcome': [{'optionId': 'b', 'seats': 1}]}
+    assert len(tallied) == 0
+
+    # Results survive a restart. Editing the description leaves them valid.
+    votes.committer.flush()
+    assert os.path.exists(vote_id_to_results_path(index_path, vote_id))
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices, scheduler=scheduler)
+    reloaded.edit_vote({**reloaded.votes[vote_id]['vote'], 'description': 'Edited.'}, registered[0])
+    assert reloaded.get_results(vote_id) == {'outcome': [{'optionId': 'b', 'seats': 1}]}
+    assert len(tallied) == 0
+
+    # A resignation invalidates them.
+    reloaded.mark_resignation(vote_id, 'b', registered[0])
+    assert reloaded.get_results(vote_id) == {'outcome': [{'optionId': 'a', 'seats': 1}]}
+    assert len(tallied) == 1
+
+
+def test_live_tally(index_path, devices, registered, clock, scheduler, votes, monkeypatch):
+    """Tests that open votes are tallied live and that their results are ready when they close."""
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[1])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[0])
+
+    live_tally = votes.get_live_tally(vote_id)
+    assert live_tally['standings'] == {'ballots': 2, 'counts': {'a': 0, 'b': 2}}
+    assert live_tally['outcome'] == [{'optionId': 'b', 'seats': 1}]
+
+    # Live tallies are rebuilt from the ballots on disk after a restart.
+    votes.committer.flush()
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices, scheduler=scheduler)
+    assert reloaded.get_live_tally(vote_id) == live_tally
+
+    monkeypatch.setattr(votes_module, 'tally', None)
+    clock.advance(120)
+    scheduler.run_due()
+    assert 'error' in reloaded.get_live_tally(vote_id)
+    assert reloaded.get_results(vote_id) == {'outcome': [{'optionId': 'b', 'seats': 1}]}
+
+
+def test_pooled_tally(data_dir, clock, scheduler):
+    """Tests that STV votes are tallied in the tally pool and that concurrent requests for their
+       results share a job."""
+    index_path = os.path.join(data_dir, 'vote-index.json')
+    registered, devices = create_devices(data_dir)
+    pool = TallyPool(1)
+    votes = read_or_create_vote_index(JsonVoteStorage(index_path), devices, tally_pool=pool, scheduler=scheduler)
+    proposal = {**create_proposal(deadline_offset=60), 'type': {'tally': 'stv', 'positions': 1}}
+    vote_id = votes.create_vote(proposal)['id']
+    votes.cast_ballot(vote_id, {'optionRanking': ['b', 'a']}, registered[0])
+    votes.cast_ballot(vote_id, {'optionRanking': ['b', 'a']}, registered[1])
+    votes.cast_ballot(vote_id, {'optionRanking': ['a', 'b']}, registered[2])
+    clock.advance(120)
+    scheduler.run_due()
+
+    try:
+        # Closing the vote submitted its tally; asking for the results does not submit it again.
+        votes.get_results(vote_id)
+        votes.get_results(vote_id)
+        [job_id] = pool.jobs
+        assert votes.get_tally_job('nonexistent') is None
+
+        for _ in range(300):
+            status = votes.get_tally_job(job_id)
+            if status['status'] == 'done':
+                break
+            time.sleep(0.1)
+
+        outcome = [{'optionId': 'b', 'seats': 1}]
+        assert status == {'jobId': job_id, 'status': 'done', 'outcome': outcome}
+        assert votes.get_results(vote_id) == {'outcome': outcome}
+        assert votes.results[vote_id] == (job_id, {'outcome': outcome})
+    finally:
+        pool.stop()
+
+
+def test_stream_closed_vote(data_dir, clock, scheduler, monkeypatch):
+    """Tests that streamed votes match the votes returned by `get_vote`, page by page."""
+    index_path = os.path.join(data_dir, 'vote-index.json')
+    registered, devices = create_devices(data_dir, user_count=5)
+    votes = read_or_create_vote_index(JsonVoteStorage(index_path), devices, scheduler=scheduler)
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+    for i, device in enumerate(registered):
+        votes.cast_ballot(vote_id, {'selectedOptionId': 'ab'[i % 2]}, device)
+    clock.advance(120)
+    scheduler.run_due()
+
+    monkeypatch.setattr(votes_module, 'BALLOT_STREAM_CHUNK_SIZE', 2)
+    vote = votes.get_vote(vote_id, registered[0])
+    assert len(vote['ballots']) == 5
+    assert json.loads(''.join(votes.stream_vote(vote_id, registered[0]))) == vote
+
+    for offset, limit in [(0, 2), (1, 3), (4, 10), (5, None), (0, 0)]:
+        page = json.loads(''.join(votes.stream_vote(vote_id, registered[0], offset, limit)))
+        expected = vote['ballots'][offset:] if limit is None else vote['ballots'][offset:offset + limit]
+        assert page == {'vote': vote['vote'], 'ballots': expected}
+
+
+def test_serialized_responses(registered, clock, scheduler, votes):
+    """Tests that cached serialized responses match the votes they were serialized from and that
+       they are dropped when those votes change."""
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+
+    def check(device):
+        assert json.loads(votes.get_serialized_vote(vote_id, device).data) == votes.get_vote(vote_id, device)
+        assert json.loads(votes.get_serialized_active_votes(device).data) == votes.get_active_votes(device)
+        assert json.loads(votes.get_serialized_all_votes().data) == votes.get_all_votes()
+
+    # Devices that did not vote share cached responses; voters get their own ballot spliced in.
+    check(registered[0])
+    check(registered[1])
+    assert votes.get_serialized_vote(vote_id, registered[1]) is votes.get_serialized_vote(vote_id, registered[2])
+    assert votes.get_serialized_active_votes(registered[1]) is votes.get_serialized_active_votes(registered[2])
+    assert 'ownBallot' in json.loads(votes.get_serialized_vote(vote_id, registered[0]).data)
+
+    # Changes to votes invalidate the responses that include them.
+    votes.add_option(vote_id, {'id': 'c', 'name': 'C', 'description': ''}, registered[0])
+    other_id = votes.create_vote(create_proposal('Other'))['id']
+    check(registered[0])
+    check(registered[1])
+    assert votes.cancel_vote(other_id)
+    check(registered[1])
+
+    clock.advance(120)
+    scheduler.run_due()
+    check(registered[1])
+    response = votes.get_serialized_vote(vote_id, registered[1])
+    assert len(json.loads(response.data)['ballots']) == 1
+    assert gzip.decompress(response.gzipped()) == response.data
+
+
+def test_etags(index_path, devices, registered, clock, scheduler, votes):
+    """Tests that entity tags change when votes change, and only then."""
+    vote_id = votes.create_vote(create_proposal(deadline_offset=60))['id']
+
+    def get_etags(device):
+        return votes.get_vote_etag(vote_id, device), votes.get_active_votes_etag(device), votes.get_all_votes_etag()
+
+    # Casting a ballot only changes the voter's entity tags.
+    before = get_etags(registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[1])
+    assert get_etags(registered[0]) == before
+    assert get_etags(registered[1])[:2] != before[:2]
+    assert get_etags(registered[1])[2] == before[2]
+
+    # Other changes are seen by all devices.
+    votes.add_option(vote_id, {'id': 'c', 'name': 'C', 'description': ''}, registered[0])
+    after_edit = get_etags(registered[0])
+    assert all(x != y for x, y in zip(before, after_edit))
+
+    clock.advance(120)
+    scheduler.run_due()
+    closed = get_etags(registered[1])
+    assert closed[0] == get_etags(registered[0])[0]
+    assert all(x != y for x, y in zip(after_edit, closed))
+
+    # Closed votes' entity tags are available without loading the vote, and are not reused after
+    # a restart.
+    votes.committer.flush()
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices, cache_budget=1, scheduler=scheduler)
+    etag = reloaded.get_vote_etag(vote_id, registered[0])
+    assert vote_id not in reloaded.votes
+    assert int(etag) > int(closed[0])
+    with pytest.raises(KeyError):
+        reloaded.get_vote_etag('nonexistent', registered[0])
+
+
+def test_active_vote_changes(registered, clock, scheduler, votes):
+    """Tests that clients that sync active votes are sent what changed since their last sync."""
+    closing_id = votes.create_vote(create_proposal('Closing', deadline_offset=60))['id']
+    edited_id = votes.create_vote(create_proposal('Edited'))['id']
+    unchanged_id = votes.create_vote(create_proposal('Unchanged'))['id']
+    cancelled_id = votes.create_vote(create_proposal('Cancelled'))['id']
+
+    # The first sync gets everything.
+    changes = votes.get_active_vote_changes(registered[0], 0)
+    assert changes['reset']
+    assert [vote['vote']['id'] for vote in changes['votes']] == [closing_id, edited_id, unchanged_id, cancelled_id]
+    version = changes['version']
+    unchanged = votes.get_active_vote_changes(registered[0], version)
+    assert unchanged['votes'] == [] and unchanged['closed'] == [] and unchanged['cancelled'] == []
+
+    votes.add_option(edited_id, {'id': 'c', 'name': 'C', 'description': ''}, registered[1])
+    votes.cast_ballot(unchanged_id, {'selectedOptionId': 'a'}, registered[1])
+    assert votes.cancel_vote(cancelled_id)
+    clock.advance(120)
+    scheduler.run_due()
+
+    # Ballots are only news to their voter.
+    changes = votes.get_active_vote_changes(registered[0], version)
+    assert not changes['reset']
+    assert [vote['vote']['id'] for vote in changes['votes']] == [edited_id]
+    assert changes['closed'] == [closing_id]
+    assert changes['cancelled'] == [cancelled_id]
+
+    own_changes = votes.get_active_vote_changes(registered[1], version)
+    assert [vote['vote']['id'] for vote in own_changes['votes']] == [edited_id, unchanged_id]
+    assert own_changes['votes'][1]['ownBallot']['selectedOptionId'] == 'a'
+
+    later = votes.get_active_vote_changes(registered[1], changes['version'])
+    assert later['votes'] == [] and later['closed'] == [] and later['cancelled'] == []
+
+
+def test_active_votes(registered, votes):
+    """Tests that active votes are listed by deadline and that cancelled votes drop out."""
+    late_id = votes.create_vote(create_proposal('Late', deadline_offset=300))['id']
+    early_id = votes.create_vote(create_proposal('Early', deadline_offset=200))['id']
+    cancelled_id = votes.create_vote(create_proposal('Cancelled', deadline_offset=100))['id']
+    assert votes.cancel_vote(cancelled_id)
+
+    active_votes = votes.get_active_votes(registered[0])
+    assert [vote['vote']['id'] for vote in active_votes] == [early_id, late_id]
+
+
+def test_closed_votes_load_lazily(index_path, devices, registered, clock, scheduler, votes):
+    """Tests that closed votes are read on first access and evicted when the cache is full."""
+    closed_ids = [votes.create_vote(create_proposal(f'Closed {i}', deadline_offset=60))['id'] for i in range(2)]
+    open_id = votes.create_vote(create_proposal('Open'))['id']
+    for vote_id in closed_ids:
+        votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    clock.advance(120)
+    scheduler.run_due()
+
+    votes.committer.flush()
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices, cache_budget=1, scheduler=scheduler)
+    assert [vote['id'] for vote in reloaded.get_all_votes()] == closed_ids + [open_id]
+    assert open_id in reloaded.votes
+    assert not any(vote_id in reloaded.votes for vote_id in closed_ids)
+
+    assert len(reloaded.get_vote(closed_ids[0], registered[0])['ballots']) == 1
+    assert closed_ids[0] in reloaded.votes
+    assert len(reloaded.get_vote(closed_ids[1], registered[0])['ballots']) == 1
+    assert closed_ids[0] not in reloaded.votes
+    assert open_id in reloaded.votes
+
+
+def test_concurrent_ballots(data_dir, monkeypatch):
+    """Stress tests casting ballots from many threads at once. No ballot may be lost or duplicated,
+       in memory or on disk, even as journals are being compacted."""
+    monkeypatch.setattr(votes_module, 'JOURNAL_COMPACTION_THRESHOLD', 10)
+    index_path = os.path.join(data_dir, 'vote-index.json')
+    registered, devices = create_devices(data_dir, user_count=40)
+    votes = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    vote_id = votes.create_vote(create_proposal())['id']
+    rounds = 25
+
+    def cast_ballots(device):
+        for i in range(rounds):
+            votes.cast_ballot(vote_id, {'selectedOptionId': 'ab'[i % 2]}, device)
+
+    threads = [threading.Thread(target=cast_ballots, args=(device,)) for device in registered]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expected_choice = 'ab'[(rounds - 1) % 2]
+    votes.committer.flush()
+    for index in [votes, read_or_create_vote_index(JsonVoteStorage(index_path), devices)]:
+        assert len(index.votes[vote_id]['ballots']) == len(registered)
+        for device in registered:
+            assert index.get_vote(vote_id, device)['ownBallot']['selectedOptionId'] == expected_choice
+
+
+def test_group_commit(data_dir):
+    """Tests that changes are coalesced into group commits, unless every change must be synced."""
+    index_path = os.path.join(data_dir, 'vote-index.json')
+    registered, devices = create_devices(data_dir)
+    votes = read_or_create_vote_index(JsonVoteStorage(index_path, GroupCommitter(interval=60)), devices)
+    first_id = votes.create_vote(create_proposal('First'))['id']
+    votes.create_vote(create_proposal('Second'))
+    summaries_path = get_summaries_path(index_path)
+    assert not os.path.exists(summaries_path)
+    assert votes.committer.metrics()['coalescedWrites'] > 0
+
+    # Creating and cancelling votes is written right away.
+    assert set(read_json(index_path).keys()) == {first_id, 'second'}
+    assert os.path.exists(vote_id_to_path(index_path, 'second'))
+    assert votes.cancel_vote('second')
+    assert set(read_json(index_path).keys()) == {first_id}
+
+    commits = votes.committer.metrics()['commits']
+    votes.committer.flush()
+    assert set(read_json(summaries_path).keys()) == {first_id}
+    assert votes.committer.metrics()['commits'] == commits + 1
+
+    synced = read_or_create_vote_index(JsonVoteStorage(index_path, GroupCommitter(fsync_policy='always')), devices)
+    synced.create_vote(create_proposal('Third'))
+    assert 'third' in read_json(index_path)
+
+
+def test_concurrent_writes_to_the_same_file(data_dir):
+    """Tests that overlapping writes of the same file do not interfere with each other."""
+    path = os.path.join(data_dir, 'vote-index.json')
+    errors = []
+
+    def write(n):
+        for i in range(200):
+            try:
+                write_json({'writer': n, 'write': i}, path)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert read_json(path)['write'] == 199
+    assert os.listdir(data_dir) == ['vote-index.json']
+
+
+def test_rate_options_ballots(index_path, devices, registered, votes):
+    """Tests that rate-options ballots are stored compactly but transmitted as a list of ratings,
+       also after candidates are added or removed."""
+    proposal = {**create_proposal(), 'type': {'tally': 'star', 'positions': 1, 'min': 0, 'max': 5}}
+    vote_id = votes.create_vote(proposal)['id']
+
+    ballot = votes.cast_ballot(vote_id, {'ratingPerOption': [{'optionId': 'b', 'rating': 4}]}, registered[0])
+    assert ballot['ratingPerOption'] == [{'optionId': 'a', 'rating': 0}, {'optionId': 'b', 'rating': 4}]
+    assert list(votes.votes[vote_id]['ballots'][ballot['id']]['ratings']) == [0, 4]
+    assert 'error' in votes.cast_ballot(vote_id, {'ratingPerOption': [{'optionId': 'a', 'rating': 0.5}]}, registered[1])
+
+    vote = votes.add_option(vote_id, {'id': 'c', 'name': 'C', 'description': ''}, registered[0])
+    votes.edit_vote({**vote, 'options': [option for option in vote['options'] if option['id'] != 'a']}, registered[0])
+    expected = [{'optionId': 'b', 'rating': 4}, {'optionId': 'c', 'rating': 0}]
+    assert votes.get_vote(vote_id, registered[0])['ownBallot']['ratingPerOption'] == expected
+
+    votes.committer.flush()
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert reloaded.get_vote(vote_id, registered[0])['ownBallot']['ratingPerOption'] == expected
+
+
+def test_malformed_ballots_are_rejected(index_path, devices, registered, votes):
+    """Tests that a ballot that does not fit its vote's type is neither stored nor journaled."""
+    proposal = {**create_proposal(), 'type': {'tally': 'star', 'positions': 1, 'min': 0, 'max': 5}}
+    vote_id = votes.create_vote(proposal)['id']
+    votes.cast_ballot(vote_id, {'ratingPerOption': [{'optionId': 'a', 'rating': 5}]}, registered[0])
+    votes.get_live_tally(vote_id)
+
+    assert 'error' in votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[1])
+    assert len(votes.votes[vote_id]['ballots']) == 1
+    assert votes.get_live_tally(vote_id)['standings']['ballots'] == 1
+
+    votes.committer.flush()
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert len(reloaded.votes[vote_id]['ballots']) == 1
+    assert reloaded.get_live_tally(vote_id) == votes.get_live_tally(vote_id)
+
+
+def test_option_edits_leave_ballots_alone(index_path, devices, registered, votes):
+    """Tests that candidate edits are journaled rather than rewriting the vote, and that ballots are
+       resolved against the current candidates when they are read."""
+    vote_id = votes.create_vote(create_proposal())['id']
+    ballot = votes.cast_ballot(vote_id, {'selectedOptionId': 'a'}, registered[0])
+    votes.cast_ballot(vote_id, {'selectedOptionId': 'b'}, registered[1])
+    votes.committer.flush()
+    snapshot = read_json(vote_id_to_path(index_path, vote_id))
+
+    # Remove candidate 'a', then add it back. The first ballot no longer counts.
+    vote = votes.get_vote(vote_id, registered[0])['vote']
+    vote = votes.edit_vote({**vote, 'options': [option for option in vote['options'] if option['id'] != 'a']}, registered[0])
+    votes.add_option(vote_id, {'id': 'a', 'name': 'A', 'description': ''}, registered[0])
+    assert 'ownBallot' not in votes.get_vote(vote_id, registered[0])
+    assert votes.votes[vote_id]['ballots'][ballot['id']] is not None
+
+    votes.committer.flush()
+    assert read_json(vote_id_to_path(index_path, vote_id)) == snapshot
+
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    assert [option['id'] for option in reloaded.get_vote(vote_id, registered[0])['vote']['options']] == ['b', 'a']
+    assert 'ownBallot' not in reloaded.get_vote(vote_id, registered[0])
+    assert reloaded.get_vote(vote_id, registered[1])['ownBallot']['selectedOptionId'] == 'b'
+
+
+def test_stale_journal_headers_are_ignored(index_path, devices, registered, votes):
+    """Tests that replaying a journal that was already compacted does not undo later edits."""
+    vote_id = votes.create_vote(create_proposal())['id']
+    votes.add_option(vote_id, {'id': 'c', 'name': 'C', 'description': ''}, registered[0])
+    journal = open(vote_id_to_journal_path(index_path, vote_id)).read()
+
+    # Compact the journal, then put it back as if the server crashed before deleting it.
+    votes.add_option(vote_id, {'id': 'd', 'name': 'D', 'description': ''}, registered[0])
+    votes.write_vote(votes.votes[vote_id])
+    votes.committer.flush()
+    with open(vote_id_to_journal_path(index_path, vote_id) + '.compacting', 'w') as compacting:
+        compacting.write(journal)
+
+    reloaded = read_or_create_vote_index(JsonVoteStorage(index_path), devices)
+    options = reloaded.get_vote(vote_id, registered[0])['vote']['options']
+    assert [option['id'] for option in options] == ['a', 'b', 'c', 'd']
@@ -80,6 +80,11 @@ export enum Permission {
      */
     ViewSuspiciousBallots = "election.view-suspicious-ballots",
 
+    /**
+     * The user can view the live tally of an open vote.
+     */
+    ViewLiveTally = "election.view-live-tally",
+
     /**
      * The user can view the list of all registered users.
      */